@@ -1,6 +1,8 @@
 import json
 import platform
+from dataclasses import asdict
 from datetime import datetime
+from pathlib import Path
 from typing import Any, cast, Literal
 import os
 from dotenv import load_dotenv
@@ -19,13 +21,25 @@ from anthropic.types.beta import (
     BetaToolUseBlockParam,
 )
 
+from computer_use_demo.context import ContextBudget
+from computer_use_demo.tools.metrics import API_REQUEST_SECONDS, API_TOKENS
+from computer_use_demo.tools.tracing import span
 from computer_use_demo.tools import (
     TOOL_GROUPS_BY_VERSION,
+    BashTool20250124,
+    EditTool20250124,
     ToolCollection,
     ToolResult,
     ToolVersion,
 )
 
+# Undo history of the editor, kept per session since tools are recreated every turn
+EDIT_HISTORY_DIR = Path(
+    os.getenv("EDIT_HISTORY_DIR", "~/.anthropic/edit_history")
+).expanduser()
+# Histories of sessions not used for this long are removed when the backend starts
+EDIT_HISTORY_MAX_AGE = float(os.getenv("EDIT_HISTORY_MAX_AGE") or 7 * 24 * 3600)  # seconds
+
 # Constants from loop.py
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
@@ -33,6 +47,9 @@ SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 * You can feel free to install Ubuntu applications with your bash tool. Use curl instead of wget.
 * To open firefox, please just click on the firefox icon.  Note, firefox-esr is what is installed on your system.
 * Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
+* For long-running bash commands such as builds or downloads, call your bash tool with `background: true` to start a job and get its id. You can keep using the computer meanwhile and check on the job with `job_action` set to `status`, `wait` (optionally with a `timeout` in seconds) or `kill`, or list all jobs with `job_action: list`. Restarting the shell doesn't stop jobs, they run until they finish, you kill them or the session ends.
+* To make several changes to one file, call str_replace_editor with `command: multi_edit` and `edits`, a list of objects with either `old_str` and `new_str` to replace text or `insert_line` and `new_str` to insert it. They are applied in order and the file is only written if all of them apply, and a single `undo_edit` reverts the whole batch.
+* To find code or text in a file or directory tree, call str_replace_editor with `command: search`, the file or directory as `path` and the text to find as `query`. It is faster than grep for repeated searches, ignores hidden files, and matches case-insensitively unless the query has uppercase letters.
 * When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_based_edit_tool or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
 * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
@@ -111,6 +128,34 @@ def _maybe_prepend_system_tool_result(result: ToolResult, result_text: str):
         result_text = f"<system>{result.system}</system>\n{result_text}"
     return result_text
 
+def _count_tokens(model: str, usage: Any):
+    for kind, tokens in (
+        ("input", usage.input_tokens),
+        ("output", usage.output_tokens),
+        ("cache_read", usage.cache_read_input_tokens),
+        ("cache_creation", usage.cache_creation_input_tokens),
+    ):
+        if tokens:
+            API_TOKENS.inc(tokens, model=model, kind=kind)
+
+def _history_to_messages(chat_history: list) -> list[BetaMessageParam]:
+    """Reconstruct the API messages from the chat messages saved in the DB."""
+    messages: list[BetaMessageParam] = []
+    for msg in chat_history:
+        role = msg.role
+        content_str = msg.content
+        
+        try:
+            content = json.loads(content_str)
+        except (json.JSONDecodeError, TypeError):
+            content = content_str
+            
+        if role == "tool":
+            messages.append({"role": "user", "content": content})
+        else:
+            messages.append({"role": role, "content": content})
+    return messages
+
 async def run_agent(session_id: str, input_text: str, chat_history: list):
     """
     Async generator that runs the agent loop.
@@ -129,30 +174,21 @@ async def run_agent(session_id: str, input_text: str, chat_history: list):
     tool_version: ToolVersion = "computer_use_20250124"
     tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
     tool_collection = ToolCollection(*tool_group.tools)
+    for tool in tool_collection.tools:
+        if isinstance(tool, EditTool20250124):
+            tool.persist_history(EDIT_HISTORY_DIR / Path(session_id).name)
+        elif isinstance(tool, BashTool20250124):
+            tool.keep_jobs(session_id)
     
     # 3. Prepare Messages
-    messages: list[BetaMessageParam] = []
-    
-    # Reconstruct history
-    for msg in chat_history:
-        role = msg.role
-        content_str = msg.content
-        
-        try:
-            content = json.loads(content_str)
-        except (json.JSONDecodeError, TypeError):
-            content = content_str
-            
-        if role == "tool":
-            messages.append({"role": "user", "content": content})
-        else:
-            messages.append({"role": role, "content": content})
+    messages = _history_to_messages(chat_history)
 
     # Append the new user message
     messages.append({"role": "user", "content": input_text})
     
     # 4. Sampling Loop
     max_tokens = 4096
+    model = "claude-sonnet-4-20250514"
     system = BetaTextBlockParam(
         type="text",
         text=SYSTEM_PROMPT
@@ -162,86 +198,101 @@ async def run_agent(session_id: str, input_text: str, chat_history: list):
     betas = [tool_group.beta_flag] if tool_group.beta_flag else []
     betas.append(PROMPT_CACHING_BETA_FLAG)
 
-    while True:
-        try:
-            # Call API
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model="claude-sonnet-4-20250514",
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-            )
+    # Older turns are compacted once the conversation nears the context window
+    context_budget = ContextBudget()
+
+    try:
+        while True:
+            context_budget.maybe_compact(messages)
+            try:
+                # Call API
+                with span("model", model=model), API_REQUEST_SECONDS.time(model=model):
+                    raw_response = client.beta.messages.with_raw_response.create(
+                        max_tokens=max_tokens,
+                        messages=messages,
+                        model=model,
+                        system=[system],
+                        tools=tool_collection.to_params(),
+                        betas=betas,
+                    )
             
-            response = raw_response.parse()
+                response = raw_response.parse()
+                context_budget.record_usage(response.usage, messages)
+                _count_tokens(model, response.usage)
             
-            # Add assistant response to messages
-            response_params = _response_to_params(response)
-            messages.append({
-                "role": "assistant",
-                "content": response_params,
-            })
+                # Add assistant response to messages
+                response_params = _response_to_params(response)
+                messages.append({
+                    "role": "assistant",
+                    "content": response_params,
+                })
             
-            # Serialize response params for DB saving
-            yield {
-                "type": "db_save",
-                "role": "assistant",
-                "content": json.dumps(response_params)
-            }
+                # Serialize response params for DB saving
+                yield {
+                    "type": "db_save",
+                    "role": "assistant",
+                    "content": json.dumps(response_params)
+                }
 
-            # Process content blocks
-            tool_result_content: list[BetaToolResultBlockParam] = []
+                # Process content blocks
+                tool_result_content: list[BetaToolResultBlockParam] = []
+                tool_calls: list[tuple[str, str, dict[str, Any]]] = []
             
-            for content_block in response_params:
-                # BetaContentBlockParam is a union of TypedDicts or objects.
-                # We cast to dict to safely access keys if it's a dict, or check isinstance.
-                # But response_params comes from _response_to_params which returns a list of BetaContentBlockParam
-                # which are TypedDicts (mostly).
+                for content_block in response_params:
+                    # BetaContentBlockParam is a union of TypedDicts or objects.
+                    # We cast to dict to safely access keys if it's a dict, or check isinstance.
+                    # But response_params comes from _response_to_params which returns a list of BetaContentBlockParam
+                    # which are TypedDicts (mostly).
                 
-                # Safe access via cast to dict
-                block_dict = cast(dict[str, Any], content_block)
-                block_type = block_dict.get("type")
+                    # Safe access via cast to dict
+                    block_dict = cast(dict[str, Any], content_block)
+                    block_type = block_dict.get("type")
 
-                if block_type == "text":
-                    text = block_dict.get("text", "")
-                    yield {"type": "text", "content": text}
-                elif block_type == "tool_use":
-                    name = block_dict.get("name")
-                    input_data = block_dict.get("input")
-                    tool_id = block_dict.get("id")
+                    if block_type == "text":
+                        text = block_dict.get("text", "")
+                        yield {"type": "text", "content": text}
+                    elif block_type == "tool_use":
+                        name = block_dict.get("name")
+                        input_data = block_dict.get("input")
+                        tool_id = block_dict.get("id")
                     
-                    if not name or not tool_id:
-                        continue
+                        if not name or not tool_id:
+                            continue
 
-                    yield {
-                        "type": "tool_use", 
-                        "name": name, 
-                        "input": input_data,
-                        "id": tool_id
-                    }
-                    
-                    # Execute Tool
-                    result = await tool_collection.run(
-                        name=name,
-                        tool_input=cast(dict[str, Any], input_data or {}),
-                    )
-                    
+                        yield {
+                            "type": "tool_use", 
+                            "name": name, 
+                            "input": input_data,
+                            "id": tool_id
+                        }
+                        tool_calls.append((tool_id, name, cast(dict[str, Any], input_data or {})))
+
+                # Execute Tools, independent calls run concurrently and results come back in order
+                results = []
+                if tool_calls:
+                    with span("tools", calls=len(tool_calls)):
+                        results = await tool_collection.run_all(
+                            [(name, tool_input) for _, name, tool_input in tool_calls]
+                        )
+
+                for (tool_id, _, _), result in zip(tool_calls, results):
                     api_tool_result = _make_api_tool_result(result, tool_id)
                     tool_result_content.append(api_tool_result)
-                    
+                
                     # Yield tool output
                     output_text = result.output if result.output else ""
                     if result.error:
                          output_text = f"Error: {result.error}\n{output_text}"
-                    
+                
                     yield {
                         "type": "tool_result",
                         "tool_use_id": tool_id,
                         "content": output_text,
-                        "is_error": bool(result.error)
+                        "is_error": bool(result.error),
+                        # Resource usage is for monitoring only, it is not sent to the model
+                        "usage": asdict(result.usage) if result.usage else None,
                     }
-                    
+                
                     if result.base64_image:
                          yield {
                              "type": "image",
@@ -249,25 +300,27 @@ async def run_agent(session_id: str, input_text: str, chat_history: list):
                              "data": result.base64_image
                          }
 
-            if not tool_result_content:
-                break
+                if not tool_result_content:
+                    break
             
-            # Append tool results to messages (Role: user)
-            messages.append({"content": tool_result_content, "role": "user"})
+                # Append tool results to messages (Role: user)
+                messages.append({"content": tool_result_content, "role": "user"})
             
-            # Serialize tool results for DB saving
-            yield {
-                "type": "db_save",
-                "role": "tool",
-                "content": json.dumps(tool_result_content)
-            }
+                # Serialize tool results for DB saving
+                yield {
+                    "type": "db_save",
+                    "role": "tool",
+                    "content": json.dumps(tool_result_content)
+                }
 
-        except (APIStatusError, APIResponseValidationError) as e:
-            yield {"type": "error", "content": f"API Error: {str(e)}"}
-            return
-        except APIError as e:
-            yield {"type": "error", "content": f"Anthropic Error: {str(e)}"}
-            return
-        except Exception as e:
-            yield {"type": "error", "content": f"Unexpected Error: {str(e)}"}
-            return
+            except (APIStatusError, APIResponseValidationError) as e:
+                yield {"type": "error", "content": f"API Error: {str(e)}"}
+                return
+            except APIError as e:
+                yield {"type": "error", "content": f"Anthropic Error: {str(e)}"}
+                return
+            except Exception as e:
+                yield {"type": "error", "content": f"Unexpected Error: {str(e)}"}
+                return
+    finally:
+        await tool_collection.close()
@@ -2,6 +2,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from uuid import UUID
 from typing import Sequence, Union
+from computer_use_demo.tools.metrics import DB_COMMIT_SECONDS
+from computer_use_demo.tools.tracing import span
+
 from . import models
 
 def _ensure_uuid(session_id: Union[str, UUID]) -> UUID:
@@ -28,7 +31,8 @@ def _ensure_uuid(session_id: Union[str, UUID]) -> UUID:
 async def create_session(db: AsyncSession) -> models.Session:
     db_session = models.Session()
     db.add(db_session)
-    await db.commit()
+    with DB_COMMIT_SECONDS.time(operation="create_session"):
+        await db.commit()
     await db.refresh(db_session)
     return db_session
 
@@ -47,8 +51,10 @@ async def create_message(db: AsyncSession, session_id: Union[str, UUID], role: s
     uuid_obj = _ensure_uuid(session_id)
     db_message = models.ChatMessage(session_id=uuid_obj, role=role, content=content)
     db.add(db_message)
-    await db.commit()
-    await db.refresh(db_message)
+    with span("db.create_message", role=role):
+        with DB_COMMIT_SECONDS.time(operation="create_message"):
+            await db.commit()
+        await db.refresh(db_message)
     return db_message
 
 async def get_chat_history(db: AsyncSession, session_id: Union[str, UUID]) -> Sequence[models.ChatMessage]:
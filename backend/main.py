@@ -1,24 +1,50 @@
 import traceback
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Sequence, Union
 from uuid import UUID
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
+import secrets
+
+from computer_use_demo.tools import close_bash_sessions, close_session_jobs
+from computer_use_demo.tools.history import remove_stale_histories
+from computer_use_demo.tools.metrics import (
+    ACTIVE_SESSIONS,
+    ACTIVE_WEBSOCKETS,
+    REGISTRY,
+)
+from computer_use_demo.profiling import PROFILER, Profiler, parse_kinds
+from computer_use_demo.tools.tracing import trace
+from computer_use_demo.tools.watchdog import LoopWatchdog
 
 from . import crud, schemas, models
 from .database import engine, Base, SessionLocal
-from .agent import run_agent
+from .agent import EDIT_HISTORY_DIR, EDIT_HISTORY_MAX_AGE, run_agent
+
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Create tables
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    # Drop the edit histories of sessions that haven't been used for a while
+    remove_stale_histories(EDIT_HISTORY_DIR, EDIT_HISTORY_MAX_AGE)
+    # Measure the lag of the event loop and log the stack of the code blocking it
+    watchdog = None
+    if REGISTRY.enabled or LoopWatchdog.threshold > 0:
+        watchdog = asyncio.create_task(LoopWatchdog().run())
     yield
     # Shutdown: Clean up resources if needed
+    if watchdog:
+        watchdog.cancel()
+    await close_bash_sessions()
     await engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
@@ -51,10 +77,44 @@ async def get_session_history(session_id: str, db: AsyncSession = Depends(get_db
         raise HTTPException(status_code=404, detail="Session not found")
     return await crud.get_chat_history(db, session_id) # type: ignore
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    files = sorted(Profiler.directory.glob("*")) if Profiler.directory.exists() else []
+    return {"armed": PROFILER.armed(), "files": [file.name for file in files]}
+
+@app.post("/admin/profile/{session_id}", dependencies=[Depends(require_admin)])
+async def arm_profile(session_id: str, kinds: str = "cpu,memory", turns: int = Query(default=1, ge=1)):
+    # Profile the next turns of a session, "*" arms every session
+    try:
+        PROFILER.arm(session_id, parse_kinds(kinds), turns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return {"armed": PROFILER.armed()}
+
+@app.delete("/admin/profile/{session_id}", dependencies=[Depends(require_admin)])
+async def disarm_profile(session_id: str):
+    PROFILER.disarm(session_id)
+    return {"armed": PROFILER.armed()}
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     await websocket.accept()
     print(f"WebSocket connected: {session_id}")
+    ACTIVE_WEBSOCKETS.inc()
     
     try:
         # Create a DB session for the websocket connection
@@ -99,25 +159,33 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 user_msg = await crud.create_message(db, session_id, "user", data)
                 # Append to local history so we don't need to re-fetch
                 history.append(user_msg)
+                turn = sum(message.role == "user" for message in history)
                 
                 # Run Agent
-                async for event in run_agent(session_id, data, history):
-                    if event["type"] == "db_save":
-                        # Internal event: Save Assistant/Tool response to DB
-                        role = event["role"]
-                        content = event["content"]
-                        saved_msg = await crud.create_message(db, session_id, role, content)
-                        # Append to local history
-                        history.append(saved_msg)
+                with ACTIVE_SESSIONS.track(), trace(session_id, turn=turn), PROFILER.profile(session_id, turn, history) as profiles:
+                    async for event in run_agent(session_id, data, history):
+                        if event["type"] == "db_save":
+                            # Internal event: Save Assistant/Tool response to DB
+                            role = event["role"]
+                            content = event["content"]
+                            saved_msg = await crud.create_message(db, session_id, role, content)
+                            # Append to local history
+                            history.append(saved_msg)
                     
-                    elif event["type"] == "error":
-                        # Send error to client and print
-                        print(f"Agent Error: {event['content']}")
-                        await websocket.send_json(event)
+                        elif event["type"] == "error":
+                            # Send error to client and print
+                            print(f"Agent Error: {event['content']}")
+                            await websocket.send_json(event)
                     
-                    else:
-                        # Forward other events (text, tool_use, tool_result, image) to UI
-                        await websocket.send_json(event)
+                        else:
+                            # Forward other events (text, tool_use, tool_result, image) to UI
+                            await websocket.send_json(event)
+
+                if profiles:
+                    logger.info("Profiled turn %s of %s: %s", turn, session_id, ", ".join(map(str, profiles)))
+
+                # Tell the client the agent finished responding to its message
+                await websocket.send_json({"type": "done"})
                         
     except WebSocketDisconnect:
         print(f"Client disconnected: {session_id}")
@@ -129,6 +197,10 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         except:
             # If connection is already closed, ignore
             pass
+    finally:
+        # jobs are kept across the turns of a session, not after it disconnects
+        await close_session_jobs(session_id)
+        ACTIVE_WEBSOCKETS.dec()
 
 # Frontend statik dosyalarını sun
 # "frontend" klasörünün proje ana dizininde olduğunu varsayıyoruz
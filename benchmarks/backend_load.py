@@ -0,0 +1,232 @@
+"""
+Load test of the backend: opens concurrent WebSocket sessions against `/ws/{session_id}`
+and drives scripted conversations through them, with the model played by the mock API
+of `benchmarks.mock_api`. The backend, the mock API and the clients run in this process
+on separate event loops, in a temporary directory with a fresh database, so that the
+backend's event-loop lag, database writes and memory can be measured.
+
+Run from the repository root with `python -m benchmarks.backend_load`, add `--xvfb` to
+give the computer tool a headless display, and `--output report.json` to write a report
+that can be compared with the reports of other commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Coroutine
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import uvicorn
+import websockets
+
+from benchmarks.common import git_commit, start_xvfb, summarize
+from benchmarks.mock_api import DEFAULT_SCRIPT, create_app
+
+TICK = 0.01
+
+
+@dataclass
+class Metrics:
+    time_to_first_event: list[float] = field(default_factory=list)
+    turn_latency: list[float] = field(default_factory=list)
+    db_writes: list[float] = field(default_factory=list)
+    loop_lag: list[float] = field(default_factory=list)
+    completed_turns: int = 0
+    errors: list[str] = field(default_factory=list)
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # the peak instead, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class _ServerThread(threading.Thread):
+    """A uvicorn server on its own event loop, listening on a free local port."""
+
+    def __init__(self, app: Any):
+        super().__init__(daemon=True)
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        self.loop.run_until_complete(self.server.serve(sockets=[self.socket]))
+
+    def start_and_wait(self):
+        self.start()
+        while not self.server.started:
+            time.sleep(TICK)
+
+    def submit(self, coroutine: Coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join()
+
+
+async def _monitor_lag(metrics: Metrics, stop: threading.Event):
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(TICK)
+        metrics.loop_lag.append((time.perf_counter() - started_at - TICK) * 1000)
+
+
+def _time_db_writes(crud: Any, metrics: Metrics):
+    create_message = crud.create_message
+
+    async def timed_create_message(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await create_message(*args, **kwargs)
+        finally:
+            metrics.db_writes.append((time.perf_counter() - started_at) * 1000)
+
+    crud.create_message = timed_create_message
+
+
+async def _run_session(
+    url: str, prompts: list[str], metrics: Metrics, turn_timeout: float
+):
+    async with websockets.connect(f"{url}/ws/{uuid.uuid4()}") as websocket:
+        for prompt in prompts:
+            sent_at = time.perf_counter()
+            await websocket.send(prompt)
+            first_event_at = None
+            while True:
+                event = json.loads(
+                    await asyncio.wait_for(websocket.recv(), turn_timeout)
+                )
+                if first_event_at is None:
+                    first_event_at = time.perf_counter()
+                    metrics.time_to_first_event.append(
+                        (first_event_at - sent_at) * 1000
+                    )
+                if event["type"] == "error":
+                    metrics.errors.append(event["content"])
+                elif event["type"] == "done":
+                    break
+            metrics.turn_latency.append((time.perf_counter() - sent_at) * 1000)
+            metrics.completed_turns += 1
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    script = json.loads(args.script.read_text()) if args.script else DEFAULT_SCRIPT
+    mock_api = _ServerThread(
+        create_app(
+            script,
+            latency=args.latency,
+            token_delay_ms=args.token_delay_ms,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        )
+    )
+    mock_api.start_and_wait()
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{mock_api.port}"
+    os.environ["ANTHROPIC_API_KEY"] = "mock"
+    # the computer tool can't be created without a screen size, even with no display
+    os.environ.setdefault("WIDTH", "1024")
+    os.environ.setdefault("HEIGHT", "768")
+
+    # imported here, once the environment points it at the temporary directory
+    from backend import crud
+    from backend.main import app
+
+    metrics = Metrics()
+    _time_db_writes(crud, metrics)
+    backend = _ServerThread(app)
+    backend.start_and_wait()
+    stop_monitor = threading.Event()
+    monitor = backend.submit(_monitor_lag(metrics, stop_monitor))
+
+    rss_before = _rss_mb()
+    prompts = [f"turn {i}" for i in range(args.turns)]
+    started_at = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            _run_session(
+                f"ws://127.0.0.1:{backend.port}", prompts, metrics, args.turn_timeout
+            )
+            for _ in range(args.sessions)
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started_at
+    rss_after = _rss_mb()
+
+    stop_monitor.set()
+    monitor.result()
+    backend.stop()
+    mock_api.stop()
+    metrics.errors.extend(repr(result) for result in results if result is not None)
+    return {
+        "commit": git_commit(),
+        "config": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+            if key != "output"
+        },
+        "elapsed_s": round(elapsed, 3),
+        "completed_turns": metrics.completed_turns,
+        "turns_per_s": round(metrics.completed_turns / elapsed, 3),
+        "errors": len(metrics.errors),
+        "first_errors": metrics.errors[:5],
+        "time_to_first_event_ms": summarize(metrics.time_to_first_event),
+        "turn_latency_ms": summarize(metrics.turn_latency),
+        "db_write_ms": summarize(metrics.db_writes),
+        "loop_lag_ms": summarize(metrics.loop_lag),
+        "memory_mb": {
+            "before": round(rss_before, 1),
+            "after": round(rss_after, 1),
+            "growth": round(rss_after - rss_before, 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3, help="user messages a session")
+    parser.add_argument("--script", type=Path, help="the script of the mock API")
+    parser.add_argument("--latency", default="lognormal:800,0.4")
+    parser.add_argument("--token-delay-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--turn-timeout", type=float, default=120)
+    parser.add_argument("--xvfb", action="store_true", help="start a headless display")
+    parser.add_argument("--display-num", type=int, default=99)
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args()
+    if args.output:
+        args.output = args.output.resolve()
+
+    xvfb = start_xvfb(args.display_num, 1024, 768) if args.xvfb else None
+    with tempfile.TemporaryDirectory() as directory:
+        # the database and the edit history of the backend start empty
+        os.chdir(directory)
+        os.environ["EDIT_HISTORY_DIR"] = str(Path(directory) / "edit_history")
+        try:
+            report = asyncio.run(main(args))
+        finally:
+            if xvfb:
+                xvfb.terminate()
+    print(json.dumps(report, indent=2))  # noqa: T201
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
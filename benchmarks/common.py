@@ -0,0 +1,59 @@
+"""
+Helpers shared by the benchmarks, apart from the load generator so that importing them
+doesn't need uvicorn or websockets.
+"""
+
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+def summarize(values: list[float]) -> dict[str, float | int]:
+    """The count and percentiles of timings in milliseconds."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p: float):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def git_commit() -> str | None:
+    """The commit checked out, to tell the reports of different commits apart."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_xvfb(display_num: int, width: int, height: int) -> subprocess.Popen:
+    """A headless display for the computer tool, set in the environment."""
+    if not shutil.which("Xvfb"):
+        sys.exit("Xvfb isn't installed")
+    xvfb = subprocess.Popen(
+        ["Xvfb", f":{display_num}", "-screen", "0", f"{width}x{height}x24"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    os.environ.update(
+        DISPLAY_NUM=str(display_num), WIDTH=str(width), HEIGHT=str(height)
+    )
+    return xvfb
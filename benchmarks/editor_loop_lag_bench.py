@@ -0,0 +1,93 @@
+"""
+Benchmark of the event-loop lag caused by editing a large file, with the editor's work
+run inline on the event loop (as it used to) and offloaded to its thread pool.
+
+Run from the repository root with `python -m benchmarks.editor_loop_lag_bench`.
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from computer_use_demo.tools.edit import EditTool20250124
+
+TICK = 0.001
+
+
+async def _monitor_lag(lags: list[float], stop: asyncio.Event):
+    """Record how late each tick of a 1ms timer fires."""
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - started_at - TICK) * 1000)
+
+
+async def _measure(
+    label: str, make_call: Callable[[int], Awaitable[object]], iterations: int
+):
+    lags: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_lag(lags, stop))
+    await asyncio.sleep(TICK)
+    started_at = time.perf_counter()
+    for i in range(iterations):
+        await make_call(i)
+    elapsed = (time.perf_counter() - started_at) * 1000
+    stop.set()
+    await monitor
+    p99 = statistics.quantiles(lags, n=100, method="inclusive")[-1]
+    print(  # noqa: T201
+        f"{label:<10} {elapsed / iterations:8.2f} ms/edit"
+        f"  loop lag p50 {statistics.median(lags):7.2f} ms"
+        f"  p99 {p99:7.2f} ms"
+        f"  max {max(lags):7.2f} ms"
+    )
+
+
+async def main(iterations: int, size_mb: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "large.txt"
+        line = "x" * 99 + "\n"
+        path.write_text(line * (size_mb * 2**20 // len(line)) + "marker 0\n")
+        tool = EditTool20250124()
+
+        def edit_inline(i: int):
+            return tool._run_command(
+                "str_replace",
+                path,
+                file_text=None,
+                view_range=None,
+                old_str=f"marker {i}\n",
+                new_str=f"marker {i + 1}\n",
+                insert_line=None,
+                edits=None,
+                query=None,
+            )
+
+        async def inline(i: int):
+            edit_inline(i)
+            # yield once, like an awaited tool call would
+            await asyncio.sleep(0)
+
+        async def offloaded(i: int):
+            await tool(
+                command="str_replace",
+                path=str(path),
+                old_str=f"marker {i + iterations}\n",
+                new_str=f"marker {i + iterations + 1}\n",
+            )
+
+        await _measure("inline", inline, iterations)
+        await _measure("offloaded", offloaded, iterations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.size_mb))
@@ -0,0 +1,407 @@
+"""
+Microbenchmarks of the hot paths of the tools and the sampling loop, compared with a
+baseline kept on this machine, so that a change that slows one of them down is
+flagged before it's merged.
+
+Run from the repository root with `python -m benchmarks.micro` before a change, with
+`--save` to store the results as the baseline, then again after it: benchmarks slower
+than their baseline by more than `--threshold` are flagged and the exit status is 1.
+Baselines are kept in `.benchmarks/micro.json`, outside of git since timings depend on
+the machine. `--filter` runs the benchmarks with a name containing the text given.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+from unittest import mock
+
+from anthropic.types.beta import (
+    BetaMessage,
+    BetaMessageParam,
+    BetaTextBlock,
+    BetaToolUseBlock,
+    BetaUsage,
+)
+from PIL import Image
+
+from benchmarks.common import git_commit
+from computer_use_demo.loop import (
+    ImageRetention,
+    _inject_prompt_caching,
+    _make_api_tool_result,
+    _response_to_params,
+)
+from computer_use_demo.tools import ResourceUsage, ToolResult, maybe_truncate
+from computer_use_demo.tools.computer import ComputerTool20250124, ScalingSource
+from computer_use_demo.tools.edit import EditTool20250124
+
+BASELINE_PATH = Path(".benchmarks/micro.json")
+DEFAULT_THRESHOLD = 0.2
+# the seconds each repeat runs for, at least
+MIN_TIME = 0.2
+REPEATS = 5
+# the turns of the synthetic conversations
+HISTORY_TURNS = 200
+LARGE_FILE_LINES = 100_000
+
+Setup = Callable[[Path], Callable[[], Any]]
+BENCHMARKS: dict[str, Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    """Register a setup, that takes a scratch directory and returns the call to time."""
+
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@dataclass
+class Result:
+    name: str
+    # calls timed in each repeat
+    number: int
+    # microseconds a call
+    best_us: float
+    median_us: float
+
+
+def _screenshot() -> str:
+    """A base64 PNG with the size and some of the detail of a screenshot."""
+    image = Image.effect_mandelbrot((1024, 768), (-2, -1.2, 1, 1.2), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _turn(i: int, image: str) -> list[BetaMessageParam]:
+    return [
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "text", "text": f"Step {i}, clicking the button."},
+                {
+                    "type": "tool_use",
+                    "id": f"toolu_{i}",
+                    "name": "computer",
+                    "input": {"action": "left_click", "coordinate": [i % 1024, 100]},
+                },
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"toolu_{i}",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/png",
+                                "data": image,
+                            },
+                        }
+                    ],
+                }
+            ],
+        },
+    ]
+
+
+def _history(n_turns: int, image: str) -> list[BetaMessageParam]:
+    messages: list[BetaMessageParam] = [{"role": "user", "content": "Do the task."}]
+    for i in range(n_turns):
+        messages.extend(_turn(i, image))
+    return messages
+
+
+@benchmark("ToolResult.__add__")
+def _tool_result_add(workdir: Path):
+    usage = ResourceUsage(wall_time=0.1, user_time=0.05, max_rss_kb=2048)
+    a = ToolResult(output="x" * 4000, error="warning\n", system="s", usage=usage)
+    b = ToolResult(output="y" * 4000, base64_image="aW1hZ2U=", usage=usage)
+    return lambda: a + b
+
+
+@benchmark("scale_coordinates")
+def _scale_coordinates(workdir: Path):
+    # the tool reads its screen size from the environment, don't leave it changed
+    with mock.patch.dict(os.environ, WIDTH="1920", HEIGHT="1080"):
+        tool = ComputerTool20250124()
+    return lambda: tool.scale_coordinates(ScalingSource.API, 683, 384)
+
+
+@benchmark("_response_to_params")
+def _response_to_params_bench(workdir: Path):
+    response = BetaMessage(
+        id="msg_1",
+        type="message",
+        role="assistant",
+        model="model",
+        content=[
+            BetaTextBlock(type="text", text="Let me open the browser. " * 20),
+            *(
+                BetaToolUseBlock(
+                    type="tool_use",
+                    id=f"toolu_{i}",
+                    name="computer",
+                    input={"action": "left_click", "coordinate": [i, i]},
+                )
+                for i in range(3)
+            ),
+        ],
+        stop_reason="tool_use",
+        stop_sequence=None,
+        usage=BetaUsage(input_tokens=1000, output_tokens=100),
+    )
+    return lambda: _response_to_params(response)
+
+
+@benchmark("_make_api_tool_result")
+def _make_api_tool_result_bench(workdir: Path):
+    result = ToolResult(output="x" * 10_000, base64_image=_screenshot(), system="s")
+    return lambda: _make_api_tool_result(result, "toolu_1")
+
+
+@benchmark(f"ImageRetention.track ({HISTORY_TURNS} turns)")
+def _image_retention_track(workdir: Path):
+    messages = _history(HISTORY_TURNS, _screenshot())
+    return lambda: ImageRetention().track(messages)
+
+
+def _image_retention_turns(thumbnails_to_keep: int) -> Setup:
+    def setup(workdir: Path):
+        image = _screenshot()
+        messages = _history(HISTORY_TURNS, image)
+        retention = ImageRetention()
+        turns = iter(range(HISTORY_TURNS, sys.maxsize))
+        # one event loop for every call, thumbnails are made in its default executor
+        runner = asyncio.Runner()
+
+        async def turns_of_a_chunk():
+            # images change tier in chunks of 3, every call does the same work
+            for _ in range(3):
+                messages.extend(_turn(next(turns), image))
+                retention.track(messages)
+                await retention.evict(
+                    3, min_removal_threshold=3, thumbnails_to_keep=thumbnails_to_keep
+                )
+
+        return lambda: runner.run(turns_of_a_chunk())
+
+    return setup
+
+
+benchmark(f"ImageRetention 3 turns ({HISTORY_TURNS} turns)")(_image_retention_turns(0))
+benchmark(f"ImageRetention 3 turns with thumbnails ({HISTORY_TURNS} turns)")(
+    _image_retention_turns(3)
+)
+
+
+@benchmark(f"_inject_prompt_caching ({HISTORY_TURNS} turns)")
+def _inject_prompt_caching_bench(workdir: Path):
+    messages = _history(HISTORY_TURNS, "aW1hZ2U=")
+    return lambda: _inject_prompt_caching(messages)
+
+
+def _large_file(workdir: Path) -> Path:
+    path = workdir / "large.py"
+    if not path.exists():
+        path.write_text(
+            "".join(
+                f"def function_{i}(value):\n    return value + {i}  # line {i}\n"
+                for i in range(LARGE_FILE_LINES // 2)
+            )
+        )
+    return path
+
+
+@benchmark(f"editor view ({LARGE_FILE_LINES} lines)")
+def _editor_view(workdir: Path):
+    path = _large_file(workdir)
+    editor = EditTool20250124()
+    return lambda: editor.view(path)
+
+
+@benchmark(f"editor view_range ({LARGE_FILE_LINES} lines)")
+def _editor_view_range(workdir: Path):
+    path = _large_file(workdir)
+    editor = EditTool20250124()
+    middle = LARGE_FILE_LINES // 2
+    return lambda: editor.view(path, [middle, middle + 50])
+
+
+@benchmark(f"editor str_replace ({LARGE_FILE_LINES} lines)")
+def _editor_str_replace(workdir: Path):
+    path = _large_file(workdir)
+    editor = EditTool20250124()
+    middle = LARGE_FILE_LINES // 4
+    replacements = [
+        (f"return value + {middle}  #", f"return value - {middle}  #"),
+        (f"return value - {middle}  #", f"return value + {middle}  #"),
+    ]
+    calls = iter(range(sys.maxsize))
+
+    def str_replace():
+        old, new = replacements[next(calls) % 2]
+        editor.str_replace(path, old, new)
+
+    return str_replace
+
+
+@benchmark("maybe_truncate (1 MB)")
+def _maybe_truncate(workdir: Path):
+    output = "0123456789abcdef\n" * (2**20 // 17)
+    return lambda: maybe_truncate(output)
+
+
+@benchmark(f"run_agent history reconstruction ({HISTORY_TURNS} turns)")
+def _history_to_messages(workdir: Path):
+    # imported here, the backend reads its environment when imported
+    from backend.agent import _history_to_messages
+
+    rows = [
+        SimpleNamespace(
+            role="tool" if message["role"] == "user" and i else message["role"],
+            content=json.dumps(message["content"]),
+        )
+        for i, message in enumerate(_history(HISTORY_TURNS, _screenshot()))
+    ]
+    return lambda: _history_to_messages(rows)
+
+
+def measure(
+    name: str, call: Callable[[], Any], min_time: float, repeats: int
+) -> Result:
+    # the first call may do one-off work, like filling caches
+    call()
+    timer = timeit.Timer(call)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time:
+        number *= 10 if elapsed < min_time / 10 else 2
+    per_call = [elapsed / number * 1e6 for elapsed in timer.repeat(repeats - 1, number)]
+    per_call.append(elapsed / number * 1e6)
+    return Result(name, number, min(per_call), statistics.median(per_call))
+
+
+def run(
+    names: list[str], min_time: float = MIN_TIME, repeats: int = REPEATS
+) -> list[Result]:
+    with tempfile.TemporaryDirectory() as directory:
+        return [
+            measure(name, BENCHMARKS[name](Path(directory)), min_time, repeats)
+            for name in names
+        ]
+
+
+def regressions(
+    results: list[Result], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """The benchmarks whose best time is slower than the baseline's by the threshold."""
+    best = {name: result["best_us"] for name, result in baseline["results"].items()}
+    return [
+        result.name
+        for result in results
+        if result.name in best and result.best_us > best[result.name] * (1 + threshold)
+    ]
+
+
+def report(results: list[Result], baseline: dict[str, Any] | None) -> list[str]:
+    best = (
+        {name: result["best_us"] for name, result in baseline["results"].items()}
+        if baseline
+        else {}
+    )
+    lines = [
+        f"{'benchmark':<56} {'best':>12} {'median':>12} {'baseline':>12} {'change':>8}"
+    ]
+    for result in results:
+        change = (
+            f"{result.best_us / best[result.name] - 1:>+8.1%}"
+            if result.name in best
+            else ""
+        )
+        lines.append(
+            f"{result.name:<56} {_format_us(result.best_us):>12} "
+            f"{_format_us(result.median_us):>12} "
+            f"{_format_us(best[result.name]) if result.name in best else '':>12} "
+            f"{change}"
+        )
+    return lines
+
+
+def _format_us(value: float) -> str:
+    if value >= 1000:
+        return f"{value / 1000:.2f} ms"
+    return f"{value:.2f} us"
+
+
+def main(args: argparse.Namespace) -> int:
+    names = [name for name in BENCHMARKS if args.filter.lower() in name.lower()]
+    results = run(names, args.min_time, args.repeats)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    print("\n".join(report(results, baseline)))  # noqa: T201
+
+    if args.save:
+        saved = baseline["results"] if baseline else {}
+        saved.update({result.name: asdict(result) for result in results})
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(
+            json.dumps(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": saved,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+        print(f"Saved the baseline to {args.baseline}")  # noqa: T201
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, save one with --save")  # noqa: T201
+        return 0
+    slower = regressions(results, baseline, args.threshold)
+    for name in slower:
+        print(  # noqa: T201
+            f"REGRESSION: {name} is more than {args.threshold:.0%} slower "
+            "than its baseline"
+        )
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--filter", default="", help="run the matching benchmarks")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="the slowdown flagged, 0.2 for 20%%",
+    )
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    sys.exit(main(parser.parse_args()))
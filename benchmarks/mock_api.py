@@ -0,0 +1,233 @@
+"""
+A local stand-in for the Messages API, to run the sampling loop and the backend under
+load without network jitter or API costs. Responses follow a script of turns, picked
+by the number of assistant messages in the request, with latencies drawn from a
+configurable distribution, and are streamed when the request asks for it.
+
+Run from the repository root with `python -m benchmarks.mock_api`, then point the
+clients of the backend and streamlit at it with the base URL switch of the SDK:
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8787 ANTHROPIC_API_KEY=mock ...
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+from typing import Any
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# the turns of the default script, then the final answer
+DEFAULT_SCRIPT: list[list[dict[str, Any]]] = [
+    [
+        {"type": "text", "text": "Let me take a screenshot to see the screen."},
+        {"type": "tool_use", "name": "computer", "input": {"action": "screenshot"}},
+    ],
+    [{"type": "tool_use", "name": "bash", "input": {"command": "echo hello"}}],
+]
+FINAL_TURN: list[dict[str, Any]] = [{"type": "text", "text": "Done."}]
+CHARS_PER_TOKEN = 4
+# the size of the text deltas of streamed responses
+STREAM_CHUNK_CHARS = 16
+
+Latency = Callable[[random.Random], float]
+
+
+def parse_latency(spec: str) -> Latency:
+    """
+    A latency distribution in milliseconds, as `fixed:MS`, `uniform:LOW,HIGH`,
+    `normal:MEAN,STDEV` or `lognormal:MEDIAN,SIGMA`, sampled in seconds.
+    """
+    kind, _, args = spec.partition(":")
+    try:
+        params = [float(arg) for arg in args.split(",")] if args else []
+    except ValueError:
+        raise ValueError(f"Invalid latency parameters: {spec}") from None
+    distributions: dict[str, tuple[int, Latency]] = {
+        "fixed": (1, lambda rng: params[0]),
+        "uniform": (2, lambda rng: rng.uniform(params[0], params[1])),
+        "normal": (2, lambda rng: rng.gauss(params[0], params[1])),
+        "lognormal": (
+            2,
+            lambda rng: params[0] * rng.lognormvariate(0, params[1]),
+        ),
+    }
+    if kind not in distributions or len(params) != distributions[kind][0]:
+        raise ValueError(
+            f"Invalid latency: {spec}. Use fixed:MS, uniform:LOW,HIGH, "
+            "normal:MEAN,STDEV or lognormal:MEDIAN,SIGMA"
+        )
+    sample = distributions[kind][1]
+    return lambda rng: max(sample(rng), 0) / 1000
+
+
+def _tokens(value: Any) -> int:
+    return max(1, len(json.dumps(value)) // CHARS_PER_TOKEN)
+
+
+def _turn(
+    script: list[list[dict[str, Any]]], request_id: int, messages: list[dict]
+) -> tuple[list[dict[str, Any]], str]:
+    """The content blocks and the stop reason of the next turn of a conversation."""
+    n_turn = sum(message.get("role") == "assistant" for message in messages)
+    if n_turn >= len(script):
+        return [dict(block) for block in FINAL_TURN], "end_turn"
+    content = []
+    for i, block in enumerate(script[n_turn]):
+        block = dict(block)
+        if block["type"] == "tool_use":
+            block["id"] = f"toolu_mock_{request_id}_{i}"
+        content.append(block)
+    has_tool_use = any(block["type"] == "tool_use" for block in content)
+    return content, "tool_use" if has_tool_use else "end_turn"
+
+
+def _sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream(message: dict[str, Any], token_delay: float) -> AsyncIterator[str]:
+    yield _sse(
+        "message_start",
+        {
+            "type": "message_start",
+            "message": {
+                **message,
+                "content": [],
+                "stop_reason": None,
+                "usage": {**message["usage"], "output_tokens": 1},
+            },
+        },
+    )
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            start = {"type": "text", "text": ""}
+            deltas = [
+                {
+                    "type": "text_delta",
+                    "text": block["text"][i : i + STREAM_CHUNK_CHARS],
+                }
+                for i in range(0, len(block["text"]), STREAM_CHUNK_CHARS)
+            ]
+        else:
+            start = {**block, "input": {}}
+            deltas = [
+                {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}
+            ]
+        yield _sse(
+            "content_block_start",
+            {"type": "content_block_start", "index": index, "content_block": start},
+        )
+        for delta in deltas:
+            await asyncio.sleep(token_delay)
+            yield _sse(
+                "content_block_delta",
+                {"type": "content_block_delta", "index": index, "delta": delta},
+            )
+        yield _sse("content_block_stop", {"type": "content_block_stop", "index": index})
+    yield _sse(
+        "message_delta",
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        },
+    )
+    yield _sse("message_stop", {"type": "message_stop"})
+
+
+def create_app(
+    script: list[list[dict[str, Any]]] = DEFAULT_SCRIPT,
+    latency: str = "fixed:0",
+    token_delay_ms: float = 0,
+    error_rate: float = 0,
+    seed: int = 0,
+) -> FastAPI:
+    """
+    The mock API. `latency` is the distribution of the time before a response starts,
+    see `parse_latency`, `token_delay_ms` the time between the deltas of a streamed
+    response and `error_rate` the share of requests answered with an overloaded error.
+    """
+    sample_latency = parse_latency(latency)
+    rng = random.Random(seed)
+    request_ids = itertools.count(1)
+    app = FastAPI()
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request):
+        body = await request.json()
+        request_id = next(request_ids)
+        await asyncio.sleep(sample_latency(rng))
+        headers = {"request-id": f"req_mock_{request_id}"}
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse(
+                {
+                    "type": "error",
+                    "error": {"type": "overloaded_error", "message": "Overloaded"},
+                },
+                status_code=529,
+                headers=headers,
+            )
+        content, stop_reason = _turn(script, request_id, body.get("messages", []))
+        message = {
+            "id": f"msg_mock_{request_id}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": _tokens(
+                    [body.get("system"), body.get("tools"), body.get("messages")]
+                ),
+                "output_tokens": _tokens(content),
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream(message, token_delay_ms / 1000),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+        return JSONResponse(message, headers=headers)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument(
+        "--script",
+        type=Path,
+        help="a JSON list of turns, each a list of text and tool_use content blocks",
+    )
+    parser.add_argument("--latency", default="fixed:0")
+    parser.add_argument("--token-delay-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(
+            json.loads(args.script.read_text()) if args.script else DEFAULT_SCRIPT,
+            latency=args.latency,
+            token_delay_ms=args.token_delay_ms,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ),
+        host=args.host,
+        port=args.port,
+    )
@@ -0,0 +1,239 @@
+"""
+Replay of the tool calls of a recorded session from the backend's `chat_messages`,
+without the model, to benchmark and regression-test the tools on real trajectories.
+Every `tool_use` input runs through `ToolCollection.run` in its recorded order, and the
+report has the latency of each kind of action split into its phases (xdotool, settle,
+screenshot, bash, edit) and how much each screenshot differs from the recorded one.
+
+The recorded commands and edits run for real, so replay in a disposable container. Run
+from the repository root with
+`python -m benchmarks.replay --db chat.db --session <session id>`, add `--xvfb` to
+replay the computer actions on a fresh headless display.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, get_args
+
+from PIL import Image, ImageChops
+
+from benchmarks.common import start_xvfb, summarize
+from computer_use_demo.tools import (
+    TOOL_GROUPS_BY_VERSION,
+    BashTool20250124,
+    EditTool20250124,
+    ToolCollection,
+    ToolVersion,
+)
+from computer_use_demo.tools.base import ToolFailure
+from computer_use_demo.tools.computer import BaseComputerTool
+
+# a pixel differs when any channel changed by more than this
+PIXEL_THRESHOLD = 16
+
+
+@dataclass(frozen=True)
+class RecordedCall:
+    name: str
+    tool_input: dict[str, Any]
+    # the screenshot the call returned when it was recorded, base64 encoded
+    image: str | None = None
+
+
+@dataclass
+class ReplayedCall:
+    label: str
+    # milliseconds spent in each phase of the call
+    phases: dict[str, float] = field(default_factory=dict)
+    total: float = 0.0
+    error: str | None = None
+    frame_diff: dict[str, float] | None = None
+
+
+def load_calls(db: Path, session_id: str) -> list[RecordedCall]:
+    """The tool calls of a session, with the screenshots they returned."""
+    with sqlite3.connect(db) as connection:
+        rows = connection.execute(
+            "SELECT role, content FROM chat_messages WHERE session_id = ? "
+            "ORDER BY timestamp, id",
+            # the UUID column is stored as 32 hex digits
+            (uuid.UUID(session_id).hex,),
+        ).fetchall()
+    calls: dict[str, tuple[str, dict[str, Any]]] = {}
+    images: dict[str, str] = {}
+    for role, content in rows:
+        try:
+            blocks = json.loads(content)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(blocks, list):
+            continue
+        for block in blocks:
+            if role == "assistant" and block.get("type") == "tool_use":
+                calls[block["id"]] = (block["name"], block.get("input") or {})
+            elif role == "tool" and block.get("type") == "tool_result":
+                for item in block.get("content") or []:
+                    if isinstance(item, dict) and item.get("type") == "image":
+                        images[block["tool_use_id"]] = item["source"]["data"]
+    return [
+        RecordedCall(name, tool_input, images.get(tool_use_id))
+        for tool_use_id, (name, tool_input) in calls.items()
+    ]
+
+
+def frame_diff(recorded: str, replayed: str) -> dict[str, float]:
+    """The share of pixels that changed between two base64 screenshots."""
+    with (
+        Image.open(io.BytesIO(base64.b64decode(recorded))) as a,
+        Image.open(io.BytesIO(base64.b64decode(replayed))) as b,
+    ):
+        a = a.convert("RGB")
+        b = b.convert("RGB").resize(a.size)
+    difference = ImageChops.difference(a, b).convert("L")
+    histogram = difference.histogram()
+    n_pixels = a.size[0] * a.size[1]
+    return {
+        "changed_pixels": round(sum(histogram[PIXEL_THRESHOLD + 1 :]) / n_pixels, 4),
+        "mean_difference": round(
+            sum(value * count for value, count in enumerate(histogram)) / n_pixels, 3
+        ),
+    }
+
+
+class Replayer:
+    """
+    Runs recorded calls through a tool collection, timing the settle delay and the
+    screenshots of the computer tools apart from the xdotool commands.
+    """
+
+    def __init__(self, tool_collection: ToolCollection, settle: float | None = None):
+        self.tool_collection = tool_collection
+        self._phases: dict[str, float] | None = None
+        for tool in tool_collection.tools:
+            if isinstance(tool, BaseComputerTool):
+                if settle is not None:
+                    tool._screenshot_delay = settle
+                tool.settle = self._timed("settle", tool.settle)
+                tool.screenshot = self._timed("screenshot", tool.screenshot)
+
+    def _timed(self, phase: str, method):
+        async def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                if self._phases is not None:
+                    self._phases[phase] += (time.perf_counter() - started_at) * 1000
+
+        return timed
+
+    def _label(self, call: RecordedCall) -> tuple[str, str]:
+        tool = self.tool_collection.tool_map.get(call.name)
+        if isinstance(tool, BaseComputerTool):
+            return f"{call.name}.{call.tool_input.get('action')}", "xdotool"
+        if isinstance(tool, BashTool20250124):
+            return call.name, "bash"
+        if isinstance(tool, EditTool20250124):
+            return f"{call.name}.{call.tool_input.get('command')}", "edit"
+        return call.name, call.name
+
+    async def replay(self, calls: list[RecordedCall]) -> list[ReplayedCall]:
+        replayed = []
+        for call in calls:
+            label, own_phase = self._label(call)
+            self._phases = defaultdict(float)
+            started_at = time.perf_counter()
+            try:
+                result = await self.tool_collection.run(
+                    name=call.name, tool_input=call.tool_input
+                )
+            except Exception as e:
+                result = ToolFailure(error=f"{type(e).__name__}: {e}")
+            total = (time.perf_counter() - started_at) * 1000
+            phases = dict(self._phases)
+            self._phases = None
+            # the time not spent settling or in screenshots is the tool's own
+            phases[own_phase] = max(0.0, total - sum(phases.values()))
+            replayed.append(
+                ReplayedCall(
+                    label,
+                    phases,
+                    total,
+                    result.error or None,
+                    frame_diff(call.image, result.base64_image)
+                    if call.image and result.base64_image
+                    else None,
+                )
+            )
+        return replayed
+
+
+def report(replayed: list[ReplayedCall]) -> dict[str, Any]:
+    by_label: defaultdict[str, list[float]] = defaultdict(list)
+    by_phase: defaultdict[str, list[float]] = defaultdict(list)
+    for call in replayed:
+        by_label[call.label].append(call.total)
+        for phase, elapsed in call.phases.items():
+            if elapsed:
+                by_phase[phase].append(elapsed)
+    diffs = [call.frame_diff for call in replayed if call.frame_diff]
+    return {
+        "calls": len(replayed),
+        "errors": sum(call.error is not None for call in replayed),
+        "latency_ms": {label: summarize(values) for label, values in by_label.items()},
+        "phase_ms": {phase: summarize(values) for phase, values in by_phase.items()},
+        "changed_pixels": summarize([diff["changed_pixels"] for diff in diffs]),
+        "frames": [
+            {
+                "label": call.label,
+                "total_ms": round(call.total, 3),
+                "error": call.error,
+                "frame_diff": call.frame_diff,
+            }
+            for call in replayed
+        ],
+    }
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    calls = load_calls(args.db, args.session)
+    tool_group = TOOL_GROUPS_BY_VERSION[args.tool_version]
+    replayer = Replayer(ToolCollection(*tool_group.tools), settle=args.settle)
+    return report(await replayer.replay(calls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--db", type=Path, default=Path("chat.db"))
+    parser.add_argument("--session", required=True, help="the id of the session")
+    parser.add_argument(
+        "--tool-version", default="computer_use_20250124", choices=get_args(ToolVersion)
+    )
+    parser.add_argument(
+        "--settle", type=float, help="seconds to wait before screenshots"
+    )
+    parser.add_argument("--xvfb", action="store_true", help="start a headless display")
+    parser.add_argument("--display-num", type=int, default=99)
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args()
+
+    xvfb = start_xvfb(args.display_num, 1024, 768) if args.xvfb else None
+    try:
+        result = asyncio.run(main(args))
+    finally:
+        if xvfb:
+            xvfb.terminate()
+    print(json.dumps(result, indent=2))  # noqa: T201
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
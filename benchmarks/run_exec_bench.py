@@ -0,0 +1,61 @@
+"""
+Microbenchmark comparing `run()` (through `/bin/sh`) with the shell-free `run_exec()`.
+
+Run from the repository root with `python -m benchmarks.run_exec_bench`.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable
+
+from computer_use_demo.tools.run import run, run_exec
+
+
+async def _time(
+    label: str, make_call: Callable[[], Awaitable[object]], iterations: int
+):
+    tracemalloc.start()
+    timings = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        await make_call()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(  # noqa: T201
+        f"{label:<32} median {statistics.median(timings):8.2f} ms"
+        f"  p95 {statistics.quantiles(timings, n=20)[-1]:8.2f} ms"
+        f"  peak alloc {peak / 2**20:7.2f} MB"
+    )
+
+
+async def main(iterations: int):
+    # an external binary, like the xdotool calls of the computer tool
+    await _time("run('/bin/echo hi')", lambda: run("/bin/echo hi"), iterations)
+    await _time(
+        "run_exec(['/bin/echo', 'hi'])",
+        lambda: run_exec(["/bin/echo", "hi"]),
+        iterations,
+    )
+
+    # a command with far more output than fits in a tool result
+    large_output = ["seq", "1", "2000000"]
+    await _time(
+        "run('seq 1 2000000')",
+        lambda: run(" ".join(large_output)),
+        max(1, iterations // 10),
+    )
+    await _time(
+        "run_exec(['seq', '1', '2000000'])",
+        lambda: run_exec(large_output),
+        max(1, iterations // 10),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    asyncio.run(main(parser.parse_args().iterations))
@@ -0,0 +1,180 @@
+"""
+Breakdown of the traces written under TRACE_DIR by `computer_use_demo.tools.tracing`:
+a tree of where the time of the turns went, summed over every turn of the traces
+given, and the spans with the most time of their own, the time not spent in the spans
+they contain. Concurrent tool calls overlap, so their times can sum to more than the
+span that contains them.
+
+Run from the repository root with `python -m benchmarks.trace_report traces/`, add
+`--folded` to print folded stacks for flamegraph.pl or speedscope instead.
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from benchmarks.common import summarize
+
+
+@dataclass
+class Node:
+    """The spans of every trace with the same path from the root."""
+
+    name: str
+    durations: list[float] = field(default_factory=list)
+    self_ms: float = 0.0
+    children: dict[str, "Node"] = field(default_factory=dict)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.durations)
+
+    def child(self, name: str) -> "Node":
+        if name not in self.children:
+            self.children[name] = Node(name)
+        return self.children[name]
+
+
+def load_spans(paths: list[Path]) -> dict[str, list[dict[str, Any]]]:
+    """The spans of the trace files and directories of trace files, by trace."""
+    files = [
+        file
+        for path in paths
+        for file in (sorted(path.glob("*.jsonl")) if path.is_dir() else [path])
+    ]
+    traces: defaultdict[str, list[dict[str, Any]]] = defaultdict(list)
+    for file in files:
+        for line in file.read_text().splitlines():
+            if line.strip():
+                record = json.loads(line)
+                traces[record["trace"]].append(record)
+    return traces
+
+
+def label(record: dict[str, Any]) -> str:
+    action = record["attributes"].get("action")
+    return f"{record['name']}.{action}" if action else record["name"]
+
+
+def _add(
+    record: dict[str, Any],
+    parent: Node,
+    children: dict[int | None, list[dict[str, Any]]],
+):
+    node = parent.child(label(record))
+    node.durations.append(record["duration_ms"])
+    own = children.get(record["span"], [])
+    node.self_ms += max(
+        0.0, record["duration_ms"] - sum(child["duration_ms"] for child in own)
+    )
+    for child in own:
+        _add(child, node, children)
+
+
+def build_tree(traces: dict[str, list[dict[str, Any]]]) -> Node:
+    root = Node("all")
+    for records in traces.values():
+        children: defaultdict[int | None, list[dict[str, Any]]] = defaultdict(list)
+        for record in records:
+            children[record["parent"]].append(record)
+        for record in children[None]:
+            _add(record, root, children)
+    return root
+
+
+def render_tree(root: Node, min_share: float = 0.001) -> list[str]:
+    total = sum(node.total_ms for node in root.children.values()) or 1
+    lines = [f"{'span':<48} {'total ms':>12} {'share':>7} {'self ms':>12} {'count':>6}"]
+
+    def render(node: Node, depth: int):
+        if node.total_ms / total < min_share:
+            return
+        lines.append(
+            f"{'  ' * depth + node.name:<48} {node.total_ms:>12.1f} "
+            f"{node.total_ms / total:>7.1%} {node.self_ms:>12.1f} "
+            f"{len(node.durations):>6}"
+        )
+        for child in sorted(node.children.values(), key=lambda n: -n.total_ms):
+            render(child, depth + 1)
+
+    for node in sorted(root.children.values(), key=lambda n: -n.total_ms):
+        render(node, 0)
+    return lines
+
+
+def folded(root: Node) -> list[str]:
+    """The self time of each path in whole microseconds, as `a;b;c 1234`."""
+    lines = []
+
+    def fold(node: Node, stack: list[str]):
+        stack = [*stack, node.name]
+        if node.self_ms >= 0.001:
+            lines.append(f"{';'.join(stack)} {round(node.self_ms * 1000)}")
+        for child in node.children.values():
+            fold(child, stack)
+
+    for node in root.children.values():
+        fold(node, [])
+    return lines
+
+
+def top_sinks(
+    traces: dict[str, list[dict[str, Any]]], limit: int = 10
+) -> list[dict[str, Any]]:
+    """The spans with the most time of their own over every trace, by label."""
+    self_ms: defaultdict[str, list[float]] = defaultdict(list)
+    for records in traces.values():
+        child_ms: defaultdict[int, float] = defaultdict(float)
+        for record in records:
+            if record["parent"] is not None:
+                child_ms[record["parent"]] += record["duration_ms"]
+        for record in records:
+            self_ms[label(record)].append(
+                max(0.0, record["duration_ms"] - child_ms[record["span"]])
+            )
+    total = sum(sum(values) for values in self_ms.values()) or 1
+    sinks = sorted(self_ms.items(), key=lambda item: -sum(item[1]))[:limit]
+    return [
+        {
+            "span": name,
+            "self_ms": round(sum(values), 3),
+            "share": round(sum(values) / total, 4),
+            **summarize(values),
+        }
+        for name, values in sinks
+    ]
+
+
+def report(traces: dict[str, list[dict[str, Any]]], limit: int = 10) -> list[str]:
+    sessions = {records[0]["session"] for records in traces.values() if records}
+    lines = [f"{len(traces)} turns in {len(sessions)} sessions", ""]
+    lines.extend(render_tree(build_tree(traces)))
+    lines.extend(["", f"Top {limit} time sinks by self time:"])
+    lines.append(
+        f"{'span':<40} {'self ms':>12} {'share':>7} {'count':>6} {'p50':>9} {'p90':>9}"
+    )
+    for sink in top_sinks(traces, limit):
+        lines.append(
+            f"{sink['span']:<40} {sink['self_ms']:>12.1f} {sink['share']:>7.1%} "
+            f"{sink['count']:>6} {sink['p50']:>9.1f} {sink['p90']:>9.1f}"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "paths", nargs="+", type=Path, help="trace files or directories of them"
+    )
+    parser.add_argument("--top", type=int, default=10, help="the time sinks to list")
+    parser.add_argument("--folded", action="store_true", help="print folded stacks")
+    args = parser.parse_args()
+
+    traces = load_spans(args.paths)
+    lines = folded(build_tree(traces)) if args.folded else report(traces, args.top)
+    print("\n".join(lines))  # noqa: T201
@@ -0,0 +1,253 @@
+"""
+Input token estimates of a conversation, and compaction of its older turns when it
+grows past a share of the context window.
+"""
+
+import base64
+import io
+import json
+import os
+from collections.abc import Iterable
+from typing import Any, cast
+
+from anthropic.types.beta import (
+    BetaImageBlockParam,
+    BetaMessageParam,
+    BetaTextBlockParam,
+    BetaUsage,
+)
+from PIL import Image
+
+# a rough average for English text and code
+CHARS_PER_TOKEN = 4
+# counted for every message and block on top of their content
+_MESSAGE_OVERHEAD = 4
+ELIDED_OUTPUT_CHARS = 200
+ELIDED_OUTPUT_MARKER = "[output elided to save context]"
+SUMMARY_LINE_CHARS = 120
+
+
+def decode_image(image: BetaImageBlockParam) -> bytes | None:
+    """The bytes of a base64 image block, or None for other sources."""
+    source = image.get("source")
+    if not isinstance(source, dict) or source.get("type") != "base64":
+        return None
+    try:
+        return base64.b64decode(cast(str, source["data"]), validate=True)
+    except (KeyError, ValueError):
+        return None
+
+
+def image_tokens(size: tuple[int, int]) -> int:
+    """The approximate number of input tokens an image of `size` takes."""
+    return size[0] * size[1] // 750
+
+
+def estimate_image_tokens(image: BetaImageBlockParam) -> int:
+    """The input tokens of an image block from its resolution, 0 if it can't be read."""
+    data = decode_image(image)
+    if data is None:
+        return 0
+    try:
+        # only the header is read to get the size
+        with Image.open(io.BytesIO(data)) as opened:
+            return image_tokens(opened.size)
+    except (OSError, ValueError):
+        return 0
+
+
+def _text_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def estimate_block_tokens(block: Any) -> int:
+    if isinstance(block, str):
+        return _text_tokens(block)
+    if not isinstance(block, dict):
+        return 0
+    block_type = block.get("type")
+    if block_type == "image":
+        return _MESSAGE_OVERHEAD + estimate_image_tokens(
+            cast(BetaImageBlockParam, block)
+        )
+    if block_type == "tool_result":
+        content = block.get("content", [])
+        return _MESSAGE_OVERHEAD + sum(
+            map(
+                estimate_block_tokens,
+                [content] if isinstance(content, str) else content,
+            )
+        )
+    if block_type == "tool_use":
+        return _MESSAGE_OVERHEAD + _text_tokens(
+            block.get("name", "") + json.dumps(block.get("input", {}))
+        )
+    return _MESSAGE_OVERHEAD + sum(
+        _text_tokens(block[key])
+        for key in ("text", "thinking", "data")
+        if isinstance(block.get(key), str)
+    )
+
+
+def estimate_message_tokens(message: BetaMessageParam) -> int:
+    """The approximate input tokens of a message, images included by resolution."""
+    content = message["content"]
+    if isinstance(content, str):
+        return _MESSAGE_OVERHEAD + _text_tokens(content)
+    return _MESSAGE_OVERHEAD + sum(map(estimate_block_tokens, content))
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _text_of(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "\n".join(
+        block["text"]
+        for block in content
+        if isinstance(block, dict) and isinstance(block.get("text"), str)
+    )
+
+
+def _summary_lines(messages: Iterable[BetaMessageParam]) -> list[str]:
+    lines = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [BetaTextBlockParam(type="text", text=content)]
+        for block in content:
+            if not isinstance(block, dict):
+                continue
+            if block.get("type") == "text" and block.get("text"):
+                lines.append(
+                    f"- {message['role']}: {_clip(block['text'], SUMMARY_LINE_CHARS)}"
+                )
+            elif block.get("type") == "tool_use":
+                call = f"{block.get('name')} {json.dumps(block.get('input', {}))}"
+                lines.append(f"- called {_clip(call, SUMMARY_LINE_CHARS)}")
+            elif block.get("type") == "tool_result":
+                result = _text_of(block.get("content", []))
+                lines.append(
+                    f"  {'failed' if block.get('is_error') else 'returned'}: "
+                    f"{_clip(result, SUMMARY_LINE_CHARS) or '(no text)'}"
+                )
+    return lines
+
+
+class ContextBudget:
+    """
+    Keeps the input of every request under `compact_at` of the context window. The
+    size of a conversation is the input tokens the API reported for its last request
+    plus estimates of the messages appended since. Past the threshold, the outputs of
+    older tool calls are elided and then the oldest turns are replaced with a summary,
+    down to `compact_to` of the window so that the prompt cache is broken rarely. The
+    first message, the system prompt and the tools, the cached prefix, are kept.
+    """
+
+    context_window = int(os.getenv("CONTEXT_WINDOW_TOKENS") or 200_000)
+    compact_at = float(os.getenv("CONTEXT_COMPACT_AT") or 0.8)
+    compact_to = float(os.getenv("CONTEXT_COMPACT_TO") or 0.5)
+    # the most recent messages are never compacted
+    keep_recent_messages = 6
+
+    def __init__(self):
+        # the input tokens of the last request and the number of messages it sent
+        self._reported: tuple[int, int] | None = None
+        # the tokens of the system prompt and tools, learned from the first usage
+        self._overhead: int | None = None
+        self.last_input_tokens = 0
+        self.compactions = 0
+
+    def record_usage(self, usage: BetaUsage, messages: list[BetaMessageParam]):
+        """Record the usage the API reported for a request that sent `messages`."""
+        input_tokens = (
+            usage.input_tokens
+            + (usage.cache_creation_input_tokens or 0)
+            + (usage.cache_read_input_tokens or 0)
+        )
+        self._reported = (input_tokens, len(messages))
+        if self._overhead is None:
+            self._overhead = max(
+                0, input_tokens - sum(map(estimate_message_tokens, messages))
+            )
+        self.last_input_tokens = input_tokens
+
+    def estimate(self, messages: list[BetaMessageParam]) -> int:
+        """The approximate input tokens a request sending `messages` would take."""
+        if self._reported is not None and self._reported[1] <= len(messages):
+            input_tokens, n_reported = self._reported
+            return input_tokens + sum(
+                map(estimate_message_tokens, messages[n_reported:])
+            )
+        return self._estimate_all(messages)
+
+    def maybe_compact(self, messages: list[BetaMessageParam]) -> bool:
+        """Compact `messages` in place if they are over budget, returns if it did."""
+        if self.estimate(messages) <= self.compact_at * self.context_window:
+            return False
+        target = self.compact_to * self.context_window
+        self._elide_tool_outputs(messages, target)
+        if self._estimate_all(messages) > target:
+            self._summarize_oldest(messages, target)
+        # the prefix the usage was reported for changed
+        self._reported = None
+        self.compactions += 1
+        return True
+
+    def _estimate_all(self, messages: list[BetaMessageParam]) -> int:
+        return (self._overhead or 0) + sum(map(estimate_message_tokens, messages))
+
+    def _elide_tool_outputs(self, messages: list[BetaMessageParam], target: float):
+        total = self._estimate_all(messages)
+        for message in messages[: max(len(messages) - self.keep_recent_messages, 0)]:
+            if total <= target:
+                return
+            if not isinstance(message["content"], list):
+                continue
+            for block in message["content"]:
+                if not (isinstance(block, dict) and block.get("type") == "tool_result"):
+                    continue
+                text = _text_of(block.get("content", []))
+                if text.endswith(ELIDED_OUTPUT_MARKER):
+                    continue
+                before = estimate_block_tokens(block)
+                text = _clip(text, ELIDED_OUTPUT_CHARS)
+                block["content"] = [
+                    BetaTextBlockParam(
+                        type="text", text=f"{text} {ELIDED_OUTPUT_MARKER}"
+                    )
+                ]
+                total -= before - estimate_block_tokens(block)
+
+    def _summarize_oldest(self, messages: list[BetaMessageParam], target: float):
+        total = self._estimate_all(messages)
+        end = 1
+        # drop whole turns, so that the first message kept is an assistant message and
+        # every tool result kept follows its tool use
+        for i in range(1, max(len(messages) - self.keep_recent_messages, 1)):
+            if total <= target and messages[i]["role"] == "assistant":
+                break
+            total -= estimate_message_tokens(messages[i])
+            end = i + 1
+        while end > 1 and messages[end]["role"] != "assistant":
+            end -= 1
+        if end <= 1:
+            return
+        summary = "\n".join(
+            [
+                f"Summary of {end - 1} earlier messages removed to fit the context window:"
+            ]
+            + _summary_lines(messages[1:end])
+        )
+        first = messages[0]
+        if isinstance(first["content"], str):
+            first["content"] = [BetaTextBlockParam(type="text", text=first["content"])]
+        content = cast(list[dict[str, Any]], first["content"])
+        for block in content:
+            # its cache breakpoint would be left behind the summary
+            block.pop("cache_control", None)
+        content.append(BetaTextBlockParam(type="text", text=summary))
+        del messages[1:end]
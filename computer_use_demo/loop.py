@@ -2,10 +2,18 @@
 Agentic sampling loop that calls the Claude API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
+import base64
+import io
+import os
 import platform
+import time
+from collections import deque
 from collections.abc import Callable
+from dataclasses import dataclass
 from datetime import datetime
 from enum import StrEnum
+from functools import lru_cache
 from typing import Any, cast
 
 import httpx
@@ -16,6 +24,7 @@ from anthropic import (
     APIError,
     APIResponseValidationError,
     APIStatusError,
+    DefaultHttpxClient,
 )
 from anthropic.types.beta import (
     BetaCacheControlEphemeralParam,
@@ -28,15 +37,25 @@ from anthropic.types.beta import (
     BetaToolResultBlockParam,
     BetaToolUseBlockParam,
 )
+from PIL import Image
 
+from .context import ContextBudget, decode_image, estimate_image_tokens, image_tokens
 from .tools import (
     TOOL_GROUPS_BY_VERSION,
     ToolCollection,
     ToolResult,
     ToolVersion,
 )
+from .tools.tracing import span
 
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+TOKEN_EFFICIENT_TOOLS_BETA_FLAG = "token-efficient-tools-2025-02-19"
+# request extension where `_trace_connection` records the connection setup times
+CONNECTION_TIMINGS = "connection_timings"
+# the longest side of the grayscale thumbnails older screenshots are downsampled to
+THUMBNAIL_SIZE = 384
+THUMBNAIL_QUALITY = 40
+REMOVED_IMAGE_PLACEHOLDER = "[an older screenshot was removed to save space]"
 
 
 class APIProvider(StrEnum):
@@ -55,6 +74,9 @@ SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 * You can feel free to install Ubuntu applications with your bash tool. Use curl instead of wget.
 * To open firefox, please just click on the firefox icon.  Note, firefox-esr is what is installed on your system.
 * Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
+* For long-running bash commands such as builds or downloads, call your bash tool with `background: true` to start a job and get its id. You can keep using the computer meanwhile and check on the job with `job_action` set to `status`, `wait` (optionally with a `timeout` in seconds) or `kill`, or list all jobs with `job_action: list`. Restarting the shell doesn't stop jobs, but jobs still running when you reply without calling a tool are killed.
+* To make several changes to one file, call str_replace_editor with `command: multi_edit` and `edits`, a list of objects with either `old_str` and `new_str` to replace text or `insert_line` and `new_str` to insert it. They are applied in order and the file is only written if all of them apply, and a single `undo_edit` reverts the whole batch.
+* To find code or text in a file or directory tree, call str_replace_editor with `command: search`, the file or directory as `path` and the text to find as `query`. It is faster than grep for repeated searches, ignores hidden files, and matches case-insensitively unless the query has uppercase letters.
 * When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_based_edit_tool or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
 * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
@@ -80,6 +102,9 @@ async def sampling_loop(
     ],
     api_key: str,
     only_n_most_recent_images: int | None = None,
+    n_thumbnail_images: int = 0,
+    image_retention: "ImageRetention | None" = None,
+    context_budget: ContextBudget | None = None,
     max_tokens: int = 4096,
     tool_version: ToolVersion,
     thinking_budget: int | None = None,
@@ -87,156 +112,433 @@ async def sampling_loop(
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    Past the `only_n_most_recent_images` most recent screenshots, the
+    `n_thumbnail_images` before them are downsampled and older ones removed. Pass the
+    same `image_retention` for every call of a session to avoid indexing the
+    conversation again and to count the tokens saved over the session. Older turns
+    are compacted once the conversation outgrows the `context_budget`.
     """
     tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
-    tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+    tool_collection = ToolCollection(*tool_group.tools)
+    tool_params = tool_collection.to_params()
     system = BetaTextBlockParam(
         type="text",
         text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
     )
+    client = _get_client(provider, api_key)
+    enable_prompt_caching = provider == APIProvider.ANTHROPIC
+    betas = list(
+        _betas(tool_version, token_efficient_tools_beta, enable_prompt_caching)
+    )
+    if image_retention is None:
+        image_retention = ImageRetention()
+    if context_budget is None:
+        context_budget = ContextBudget()
+
+    try:
+        while True:
+            image_truncation_threshold = only_n_most_recent_images or 0
+            if context_budget.maybe_compact(messages):
+                # the images tracked so far may have moved or been dropped
+                image_retention.rebuild(messages)
+            if enable_prompt_caching:
+                _inject_prompt_caching(messages)
+                # Because cached reads are 10% of the price, we don't think it's
+                # ever sensible to break the cache by truncating images
+                only_n_most_recent_images = 0
+                # Use type ignore to bypass TypedDict check until SDK types are updated
+                system["cache_control"] = {"type": "ephemeral"}  # type: ignore
+
+            if only_n_most_recent_images:
+                image_retention.track(messages)
+                await image_retention.evict(
+                    only_n_most_recent_images,
+                    min_removal_threshold=image_truncation_threshold,
+                    thumbnails_to_keep=n_thumbnail_images,
+                )
+            extra_body = {}
+            if thinking_budget:
+                # Ensure we only send the required fields for thinking
+                extra_body = {
+                    "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
+                }
 
-    while True:
-        enable_prompt_caching = False
-        betas = [tool_group.beta_flag] if tool_group.beta_flag else []
-        if token_efficient_tools_beta:
-            betas.append("token-efficient-tools-2025-02-19")
-        image_truncation_threshold = only_n_most_recent_images or 0
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        if enable_prompt_caching:
-            betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Because cached reads are 10% of the price, we don't think it's
-            # ever sensible to break the cache by truncating images
-            only_n_most_recent_images = 0
-            # Use type ignore to bypass TypedDict check until SDK types are updated
-            system["cache_control"] = {"type": "ephemeral"}  # type: ignore
-
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
-                only_n_most_recent_images,
-                min_removal_threshold=image_truncation_threshold,
+            # Call the API
+            # we use raw_response to provide debug information to streamlit. Your
+            # implementation may be able call the SDK directly with:
+            # `response = client.messages.create(...)` instead.
+            try:
+                with span("model", model=model):
+                    raw_response = client.beta.messages.with_raw_response.create(
+                        max_tokens=max_tokens,
+                        messages=messages,
+                        model=model,
+                        system=[system],
+                        tools=tool_params,
+                        betas=betas,
+                        extra_body=extra_body,
+                    )
+            except (APIStatusError, APIResponseValidationError) as e:
+                api_response_callback(e.request, e.response, e)
+                return messages
+            except APIError as e:
+                api_response_callback(e.request, e.body, e)
+                return messages
+
+            api_response_callback(
+                raw_response.http_response.request, raw_response.http_response, None
             )
-        extra_body = {}
-        if thinking_budget:
-            # Ensure we only send the required fields for thinking
-            extra_body = {
-                "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
-            }
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-                extra_body=extra_body,
+
+            response = raw_response.parse()
+            context_budget.record_usage(response.usage, messages)
+
+            response_params = _response_to_params(response)
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": response_params,
+                }
             )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
-
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
-
-        response = raw_response.parse()
-
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
-        )
-
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
-            output_callback(content_block)
-            if (
-                isinstance(content_block, dict)
-                and content_block.get("type") == "tool_use"
-            ):
-                # Type narrowing for tool use blocks
-                tool_use_block = cast(BetaToolUseBlockParam, content_block)
-                result = await tool_collection.run(
-                    name=tool_use_block["name"],
-                    tool_input=cast(dict[str, Any], tool_use_block.get("input", {})),
-                )
-                tool_result_content.append(
-                    _make_api_tool_result(result, tool_use_block["id"])
-                )
-                tool_output_callback(result, tool_use_block["id"])
 
-        if not tool_result_content:
-            return messages
+            tool_use_blocks: list[BetaToolUseBlockParam] = []
+            for content_block in response_params:
+                output_callback(content_block)
+                if (
+                    isinstance(content_block, dict)
+                    and content_block.get("type") == "tool_use"
+                ):
+                    # Type narrowing for tool use blocks
+                    tool_use_blocks.append(cast(BetaToolUseBlockParam, content_block))
+
+            tool_result_content: list[BetaToolResultBlockParam] = []
+            if tool_use_blocks:
+                # independent calls run concurrently, results come back in order
+                with span("tools", calls=len(tool_use_blocks)):
+                    results = await tool_collection.run_all(
+                        [
+                            (
+                                block["name"],
+                                cast(dict[str, Any], block.get("input", {})),
+                            )
+                            for block in tool_use_blocks
+                        ]
+                    )
+                for tool_use_block, result in zip(
+                    tool_use_blocks, results, strict=True
+                ):
+                    tool_result_content.append(
+                        _make_api_tool_result(result, tool_use_block["id"])
+                    )
+                    tool_output_callback(result, tool_use_block["id"])
+
+            if not tool_result_content:
+                return messages
+
+            messages.append({"content": tool_result_content, "role": "user"})
+    finally:
+        await tool_collection.close()
+
+
+@lru_cache(maxsize=1)
+def _http_client() -> httpx.Client:
+    """A keep-alive connection pool shared by all clients, tracing new connections."""
+    return DefaultHttpxClient(event_hooks={"request": [_trace_connection]})
+
+
+# the settings Vertex and Bedrock clients read from the environment when created
+_CLIENT_ENVIRONMENT: dict[APIProvider, tuple[str, ...]] = {
+    APIProvider.VERTEX: (
+        "CLOUD_ML_REGION",
+        "ANTHROPIC_VERTEX_PROJECT_ID",
+        "ANTHROPIC_VERTEX_BASE_URL",
+        "GOOGLE_APPLICATION_CREDENTIALS",
+    ),
+    APIProvider.BEDROCK: (
+        "AWS_REGION",
+        "AWS_DEFAULT_REGION",
+        "AWS_PROFILE",
+        "AWS_ACCESS_KEY_ID",
+        "AWS_SECRET_ACCESS_KEY",
+        "AWS_SESSION_TOKEN",
+        "AWS_BEARER_TOKEN_BEDROCK",
+        "ANTHROPIC_BEDROCK_BASE_URL",
+    ),
+}
+
+
+def _get_client(
+    provider: APIProvider, api_key: str
+) -> Anthropic | AnthropicVertex | AnthropicBedrock:
+    """
+    Clients are reused across turns and sampling loops so that their connections are
+    kept alive. Vertex and Bedrock read their credentials from the environment, a new
+    client is made once those settings change.
+    """
+    environment = tuple(
+        os.environ.get(name) for name in _CLIENT_ENVIRONMENT.get(provider, ())
+    )
+    return _client(provider, api_key, environment)
 
-        messages.append({"content": tool_result_content, "role": "user"})
 
+@lru_cache(maxsize=8)
+def _client(
+    provider: APIProvider, api_key: str, environment: tuple[str | None, ...]
+) -> Anthropic | AnthropicVertex | AnthropicBedrock:
+    if provider == APIProvider.ANTHROPIC:
+        return Anthropic(api_key=api_key, max_retries=4, http_client=_http_client())
+    elif provider == APIProvider.VERTEX:
+        return AnthropicVertex(http_client=_http_client())
+    return AnthropicBedrock(http_client=_http_client())
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int,
-):
+
+@lru_cache
+def _betas(
+    tool_version: ToolVersion,
+    token_efficient_tools_beta: bool,
+    enable_prompt_caching: bool,
+) -> tuple[str, ...]:
+    beta_flag = TOOL_GROUPS_BY_VERSION[tool_version].beta_flag
+    betas = [beta_flag] if beta_flag else []
+    if token_efficient_tools_beta:
+        betas.append(TOKEN_EFFICIENT_TOOLS_BETA_FLAG)
+    if enable_prompt_caching:
+        betas.append(PROMPT_CACHING_BETA_FLAG)
+    return tuple(betas)
+
+
+def _trace_connection(request: httpx.Request):
     """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
+    Record how long the request spent opening a connection, by step. Nothing is
+    recorded when it reused a kept-alive connection.
     """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[BetaToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
+    timings: dict[str, float] = {}
+    started_at: dict[str, float] = {}
+
+    def trace(event_name: str, info: dict[str, Any]):
+        step, _, stage = event_name.rpartition(".")
+        if not step.startswith("connection."):
+            return
+        if stage == "started":
+            started_at[step] = time.perf_counter()
+        elif stage == "complete" and step in started_at:
+            timings[step.removeprefix("connection.")] = (
+                time.perf_counter() - started_at.pop(step)
             )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
 
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
+    request.extensions["trace"] = trace
+    request.extensions[CONNECTION_TIMINGS] = timings
+
+
+def connection_overhead(request: httpx.Request) -> str:
+    """Describe the connection setup recorded by `_trace_connection` for a request."""
+    timings = request.extensions.get(CONNECTION_TIMINGS)
+    if timings is None:
+        return "connection setup not traced"
+    if not timings:
+        return "reused a kept-alive connection"
+    steps = ", ".join(
+        f"{step} {seconds * 1000:.1f} ms" for step, seconds in timings.items()
+    )
+    return f"new connection: {steps}"
+
+
+def _thumbnail(data: bytes) -> tuple[BetaImageBlockParam, int] | None:
+    """A small grayscale JPEG of an image, and the tokens it saves."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            tokens = image_tokens(image.size)
+            thumbnail = image.convert("L")
+    except (OSError, ValueError):
+        return None
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+    block = BetaImageBlockParam(
+        type="image",
+        source={
+            "type": "base64",
+            "media_type": "image/jpeg",
+            "data": base64.b64encode(buffer.getvalue()).decode(),
+        },
     )
+    return block, tokens - image_tokens(thumbnail.size)
 
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
+
+@dataclass
+class _TrackedImage:
+    # the content list of the tool_result the image is in
+    content: list[Any]
+    block: dict[str, Any]
+
+
+class ImageRetention:
+    """
+    With the assumption that images are screenshots that are of diminishing value as
+    the conversation progresses, tracks the tool_result images of a conversation as
+    messages are appended to it, so that older ones can be downsampled to thumbnails
+    and then replaced with a placeholder without scanning the whole conversation on
+    every turn.
+    """
+
+    # the most thumbnails and placeholders remembered to recognize them after a
+    # rebuild, the tokens the older ones save are no longer counted after it
+    max_saved = 1024
+
+    def __init__(self):
+        self._n_scanned = 0
+        # the full size images, oldest first
+        self._images: deque[_TrackedImage] = deque()
+        self._thumbnails: deque[_TrackedImage] = deque()
+        # the thumbnails and placeholders made, by id, with the input tokens each saves,
+        # oldest first
+        self._saved: dict[int, tuple[dict[str, Any], int]] = {}
+        # the input tokens each request saves with the images downsampled or removed
+        self.tokens_saved_per_request = 0
+        # the input tokens saved by every request so far
+        self.tokens_saved = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    def track(self, messages: list[BetaMessageParam]):
+        """Index the images of the messages appended since the last call."""
+        if len(messages) < self._n_scanned:
+            # the conversation was rewritten rather than appended to
+            self.rebuild(messages)
+            return
+        self._scan(messages[self._n_scanned :], self._saved)
+        self._n_scanned = len(messages)
+
+    def rebuild(self, messages: list[BetaMessageParam]):
+        """
+        Index the images of the messages again after they were rewritten in place, as
+        compaction does. The thumbnails and placeholders that are left are recognized
+        rather than tracked as full size images.
+        """
+        saved = self._saved
+        self._saved = {}
+        self._images.clear()
+        self._thumbnails.clear()
+        self.tokens_saved_per_request = 0
+        self._scan(messages, saved)
+        self._n_scanned = len(messages)
+
+    def _scan(
+        self,
+        messages: list[BetaMessageParam],
+        saved: dict[int, tuple[dict[str, Any], int]],
+    ):
+        for message in messages:
+            if not isinstance(message["content"], list):
+                continue
+            for item in message["content"]:
+                if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                    continue
+                content = cast(BetaToolResultBlockParam, item).get("content")
+                if not isinstance(content, list):
+                    continue
+                for block in content:
+                    if not isinstance(block, dict):
                         continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+                    made = saved.get(id(block))
+                    if made is not None and made[0] is block:
+                        self._remember(*made)
+                        self.tokens_saved_per_request += made[1]
+                        if block.get("type") == "image":
+                            self._thumbnails.append(_TrackedImage(content, block))
+                    elif block.get("type") == "image":
+                        self._images.append(_TrackedImage(content, block))
+
+    async def evict(
+        self,
+        images_to_keep: int,
+        min_removal_threshold: int,
+        thumbnails_to_keep: int = 0,
+    ):
+        """
+        Keep the final `images_to_keep` tracked images at full size, downsample the
+        `thumbnails_to_keep` before them and replace the rest with a placeholder, in
+        place. Without thumbnails the rest are removed. Images change tier in chunks of min_removal_threshold to reduce the
+        amount we break the implicit prompt cache, and only those images are visited.
+        Images are downsampled in a thread, decoding and encoding them is slow.
+        """
+        images = [
+            self._images.popleft()
+            for _ in range(
+                _chunk(len(self._images) - images_to_keep, min_removal_threshold)
+            )
+        ]
+        if thumbnails_to_keep and images:
+            thumbnails = await asyncio.to_thread(
+                lambda: [_downsample(image) for image in images]
+            )
+            for image, thumbnail in zip(images, thumbnails, strict=True):
+                self._replace_with_thumbnail(image, thumbnail)
+        else:
+            for image in images:
+                self._remove(image, placeholder=False)
+        for _ in range(
+            _chunk(len(self._thumbnails) - thumbnails_to_keep, min_removal_threshold)
+        ):
+            self._remove(self._thumbnails.popleft(), placeholder=thumbnails_to_keep > 0)
+        self.tokens_saved += self.tokens_saved_per_request
+
+    def _replace_with_thumbnail(
+        self,
+        image: _TrackedImage,
+        thumbnail: tuple[BetaImageBlockParam, int] | None,
+    ):
+        if thumbnail is None:
+            self._remove(image, placeholder=True)
+            return
+        block, tokens_saved = thumbnail
+        self.tokens_saved_per_request += tokens_saved
+        _replace(image.content, image.block, block)
+        self._remember(cast(dict[str, Any], block), tokens_saved)
+        self._thumbnails.append(_TrackedImage(image.content, block))
+
+    def _remove(self, image: _TrackedImage, placeholder: bool):
+        tokens_saved = estimate_image_tokens(cast(BetaImageBlockParam, image.block))
+        self.tokens_saved_per_request += tokens_saved
+        # a thumbnail's placeholder also saves what the thumbnail did
+        _, thumbnail_saved = self._saved.pop(id(image.block), (None, 0))
+        if not placeholder:
+            _replace(image.content, image.block)
+            return
+        block = BetaTextBlockParam(type="text", text=REMOVED_IMAGE_PLACEHOLDER)
+        _replace(image.content, image.block, block)
+        self._remember(cast(dict[str, Any], block), thumbnail_saved + tokens_saved)
+
+    def _remember(self, block: dict[str, Any], tokens_saved: int):
+        self._saved[id(block)] = (block, tokens_saved)
+        if len(self._saved) > self.max_saved:
+            del self._saved[next(iter(self._saved))]
+
+
+def _downsample(image: _TrackedImage) -> tuple[BetaImageBlockParam, int] | None:
+    data = decode_image(cast(BetaImageBlockParam, image.block))
+    return _thumbnail(data) if data is not None else None
+
+
+def _chunk(n: int, chunk_size: int) -> int:
+    """`n` rounded down to a multiple of `chunk_size`, for better cache behavior."""
+    if n <= 0:
+        return 0
+    if not chunk_size:
+        return n
+    return n - n % chunk_size
+
+
+def _replace(content: list[Any], old: dict[str, Any], new: Any | None = None):
+    """Replace `old` in `content` with `new`, or remove it without one."""
+    for i, item in enumerate(content):
+        if item is old:
+            if new is None:
+                del content[i]
+            else:
+                content[i] = new
+            return
 
 
 def _response_to_params(
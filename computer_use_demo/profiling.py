@@ -0,0 +1,197 @@
+"""
+Profiles of the turns of chosen sessions, taken without restarting the process: CPU
+profiles in the pstats format of cProfile, for snakeviz or `python -m pstats`, and
+tracemalloc snapshots of the memory a turn allocated and still holds at its end, as
+the conversation grows. Sessions are chosen with PROFILE_SESSIONS, a comma separated
+list of session ids or `*` for all of them, or at runtime with `Profiler.arm`, as the
+admin endpoints of the backend and the sidebar of the Streamlit app do.
+
+CPU profiles cover every coroutine of the event loop while the turn runs, including
+those of other sessions, and one runs at a time.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+from collections.abc import Iterator, Sized
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal, get_args
+
+ProfileKind = Literal["cpu", "memory"]
+ALL_KINDS: frozenset[ProfileKind] = frozenset(get_args(ProfileKind))
+
+# frames kept for each allocation of the memory profiles
+TRACEMALLOC_FRAMES = 16
+MEMORY_SUMMARY_LINES = 25
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Armed:
+    kinds: frozenset[ProfileKind]
+    # the turns left to profile, None for every turn
+    turns: int | None
+
+
+class Profiler:
+    """Profiles the turns of the sessions armed, one file of each kind for a turn."""
+
+    directory = Path(os.getenv("PROFILE_DIR", "~/.anthropic/profiles")).expanduser()
+
+    def __init__(self):
+        self._armed: dict[str, _Armed] = {}
+        self._cpu_busy = False
+        sessions = os.getenv("PROFILE_SESSIONS", "")
+        kinds = parse_kinds(os.getenv("PROFILE_KINDS", "cpu,memory"))
+        for session_id in filter(None, map(str.strip, sessions.split(","))):
+            self.arm(session_id, kinds)
+
+    def arm(
+        self,
+        session_id: str,
+        kinds: frozenset[ProfileKind] = ALL_KINDS,
+        turns: int | None = None,
+    ):
+        """Profile the next `turns` turns of a session, or `*` for every session."""
+        self._armed[session_id] = _Armed(kinds, turns)
+
+    def disarm(self, session_id: str):
+        self._armed.pop(session_id, None)
+
+    def armed(self) -> dict[str, dict]:
+        return {
+            session_id: {"kinds": sorted(armed.kinds), "turns": armed.turns}
+            for session_id, armed in self._armed.items()
+        }
+
+    def _take(self, session_id: str) -> frozenset[ProfileKind]:
+        key = session_id if session_id in self._armed else "*"
+        armed = self._armed.get(key)
+        if armed is None:
+            return frozenset()
+        if armed.turns is not None:
+            armed.turns -= 1
+            if armed.turns <= 0:
+                del self._armed[key]
+        return armed.kinds
+
+    @contextmanager
+    def profile(
+        self, session_id: str, turn: int, messages: Sized | None = None
+    ) -> Iterator[list[Path]]:
+        """
+        Profile the block as a turn of the session if it is armed, and yield the list
+        the paths of the profiles are added to once they are written.
+        """
+        paths: list[Path] = []
+        kinds = self._take(session_id)
+        if not kinds:
+            yield paths
+            return
+        stem = f"{Path(session_id).name}-turn{turn}-{time.strftime('%Y%m%d%H%M%S')}"
+        profile = None
+        if "cpu" in kinds and not self._cpu_busy:
+            self._cpu_busy = True
+            profile = cProfile.Profile()
+        # another profile may be tracing allocations already
+        trace_memory = "memory" in kinds and not tracemalloc.is_tracing()
+        n_messages = len(messages) if messages is not None else None
+        if trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if profile:
+            profile.enable()
+        try:
+            yield paths
+        finally:
+            snapshot = None
+            try:
+                if profile:
+                    profile.disable()
+                    self._cpu_busy = False
+                if trace_memory:
+                    snapshot = tracemalloc.take_snapshot()
+            finally:
+                # tracing allocations slows down the whole process, never leave it on
+                if trace_memory:
+                    tracemalloc.stop()
+            try:
+                self._write(
+                    paths,
+                    stem,
+                    profile,
+                    snapshot,
+                    n_messages,
+                    len(messages) if messages is not None else None,
+                )
+            except OSError:
+                # a profile that can't be written must not fail the turn
+                logger.exception(
+                    "Could not write the profiles of turn %s of %s", turn, session_id
+                )
+
+    def _write(
+        self,
+        paths: list[Path],
+        stem: str,
+        profile: cProfile.Profile | None,
+        snapshot: tracemalloc.Snapshot | None,
+        messages_before: int | None,
+        messages_after: int | None,
+    ):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if profile:
+            path = self.directory / f"{stem}.prof"
+            profile.dump_stats(path)
+            paths.append(path)
+        if snapshot is not None:
+            path = self.directory / f"{stem}.tracemalloc"
+            snapshot.dump(str(path))
+            paths.append(path)
+            path = self.directory / f"{stem}-memory.json"
+            path.write_text(
+                json.dumps(
+                    _memory_summary(snapshot, messages_before, messages_after),
+                    indent=2,
+                )
+            )
+            paths.append(path)
+
+
+def parse_kinds(value: str) -> frozenset[ProfileKind]:
+    kinds = frozenset(kind.strip() for kind in value.split(",") if kind.strip())
+    invalid = kinds - ALL_KINDS
+    if invalid or not kinds:
+        raise ValueError(
+            f"Invalid profile kinds: {value}. Use a list of {sorted(ALL_KINDS)}"
+        )
+    return kinds  # type: ignore[return-value]
+
+
+def _memory_summary(
+    snapshot: tracemalloc.Snapshot,
+    messages_before: int | None,
+    messages_after: int | None,
+) -> dict:
+    statistics = snapshot.statistics("lineno")
+    return {
+        "messages_before": messages_before,
+        "messages_after": messages_after,
+        "allocated_bytes": sum(stat.size for stat in statistics),
+        "top_allocations": [
+            {
+                "location": str(stat.traceback),
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in statistics[:MEMORY_SUMMARY_LINES]
+        ],
+    }
+
+
+PROFILER = Profiler()
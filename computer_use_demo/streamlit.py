@@ -8,28 +8,40 @@ import os
 import subprocess
 import traceback
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
 from enum import StrEnum
 from functools import partial
 from pathlib import PosixPath
 from typing import cast, get_args
+from uuid import uuid4
 
 import httpx
 import streamlit as st
 from anthropic import RateLimitError
 from anthropic.types.beta import (
     BetaContentBlockParam,
+    BetaMessageParam,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
 )
 from streamlit.delta_generator import DeltaGenerator
 
+from computer_use_demo.context import ContextBudget
 from computer_use_demo.loop import (
     APIProvider,
+    ImageRetention,
+    connection_overhead,
     sampling_loop,
 )
-from computer_use_demo.tools import ToolResult, ToolVersion
+from computer_use_demo.profiling import PROFILER
+from computer_use_demo.tools import (
+    BashSessionPool,
+    ToolResult,
+    ToolVersion,
+    close_bash_sessions,
+)
+from computer_use_demo.tools.tracing import trace
 
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.ANTHROPIC: "claude-sonnet-4-5-20250929",
@@ -121,6 +133,12 @@ class Sender(StrEnum):
 def setup_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "api_messages" not in st.session_state:
+        # the conversation sent to the API, its older turns get compacted while
+        # `messages` keeps all of them to render
+        st.session_state.api_messages = []
+    if "context_budget" not in st.session_state:
+        st.session_state.context_budget = ContextBudget()
     if "api_key" not in st.session_state:
         # Try to load API key from file first, then environment
         st.session_state.api_key = load_from_storage("api_key") or os.getenv(
@@ -142,6 +160,10 @@ def setup_state():
         st.session_state.tools = {}
     if "only_n_most_recent_images" not in st.session_state:
         st.session_state.only_n_most_recent_images = 3
+    if "n_thumbnail_images" not in st.session_state:
+        st.session_state.n_thumbnail_images = 3
+    if "image_retention" not in st.session_state:
+        st.session_state.image_retention = ImageRetention()
     if "custom_system_prompt" not in st.session_state:
         st.session_state.custom_system_prompt = load_from_storage("system_prompt") or ""
     if "hide_images" not in st.session_state:
@@ -150,6 +172,11 @@ def setup_state():
         st.session_state.token_efficient_tools_beta = False
     if "in_sampling_loop" not in st.session_state:
         st.session_state.in_sampling_loop = False
+    if "session_id" not in st.session_state:
+        # names the trace and profile files of the session
+        st.session_state.session_id = uuid4().hex
+    if "turn" not in st.session_state:
+        st.session_state.turn = 0
 
 
 def _reset_model():
@@ -220,6 +247,16 @@ async def main():
             key="only_n_most_recent_images",
             help="To decrease the total tokens sent, remove older screenshots from the conversation",
         )
+        st.number_input(
+            "Keep N older images as thumbnails",
+            min_value=0,
+            key="n_thumbnail_images",
+            help="Send small grayscale versions of the screenshots before the N most recent ones instead of removing them",
+        )
+        if st.session_state.image_retention.tokens_saved:
+            st.caption(
+                f"Older screenshots saved ~{st.session_state.image_retention.tokens_saved:,} input tokens this session"
+            )
         st.text_area(
             "Custom System Prompt Suffix",
             key="custom_system_prompt",
@@ -256,6 +293,15 @@ async def main():
             disabled=not st.session_state.thinking,
         )
 
+        st.caption(f"Session id: `{st.session_state.session_id}`")
+        if st.button(
+            "Profile next turn",
+            help=f"Write CPU and memory profiles of the next turn to {PROFILER.directory}",
+        ):
+            PROFILER.arm(st.session_state.session_id, turns=1)
+        if st.session_state.session_id in PROFILER.armed():
+            st.caption("The next turn will be profiled")
+
         if st.button("Reset", type="primary"):
             with st.spinner("Resetting..."):
                 st.session_state.clear()
@@ -280,6 +326,8 @@ async def main():
     )
 
     with chat:
+        # messages added by an interrupted run
+        _sync_transcript()
         # render past chats
         for message in st.session_state.messages:
             if isinstance(message["content"], str):
@@ -301,18 +349,26 @@ async def main():
         # render past http exchanges
         for identity, (request, response) in st.session_state.responses.items():
             _render_api_response(request, response, identity, http_logs)
+        for tool_id, tool_output in st.session_state.tools.items():
+            _render_tool_usage(tool_output, tool_id, http_logs)
 
         # render past chats
         if new_message:
-            st.session_state.messages.append(
-                {
-                    "role": Sender.USER,
-                    "content": [
-                        *maybe_add_interruption_blocks(),
-                        BetaTextBlockParam(type="text", text=new_message),
-                    ],
-                }
-            )
+            message: BetaMessageParam = {
+                "role": Sender.USER,
+                "content": [
+                    *maybe_add_interruption_blocks(),
+                    BetaTextBlockParam(type="text", text=new_message),
+                ],
+            }
+            st.session_state.messages.append(message)
+            if st.session_state.api_messages:
+                st.session_state.api_messages.append(message)
+            else:
+                # compaction adds its summaries to the first message
+                st.session_state.api_messages.append(
+                    {**message, "content": list(message["content"])}
+                )
             _render_message(Sender.USER, new_message)
 
         try:
@@ -324,16 +380,27 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
-        with track_sampling_loop():
+        st.session_state.turn += 1
+        with (
+            track_sampling_loop(),
+            trace(st.session_state.session_id, turn=st.session_state.turn),
+            PROFILER.profile(
+                st.session_state.session_id,
+                st.session_state.turn,
+                st.session_state.messages,
+            ),
+        ):
             # run the agent sampling loop with the newest message
-            st.session_state.messages = await sampling_loop(
+            await sampling_loop(
                 system_prompt_suffix=st.session_state.custom_system_prompt,
                 model=st.session_state.model,
                 provider=st.session_state.provider,
-                messages=st.session_state.messages,
+                messages=st.session_state.api_messages,
                 output_callback=partial(_render_message, Sender.BOT),
                 tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
+                    _tool_output_callback,
+                    tool_state=st.session_state.tools,
+                    tab=http_logs,
                 ),
                 api_response_callback=partial(
                     _api_response_callback,
@@ -342,6 +409,9 @@ async def main():
                 ),
                 api_key=st.session_state.api_key,
                 only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+                n_thumbnail_images=st.session_state.n_thumbnail_images,
+                image_retention=st.session_state.image_retention,
+                context_budget=st.session_state.context_budget,
                 tool_version=st.session_state.tool_versions,
                 max_tokens=st.session_state.output_tokens,
                 thinking_budget=st.session_state.thinking_budget
@@ -349,6 +419,20 @@ async def main():
                 else None,
                 token_efficient_tools_beta=st.session_state.token_efficient_tools_beta,
             )
+            _sync_transcript()
+
+
+def _sync_transcript():
+    """
+    Add the messages the sampling loop appended to the API conversation to the
+    rendered one. Compaction never removes the most recent messages, so syncing on
+    every API response keeps up with it.
+    """
+    transcript = st.session_state.messages
+    api_messages = st.session_state.api_messages
+    known = {id(message) for message in transcript}
+    known.update(id(message) for message in api_messages[:1])
+    transcript.extend(message for message in api_messages if id(message) not in known)
 
 
 def maybe_add_interruption_blocks():
@@ -442,17 +526,34 @@ def _api_response_callback(
     """
     response_id = datetime.now().isoformat()
     response_state[response_id] = (request, response)
+    _sync_transcript()
     if error:
         _render_error(error)
     _render_api_response(request, response, response_id, tab)
 
 
 def _tool_output_callback(
-    tool_output: ToolResult, tool_id: str, tool_state: dict[str, ToolResult]
+    tool_output: ToolResult,
+    tool_id: str,
+    tool_state: dict[str, ToolResult],
+    tab: DeltaGenerator,
 ):
     """Handle a tool output by storing it to state and rendering it."""
     tool_state[tool_id] = tool_output
     _render_message(Sender.TOOL, tool_output)
+    _render_tool_usage(tool_output, tool_id, tab)
+
+
+def _render_tool_usage(tool_output: ToolResult, tool_id: str, tab: DeltaGenerator):
+    """Render the resources used by a tool call next to the http exchanges"""
+    # interrupted tool calls and results from before a hot reload have no usage
+    usage = getattr(tool_output, "usage", None)
+    if not usage:
+        return
+    with tab:
+        with st.expander(f"Tool Resource Usage ({tool_id})"):
+            st.markdown(f"`{usage}`")
+            st.json(asdict(usage))
 
 
 def _render_api_response(
@@ -470,6 +571,7 @@ def _render_api_response(
             )
             st.json(request.read().decode())
             st.markdown("---")
+            st.markdown(f"`{connection_overhead(request)}`")
             if isinstance(response, httpx.Response):
                 st.markdown(
                     f"`{response.status_code}`{newline}{newline.join(f'`{k}: {v}`' for k, v in response.headers.items())}"
@@ -535,5 +637,16 @@ def _render_message(
             st.markdown(message)
 
 
+async def run_script():
+    """Run one script run of streamlit, each gets its own event loop."""
+    # the sessions of a run end with it, a pooled one would never be used
+    BashSessionPool.for_running_loop().size = 0
+    try:
+        await main()
+    finally:
+        # subprocesses can't outlive the event loop that started them
+        await close_bash_sessions()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run_script())
@@ -1,9 +1,16 @@
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .bash import BashTool20241022, BashTool20250124
+from .bash import (
+    BashSessionPool,
+    BashTool20241022,
+    BashTool20250124,
+    close_bash_sessions,
+    close_session_jobs,
+)
 from .collection import ToolCollection
 from .computer import ComputerTool20241022, ComputerTool20250124
 from .edit import EditTool20241022, EditTool20250124
 from .groups import TOOL_GROUPS_BY_VERSION, ToolVersion
+from .proc import REAPER_COUNTERS, ResourceUsage
 from .run import maybe_truncate, run
 
 __all__ = [
@@ -11,8 +18,11 @@ __all__ = [
     "CLIResult",
     "ToolError",
     "ToolResult",
+    "BashSessionPool",
     "BashTool20241022",
     "BashTool20250124",
+    "close_bash_sessions",
+    "close_session_jobs",
     "ToolCollection",
     "ComputerTool20241022",
     "ComputerTool20250124",
@@ -20,6 +30,8 @@ __all__ = [
     "EditTool20250124",
     "TOOL_GROUPS_BY_VERSION",
     "ToolVersion",
+    "REAPER_COUNTERS",
+    "ResourceUsage",
     "maybe_truncate",
     "run",
 ]
@@ -1,9 +1,12 @@
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, fields, replace
+from pathlib import Path
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .proc import ResourceUsage
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -19,6 +22,48 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def access(self, tool_input: dict[str, Any]) -> "ToolAccess":
+        """What a call with the given input uses, by default it conflicts with any call."""
+        return ToolAccess(barrier=True)
+
+    def action_of(self, tool_input: dict[str, Any]) -> str:
+        """The kind of a call with the given input, to label its metrics."""
+        return ""
+
+    async def close(self):
+        """Release what the tool holds once its collection is done, by default nothing."""
+        return None
+
+
+def _overlap(path: Path, other: Path):
+    return path == other or path in other.parents or other in path.parents
+
+
+@dataclass(kw_only=True, frozen=True)
+class ToolAccess:
+    """
+    What a tool call uses, to tell which calls of one turn can run at the same time.
+    Paths cover everything under them.
+    """
+
+    # resources only one call can use at a time, like the display
+    exclusive: frozenset[str] = frozenset()
+    reads: frozenset[Path] = frozenset()
+    writes: frozenset[Path] = frozenset()
+    # conflicts with every other call
+    barrier: bool = False
+
+    def conflicts_with(self, other: "ToolAccess"):
+        if self.barrier or other.barrier or self.exclusive & other.exclusive:
+            return True
+        return any(
+            _overlap(written, path)
+            for written in self.writes
+            for path in other.reads | other.writes
+        ) or any(
+            _overlap(written, path) for written in other.writes for path in self.reads
+        )
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -28,9 +73,13 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    # what running the tool cost, for logs only and never sent to the model
+    usage: ResourceUsage | None = None
 
     def __bool__(self):
-        return any(getattr(self, field.name) for field in fields(self))
+        return any(
+            getattr(self, field.name) for field in fields(self) if field.name != "usage"
+        )
 
     def __add__(self, other: "ToolResult"):
         def combine_fields(
@@ -47,6 +96,9 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            usage=self.usage + other.usage
+            if self.usage and other.usage
+            else self.usage or other.usage,
         )
 
     def replace(self, **kwargs):
@@ -1,8 +1,29 @@
 import asyncio
+import logging
 import os
-from typing import Any, Literal
+import signal
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Literal, get_args
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .base import BaseAnthropicTool, CLIResult, ToolAccess, ToolError, ToolResult
+from .proc import (
+    PROC_ROOT,
+    ResourceUsage,
+    group_children,
+    kill_process_tree,
+    process_children,
+    sample_process_tree,
+)
+from .run import maybe_truncate
+
+JobAction = Literal["list", "status", "wait", "kill"]
+
+# the idle bash sessions kept started for each event loop
+BASH_SESSION_POOL_SIZE = int(os.getenv("BASH_SESSION_POOL_SIZE") or 1)
+
+logger = logging.getLogger(__name__)
 
 
 class _BashSession:
@@ -14,11 +35,13 @@ class _BashSession:
     command: str = "/bin/bash"
     _output_delay: float = 0.2  # seconds
     _timeout: float = 120.0  # seconds
+    _stop_grace: float = 2.0  # seconds
     _sentinel: str = "<<exit>>"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._started = False
         self._timed_out = False
+        self._env = env
 
     async def start(self):
         if self._started:
@@ -29,6 +52,7 @@ class _BashSession:
             preexec_fn=os.setsid,
             shell=True,
             bufsize=0,
+            env={**os.environ, **self._env} if self._env else None,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
@@ -36,13 +60,22 @@ class _BashSession:
 
         self._started = True
 
-    def stop(self):
-        """Terminate the bash shell."""
+    async def stop(self):
+        """Terminate the bash shell and wait for it to exit."""
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
             return
-        self._process.terminate()
+        # bash runs under a `/bin/sh` wrapper, signal the whole session started by it
+        try:
+            os.killpg(self._process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(self._process.wait(), self._stop_grace)
+        except asyncio.TimeoutError:
+            await kill_process_tree(self._process.pid)
+            await self._process.wait()
 
     async def run(self, command: str):
         """Execute a command in the bash shell."""
@@ -63,6 +96,12 @@ class _BashSession:
         assert self._process.stdout
         assert self._process.stderr
 
+        # the shell reaps the command, so its cost shows up in the shell's counters.
+        # sampled only before and after the command, the peak rss is of the processes
+        # left then
+        before = sample_process_tree(self._process.pid) or ResourceUsage()
+        started_at = time.monotonic()
+
         # send command to the process
         self._process.stdin.write(
             command.encode() + f"; echo '{self._sentinel}'\n".encode()
@@ -81,8 +120,16 @@ class _BashSession:
                         # strip the sentinel and break
                         output = output[: output.index(self._sentinel)]
                         break
+        except asyncio.CancelledError:
+            # the sentinel would never be read, so the session can't be reused
+            await kill_process_tree(self._process.pid)
+            await self._process.wait()
+            raise
         except asyncio.TimeoutError:
             self._timed_out = True
+            # the session can't be used anymore, don't leave the command running
+            await kill_process_tree(self._process.pid)
+            await self._process.wait()
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
@@ -98,7 +145,295 @@ class _BashSession:
         self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
         self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
 
-        return CLIResult(output=output, error=error)
+        after = sample_process_tree(self._process.pid) or before
+        usage = (after - before).replace(
+            wall_time=time.monotonic() - started_at,
+            max_rss_kb=max(before.max_rss_kb, after.max_rss_kb),
+        )
+        return CLIResult(output=output, error=error, usage=usage)
+
+
+class BashSessionPool:
+    """
+    A pool of started bash sessions, so tools don't wait for a shell on restart or in
+    later turns. The pool is filled once the first session is taken from it. Used
+    sessions are never handed out again: they are stopped and a fresh session is
+    started in the background to take their place. `size` is the number of idle
+    sessions kept, none disables the pool, and sessions are started with `env` added
+    to the environment. Idle sessions started with another `env` are stopped rather
+    than handed out, so both can be changed at any time.
+    """
+
+    # subprocesses are bound to the event loop that started them
+    _pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BashSessionPool]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(
+        self, size: int = BASH_SESSION_POOL_SIZE, env: dict[str, str] | None = None
+    ):
+        self.size = size
+        self.env = env
+        self._idle: list[_BashSession] = []
+        # sessions being started or handed out, stopped along with the idle ones
+        self._active: set[_BashSession] = set()
+        self._refill: asyncio.Task | None = None
+        self._closed = False
+
+    @classmethod
+    def for_running_loop(cls) -> "BashSessionPool":
+        """The pool of the running event loop, created with the default configuration."""
+        loop = asyncio.get_running_loop()
+        if loop not in cls._pools:
+            cls._pools[loop] = cls()
+        return cls._pools[loop]
+
+    def fill(self):
+        """Start sessions in the background until the pool is full."""
+        if not self._closed and (self._refill is None or self._refill.done()):
+            self._refill = asyncio.create_task(self._fill())
+
+    async def _fill(self):
+        while not self._closed and len(self._idle) < self.size:
+            session = _BashSession(env=self.env)
+            self._active.add(session)
+            try:
+                await session.start()
+                # wait for the shell to finish starting up before handing it out
+                await session.run("true")
+            except Exception:
+                # nothing waits for the refill, a session is started on demand instead
+                logger.warning("Could not start a pooled bash session", exc_info=True)
+                self._active.discard(session)
+                if session._started:
+                    await session.stop()
+                return
+            self._active.discard(session)
+            self._idle.append(session)
+
+    async def acquire(self) -> _BashSession:
+        """Take a started session from the pool, or start one if none are idle."""
+        stale = [
+            s
+            for s in self._idle
+            if s._process.returncode is not None or s._env != self.env
+        ]
+        self._idle = [s for s in self._idle if s not in stale]
+        # take the session before stopping the stale ones, a refill may add a session
+        # started with the old environment meanwhile
+        if self._idle:
+            session = self._idle.pop(0)
+        else:
+            session = _BashSession(env=self.env)
+            await session.start()
+        self._active.add(session)
+        await asyncio.gather(*(stale_session.stop() for stale_session in stale))
+        self.fill()
+        return session
+
+    async def release(self, session: _BashSession):
+        """Stop a session handed out by the pool."""
+        self._active.discard(session)
+        await session.stop()
+
+    async def recycle(self, session: _BashSession):
+        """Stop a used session and replace it in the background."""
+        await self.release(session)
+        self.fill()
+
+    async def close(self):
+        """Stop the refill and every session of the pool, idle or handed out."""
+        self._closed = True
+        # let a refill finish the session it is starting, cancelling a subprocess
+        # while it starts leaves its pipes unconnected
+        if self._refill is not None:
+            await self._refill
+        sessions = [*self._idle, *self._active]
+        self._idle.clear()
+        self._active.clear()
+        await asyncio.gather(*(session.stop() for session in sessions))
+
+
+async def close_bash_sessions():
+    """
+    Stop the bash sessions and kill the background jobs started for the running event
+    loop, before it closes.
+    """
+    loop = asyncio.get_running_loop()
+    pool = BashSessionPool._pools.pop(loop, None)
+    if pool is not None:
+        await pool.close()
+    managers = _BashJobManager._sessions.pop(loop, {})
+    await asyncio.gather(*(manager.kill_all() for manager in managers.values()))
+
+
+async def close_session_jobs(session_id: str):
+    """Kill the background jobs kept for a session, once it has ended."""
+    managers = _BashJobManager._sessions.get(asyncio.get_running_loop(), {})
+    manager = managers.pop(session_id, None)
+    if manager is not None:
+        await manager.kill_all()
+
+
+class _BashJob:
+    """A command running in the background in its own process group."""
+
+    _process: asyncio.subprocess.Process
+
+    _sample_interval: float = 1.0  # seconds
+    _kill_grace: float = 2.0  # seconds
+    _max_buffered_output: int = 2**20  # bytes
+
+    def __init__(self, job_id: str, command: str):
+        self.job_id = job_id
+        self.command = command
+        self.usage = ResourceUsage()
+        self.killed = False
+        self._output = bytearray()
+        self._read_offset = 0
+        self._started_at = time.monotonic()
+        self._finished_at: float | None = None
+
+    async def start(self, cwd: str | None = None):
+        self._process = await asyncio.create_subprocess_exec(
+            "/bin/bash",
+            "-c",
+            self.command,
+            start_new_session=True,
+            cwd=cwd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        self._started_at = time.monotonic()
+        self._reader = asyncio.create_task(self._read_output())
+        self._sampler = asyncio.create_task(self._sample_usage())
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def returncode(self):
+        return self._process.returncode
+
+    @property
+    def done(self):
+        return self._reader.done()
+
+    async def _read_output(self):
+        assert self._process.stdout
+        while chunk := await self._process.stdout.read(65536):
+            self._output += chunk
+            # keep only the most recent output so a chatty job can't exhaust memory
+            overflow = len(self._output) - self._max_buffered_output
+            if overflow > 0:
+                del self._output[:overflow]
+                self._read_offset = max(0, self._read_offset - overflow)
+        await self._process.wait()
+        self._finished_at = time.monotonic()
+        self._sampler.cancel()
+        self.usage = self.usage.replace(wall_time=self._finished_at - self._started_at)
+
+    async def _sample_usage(self):
+        while True:
+            if sample := sample_process_tree(self.pid):
+                self.usage = self.usage.merge(
+                    sample.replace(wall_time=time.monotonic() - self._started_at)
+                )
+            await asyncio.sleep(self._sample_interval)
+
+    def read_new_output(self):
+        """Return the output produced since the last call."""
+        output = self._output[self._read_offset :].decode(errors="replace")
+        self._read_offset = len(self._output)
+        return maybe_truncate(output)
+
+    async def wait(self, timeout: float):
+        await asyncio.wait({self._reader}, timeout=timeout)
+
+    async def kill(self):
+        """Terminate every process in the job's process group."""
+        if self.done:
+            return
+        self.killed = True
+        try:
+            os.killpg(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        await self.wait(self._kill_grace)
+        if not self.done:
+            await kill_process_tree(self.pid)
+            await self.wait(self._kill_grace)
+
+    def status(self):
+        if not self.done:
+            state = f"running (pid {self.pid})"
+        elif self.killed:
+            state = f"killed (returncode {self.returncode})"
+        else:
+            state = f"exited with returncode {self.returncode}"
+        elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        usage = self.usage.replace(wall_time=elapsed)
+        return f"job {self.job_id} `{self.command}` {state}; {usage}"
+
+
+class _BashJobManager:
+    """
+    Keeps track of the background jobs started by a bash tool, or by every bash tool of
+    a session, see `for_session`.
+    """
+
+    _max_running_jobs: int = 8
+    # finished jobs kept to report their status and output, oldest are dropped first
+    _max_finished_jobs: int = 16
+
+    # jobs are bound to the event loop that started them, like sessions
+    _sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, _BashJobManager]]" = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        self._jobs: dict[str, _BashJob] = {}
+        self._next_id = 1
+
+    @classmethod
+    def for_session(cls, session_id: str):
+        """The jobs of a session, shared by the bash tools of all of its turns."""
+        managers = cls._sessions.setdefault(asyncio.get_running_loop(), {})
+        if session_id not in managers:
+            managers[session_id] = cls()
+        return managers[session_id]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    async def start(self, command: str, cwd: str | None = None):
+        if sum(not job.done for job in self._jobs.values()) >= self._max_running_jobs:
+            raise ToolError(
+                f"Cannot start more than {self._max_running_jobs} background jobs. Wait for or kill a running job first."
+            )
+        self._prune()
+        job = _BashJob(str(self._next_id), command)
+        await job.start(cwd=cwd)
+        self._jobs[job.job_id] = job
+        self._next_id += 1
+        return job
+
+    def get(self, job_id: str | int | None):
+        if job_id is None:
+            raise ToolError("Parameter `job_id` is required for this job_action.")
+        job = self._jobs.get(str(job_id))
+        if job is None:
+            raise ToolError(f"No background job with id {job_id}.")
+        return job
+
+    def list(self):
+        return list(self._jobs.values())
+
+    async def kill_all(self):
+        """Kill every running job."""
+        await asyncio.gather(*(job.kill() for job in self._jobs.values()))
 
 
 class BashTool20250124(BaseAnthropicTool):
@@ -108,40 +443,142 @@ class BashTool20250124(BaseAnthropicTool):
     """
 
     _session: _BashSession | None
+    _jobs: _BashJobManager
 
     api_type: Literal["bash_20250124"] = "bash_20250124"
     name: Literal["bash"] = "bash"
 
     def __init__(self):
         self._session = None
+        self._jobs = _BashJobManager()
+        self._shared_jobs = False
         super().__init__()
 
+    def keep_jobs(self, session_id: str):
+        """
+        Keep background jobs with the session rather than the tool, so the tools of its
+        later turns can check on them.
+        """
+        self._jobs = _BashJobManager.for_session(session_id)
+        self._shared_jobs = True
+
+    async def close(self):
+        """Stop the bash session, and the background jobs unless they are kept."""
+        if self._session is not None:
+            await BashSessionPool.for_running_loop().release(self._session)
+            self._session = None
+        if not self._shared_jobs:
+            await self._jobs.kill_all()
+
     def to_params(self) -> Any:
         return {
             "type": self.api_type,
             "name": self.name,
         }
 
+    def access(self, tool_input: dict[str, Any]) -> ToolAccess:
+        """
+        Commands share one bash session and may read any file. The files they write
+        aren't known, so editor views can run alongside them. Any command may reach the
+        X display once DISPLAY is exported in the session, so commands use the display
+        too, only job status and output reads leave it to computer actions.
+        """
+        uses_display = tool_input.get("job_action") is None
+        return ToolAccess(
+            exclusive=frozenset({"bash", "display"} if uses_display else {"bash"}),
+            reads=frozenset({Path("/")}),
+        )
+
+    def action_of(self, tool_input: dict[str, Any]) -> str:
+        if tool_input.get("job_action") is not None:
+            return "job"
+        if tool_input.get("restart"):
+            return "restart"
+        return "background" if tool_input.get("background") else "command"
+
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        background: bool = False,
+        job_action: JobAction | None = None,
+        job_id: str | int | None = None,
+        timeout: float | None = None,
+        **kwargs,
     ):
+        if job_action is not None:
+            return await self.manage_job(job_action, job_id, timeout)
+
+        if background:
+            if command is None:
+                raise ToolError("no command provided.")
+            job = await self._jobs.start(
+                command, cwd=await asyncio.to_thread(self._session_cwd)
+            )
+            return ToolResult(
+                output=f"Started background job {job.job_id}.",
+                system=job.status(),
+            )
+
         if restart:
+            pool = BashSessionPool.for_running_loop()
             if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+                await pool.recycle(self._session)
+            # jobs run in their own process groups, they outlive the shell
+            self._session = await pool.acquire()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await BashSessionPool.for_running_loop().acquire()
 
         if command is not None:
             return await self._session.run(command)
 
         raise ToolError("no command provided.")
 
+    async def manage_job(
+        self, job_action: JobAction, job_id: str | int | None, timeout: float | None
+    ):
+        if job_action == "list":
+            jobs = self._jobs.list()
+            return CLIResult(
+                output="\n".join(job.status() for job in jobs)
+                if jobs
+                else "No background jobs."
+            )
+        if job_action not in get_args(JobAction):
+            raise ToolError(
+                f"Unrecognized job_action {job_action}. The allowed job actions are: {', '.join(get_args(JobAction))}"
+            )
+        job = self._jobs.get(job_id)
+        if job_action == "wait":
+            await job.wait(min(timeout or _BashSession._timeout, _BashSession._timeout))
+        elif job_action == "kill":
+            await job.kill()
+        return CLIResult(
+            output=job.read_new_output(), system=job.status(), usage=job.usage
+        )
+
+    def _session_cwd(self):
+        """
+        Background jobs start in the working directory of the bash session. Scans the
+        process table where the kernel doesn't list children, run it off the event loop.
+        """
+        if self._session is None or not self._session._started:
+            return None
+        # the session runs bash under a `/bin/sh` wrapper that leads its process group
+        wrapper_pid = self._session._process.pid
+        children = process_children(wrapper_pid)
+        if children is None:
+            children = group_children(wrapper_pid)
+        for pid in children or [wrapper_pid]:
+            try:
+                return os.readlink(PROC_ROOT / str(pid) / "cwd")
+            except OSError:
+                continue
+        return None
+
 
 class BashTool20241022(BashTool20250124):
     api_type: Literal["bash_20241022"] = "bash_20241022"  # pyright: ignore[reportIncompatibleVariableOverride]
@@ -1,15 +1,20 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
+from collections.abc import Sequence
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
 from .base import (
     BaseAnthropicTool,
+    ToolAccess,
     ToolError,
     ToolFailure,
     ToolResult,
 )
+from .metrics import TOOL_ERRORS, TOOL_SECONDS, WAITING_TOOL_CALLS
+from .tracing import span
 
 
 class ToolCollection:
@@ -24,11 +29,67 @@ class ToolCollection:
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
+    async def close(self):
+        """Release what the tools hold, like the bash session, once a turn is done."""
+        await asyncio.gather(*(tool.close() for tool in self.tools))
+
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
         tool = self.tool_map.get(name)
         if not tool:
+            TOOL_ERRORS.inc(tool=name)
             return ToolFailure(error=f"Tool {name} is invalid")
+        action = tool.action_of(tool_input)
         try:
-            return await tool(**tool_input)
+            with (
+                span(f"tool.{name}", action=action),
+                TOOL_SECONDS.time(tool=name, action=action),
+            ):
+                result = await tool(**tool_input)
         except ToolError as e:
-            return ToolFailure(error=e.message)
+            result = ToolFailure(error=e.message)
+        if result.error:
+            TOOL_ERRORS.inc(tool=name)
+        return result
+
+    async def run_all(
+        self, calls: Sequence[tuple[str, dict[str, Any]]]
+    ) -> list[ToolResult]:
+        """
+        Run the (name, tool_input) calls of one turn, each one as soon as the earlier
+        calls it conflicts with are done, and return their results in order.
+        """
+        accesses: list[ToolAccess] = []
+        tasks: list[asyncio.Task[ToolResult]] = []
+        for name, tool_input in calls:
+            tool = self.tool_map.get(name)
+            # invalid calls fail without running anything
+            access = tool.access(tool_input) if tool else ToolAccess()
+            dependencies = [
+                task
+                for task, earlier in zip(tasks, accesses, strict=True)
+                if access.conflicts_with(earlier)
+            ]
+            tasks.append(
+                asyncio.create_task(
+                    self._run_after(dependencies, name=name, tool_input=tool_input)
+                )
+            )
+            accesses.append(access)
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # stop the other calls when one raises or the turn is cancelled
+            for task in tasks:
+                task.cancel()
+
+    async def _run_after(
+        self,
+        dependencies: list[asyncio.Task[ToolResult]],
+        *,
+        name: str,
+        tool_input: dict[str, Any],
+    ) -> ToolResult:
+        if dependencies:
+            with WAITING_TOOL_CALLS.track():
+                await asyncio.wait(dependencies)
+        return await self.run(name=name, tool_input=tool_input)
@@ -5,13 +5,20 @@ import shlex
 import shutil
 from enum import StrEnum
 from pathlib import Path
-from typing import Literal, TypedDict, cast, get_args
+from typing import Any, Literal, TypedDict, cast, get_args
 from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param, BetaToolUnionParam
 
-from .base import BaseAnthropicTool, ToolError, ToolResult
-from .run import run
+from .base import BaseAnthropicTool, ToolAccess, ToolError, ToolResult
+from .metrics import (
+    SCREENSHOT_BYTES,
+    SCREENSHOT_CAPTURE_SECONDS,
+    SCREENSHOT_ENCODE_SECONDS,
+)
+from .proc import ResourceUsage
+from .run import run_exec, split_command
+from .tracing import span
 
 OUTPUT_DIR = "/tmp/outputs"
 
@@ -125,6 +132,14 @@ class BaseComputerTool:
 
         self.xdotool = f"{self._display_prefix}xdotool"
 
+    def access(self, tool_input: dict[str, Any]) -> ToolAccess:
+        """Actions use the display, one at a time."""
+        return ToolAccess(exclusive=frozenset({"display"}))
+
+    def action_of(self, tool_input: dict[str, Any]) -> str:
+        action = tool_input.get("action")
+        return action if isinstance(action, str) and action.isidentifier() else ""
+
     async def __call__(
         self,
         *,
@@ -172,11 +187,15 @@ class BaseComputerTool:
                     results.append(
                         await self.shell(" ".join(command_parts), take_screenshot=False)
                     )
-                screenshot_base64 = (await self.screenshot()).base64_image
+                screenshot = await self.screenshot()
                 return ToolResult(
                     output="".join(result.output or "" for result in results),
                     error="".join(result.error or "" for result in results),
-                    base64_image=screenshot_base64,
+                    base64_image=screenshot.base64_image,
+                    usage=sum(
+                        (result.usage for result in results if result.usage),
+                        start=screenshot.usage or ResourceUsage(),
+                    ),
                 )
 
         if action in (
@@ -234,32 +253,54 @@ class BaseComputerTool:
             # Fall back to scrot if gnome-screenshot isn't available
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
 
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
-        if self._scaling_enabled:
-            x, y = self.scale_coordinates(
-                ScalingSource.COMPUTER, self.width, self.height
-            )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
+        with span("screenshot.capture"), SCREENSHOT_CAPTURE_SECONDS.time():
+            result = await self.shell(screenshot_cmd, take_screenshot=False)
+        with span("screenshot.encode"), SCREENSHOT_ENCODE_SECONDS.time():
+            if self._scaling_enabled:
+                x, y = self.scale_coordinates(
+                    ScalingSource.COMPUTER, self.width, self.height
+                )
+                resize = await self.shell(
+                    f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
+                )
+                if result.usage and resize.usage:
+                    result = result.replace(usage=result.usage + resize.usage)
+            if path.exists():
+                base64_image = base64.b64encode(path.read_bytes()).decode()
+            else:
+                base64_image = None
 
-        if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
+        if base64_image is not None:
+            SCREENSHOT_BYTES.observe(len(base64_image))
+            return result.replace(base64_image=base64_image)
         raise ToolError(f"Failed to take screenshot: {result.error}")
 
+    async def settle(self):
+        """Delay to let things settle before taking a screenshot."""
+        with span("settle"):
+            await asyncio.sleep(self._screenshot_delay)
+
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
+        # the computer tool only issues simple commands, so skip the `/bin/sh` wrapper
+        try:
+            argv, env = split_command(command)
+        except ValueError as e:
+            raise ToolError(f"Invalid command `{command}`: {e}") from None
+        with span("exec", program=Path(argv[0]).name if argv else ""):
+            _, stdout, stderr, usage = await run_exec(argv, env=env)
         base64_image = None
 
         if take_screenshot:
-            # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
-
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+            await self.settle()
+            screenshot = await self.screenshot()
+            base64_image = screenshot.base64_image
+            if screenshot.usage:
+                usage += screenshot.usage
+
+        return ToolResult(
+            output=stdout, error=stderr, base64_image=base64_image, usage=usage
+        )
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
@@ -457,8 +498,16 @@ class ComputerTool20251124(ComputerTool20250124):
             # Crop using ImageMagick: convert input -crop WxH+X+Y output
             width = x1 - x0
             height = y1 - y0
-            crop_cmd = f"convert {temp_path} -crop {width}x{height}+{x0}+{y0} +repage {cropped_path}"
-            await run(crop_cmd)
+            await run_exec(
+                [
+                    "convert",
+                    str(temp_path),
+                    "-crop",
+                    f"{width}x{height}+{x0}+{y0}",
+                    "+repage",
+                    str(cropped_path),
+                ]
+            )
 
             if cropped_path.exists():
                 cropped_base64 = base64.b64encode(cropped_path.read_bytes()).decode()
@@ -1,9 +1,19 @@
-from collections import defaultdict
+import asyncio
+import functools
+import os
+import tempfile
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
 from pathlib import Path
-from typing import Any, Literal, get_args
+from typing import Any, Literal, TypeVar, cast, get_args
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .base import BaseAnthropicTool, CLIResult, ToolAccess, ToolError, ToolResult
+from .history import EditHistory, Patch
+from .line_index import LINE_INDEXES, LineIndex
+from .listing import DIRECTORY_LISTINGS
+from .run import TRUNCATED_MESSAGE, maybe_truncate
+from .search import SEARCH_INDEXES, search
 
 Command = Literal[
     "view",
@@ -11,9 +21,41 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "multi_edit",
+    "search",
 ]
 
+ResultFormat = Literal["snippet", "diff"]
+
+T = TypeVar("T")
+
+# commands that don't write, they can run alongside others
+READ_COMMANDS = ("view", "search")
+
+
+def _umask() -> int:
+    """
+    New files are created with the permissions `open` would give them, rather than the
+    owner-only ones of `mkstemp`. Setting the umask to read it back would race with
+    other threads creating files, so it is read from procfs.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    return 0o022
+
+
+@functools.cache
+def _executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+
 SNIPPET_LINES: int = 4
+DIFF_CONTEXT_LINES: int = 1
 
 class EditTool20250124(BaseAnthropicTool):
     """
@@ -22,18 +64,48 @@ class EditTool20250124(BaseAnthropicTool):
     api_type: Literal["text_editor_20250124"] = "text_editor_20250124"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    # "snippet" shows `cat -n` lines around an edit, "diff" a minimal unified diff
+    result_format: ResultFormat = (
+        "diff" if os.getenv("EDITOR_RESULT_FORMAT") == "diff" else "snippet"
+    )
+    max_result_bytes: int = int(os.getenv("EDITOR_MAX_RESULT_BYTES") or 16000)
+
+    # file I/O and string processing run in these threads to keep the event loop free,
+    # they are started on first use
+    io_workers: int = int(os.getenv("EDITOR_IO_WORKERS") or 4)
+
+    _file_history: EditHistory
+    _edit_lock: asyncio.Lock
 
     def __init__(self):
-        self._file_history = defaultdict(list)
+        self._file_history = EditHistory()
+        # edits run one at a time, so each one reads what the previous one wrote
+        self._edit_lock = asyncio.Lock()
         super().__init__()
 
+    def persist_history(self, directory: Path):
+        """Keep the edit history in `directory`, loading what an earlier editor saved there."""
+        self._file_history = EditHistory(directory)
+
     def to_params(self) -> Any:
         return {
             "name": self.name,
             "type": self.api_type,
         }
 
+    def access(self, tool_input: dict[str, Any]) -> ToolAccess:
+        path = tool_input.get("path")
+        if not isinstance(path, str) or not Path(path).is_absolute():
+            # rejected without touching any file
+            return ToolAccess()
+        if tool_input.get("command") in READ_COMMANDS:
+            return ToolAccess(reads=frozenset({Path(path)}))
+        return ToolAccess(writes=frozenset({Path(path)}))
+
+    def action_of(self, tool_input: dict[str, Any]) -> str:
+        command = tool_input.get("command")
+        return command if command in get_args(Command) else "invalid"
+
     async def __call__(
         self,
         *,
@@ -44,17 +116,65 @@ class EditTool20250124(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict[str, Any]] | None = None,
+        query: str | None = None,
         **kwargs,
     ):
-        _path = Path(path)
+        call = functools.partial(
+            self._run_command,
+            command,
+            Path(path),
+            file_text=file_text,
+            view_range=view_range,
+            old_str=old_str,
+            new_str=new_str,
+            insert_line=insert_line,
+            edits=edits,
+            query=query,
+        )
+        if command == "search":
+            # building the index of a large directory takes a while, searches get
+            # their own thread so that they don't hold up the other commands
+            return await self._run_in_thread(call, _executor("editor-search", 1))
+        if command in READ_COMMANDS:
+            return await self._run_in_thread(call)
+        async with self._edit_lock:
+            return await self._run_in_thread(call)
+
+    async def _run_in_thread(
+        self, call: Callable[[], T], executor: ThreadPoolExecutor | None = None
+    ) -> T:
+        future = asyncio.get_running_loop().run_in_executor(
+            executor or _executor("editor-io", self.io_workers), call
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the thread can't be interrupted, wait for it before releasing the lock
+            await asyncio.wait([future])
+            raise
+
+    def _run_command(
+        self,
+        command: Command,
+        _path: Path,
+        *,
+        file_text: str | None,
+        view_range: list[int] | None,
+        old_str: str | None,
+        new_str: str | None,
+        insert_line: int | None,
+        edits: list[dict[str, Any]] | None,
+        query: str | None,
+    ) -> ToolResult:
         self.validate_path(command, _path)
         if command == "view":
-            return await self.view(_path, view_range)
+            return self.view(_path, view_range)
         elif command == "create":
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._file_history.push(_path, file_text, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -72,6 +192,14 @@ class EditTool20250124(BaseAnthropicTool):
             return self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
             return self.undo_edit(_path)
+        elif command == "multi_edit":
+            if not edits:
+                raise ToolError("Parameter `edits` is required for command: multi_edit")
+            return self.multi_edit(_path, edits)
+        elif command == "search":
+            if not query:
+                raise ToolError("Parameter `query` is required for command: search")
+            return CLIResult(output=maybe_truncate(search(_path, query)))
         raise ToolError(
             f"Unrecognized command {command}. The allowed commands for the {self.name} tool are: {', '.join(get_args(Command))}"
         )
@@ -91,33 +219,38 @@ class EditTool20250124(BaseAnthropicTool):
                 f"File already exists at: {path}. Cannot overwrite files using command `create`."
             )
         if path.is_dir():
-            if command != "view":
+            if command not in ("view", "search"):
                 raise ToolError(
-                    f"The path {path} is a directory and only the `view` command can be used on directories"
+                    f"The path {path} is a directory and only the `view` and `search` commands can be used on directories"
                 )
 
-    async def view(self, path: Path, view_range: list[int] | None = None):
+    def view(self, path: Path, view_range: list[int] | None = None):
         if path.is_dir():
             if view_range:
                 raise ToolError(
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
+            try:
+                listing = DIRECTORY_LISTINGS.get(path)
+            except OSError as e:
+                return CLIResult(error=f"Ran into {e} while trying to list {path}")
+            return CLIResult(
+                output=f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{listing}\n"
             )
-            if not stderr:
-                stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
-            return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
         init_line = 1
         if view_range:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
                 raise ToolError(
                     "Invalid `view_range`. It should be a list of two integers."
                 )
-            file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
+            # only the requested lines are read when the file can be indexed
+            index = self._line_index(path)
+            if index is None:
+                file_lines = self.read_file(path).split("\n")
+                n_lines_file = len(file_lines)
+            else:
+                n_lines_file = index.n_lines
             init_line, final_line = view_range
             if init_line < 1 or init_line > n_lines_file:
                 raise ToolError(
@@ -132,9 +265,13 @@ class EditTool20250124(BaseAnthropicTool):
                     f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
                 )
             if final_line == -1:
-                file_content = "\n".join(file_lines[init_line - 1 :])
-            else:
+                final_line = n_lines_file
+            if index is None:
                 file_content = "\n".join(file_lines[init_line - 1 : final_line])
+            else:
+                file_content = index.read_lines(init_line, final_line)
+        else:
+            file_content = self.read_file(path)
 
         return CLIResult(
             output=self._make_output(file_content, str(path), init_line=init_line)
@@ -144,26 +281,15 @@ class EditTool20250124(BaseAnthropicTool):
         file_content = self.read_file(path).expandtabs()
         old_str = old_str.expandtabs()
         new_str = new_str.expandtabs() if new_str is not None else ""
-
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
-            raise ToolError(
-                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
-            )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
-            raise ToolError(
-                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
-            )
+        self._validate_old_str(file_content, old_str, path)
 
         new_file_content = file_content.replace(old_str, new_str)
         self.write_file(path, new_file_content)
-        self._file_history[path].append(file_content)
+        self._file_history.push(path, file_content, new_file_content)
+        if self.result_format == "diff":
+            return self._diff_result(
+                f"The file {path} has been edited.", file_content, new_file_content
+            )
 
         replacement_line = file_content.split(old_str)[0].count("\n")
         start_line = max(0, replacement_line - SNIPPET_LINES)
@@ -175,18 +301,66 @@ class EditTool20250124(BaseAnthropicTool):
             snippet, f"a snippet of {path}", start_line + 1
         )
         success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
-        return CLIResult(output=success_msg)
+        return CLIResult(output=self._cap(success_msg))
+
+    def multi_edit(self, path: Path, edits: list[dict[str, Any]]):
+        """
+        Apply str_replace (`old_str`, `new_str`) and insert (`insert_line`, `new_str`)
+        edits in order to one copy of the file, and write it only if all of them apply.
+        """
+        file_content = self.read_file(path).expandtabs()
+        new_file_content = file_content
+        for i, edit in enumerate(edits, 1):
+            try:
+                new_file_content = self._apply_edit(new_file_content, path, edit)
+            except ToolError as e:
+                raise ToolError(
+                    f"No edits were performed, edit {i} of {len(edits)} failed: {e.message}"
+                ) from None
+
+        self.write_file(path, new_file_content)
+        self._file_history.push(path, file_content, new_file_content)
+        return self._diff_result(
+            f"The file {path} has been edited with {len(edits)} edits.",
+            file_content,
+            new_file_content,
+        )
+
+    def _apply_edit(self, file_content: str, path: Path, edit: dict[str, Any]) -> str:
+        if not isinstance(edit, dict):
+            raise ToolError(f"Invalid edit {edit!r}, it should be an object.")
+        new_str = edit.get("new_str")
+        if "insert_line" in edit:
+            insert_line = edit["insert_line"]
+            if not isinstance(insert_line, int) or not isinstance(new_str, str):
+                raise ToolError(
+                    "An insert edit needs an integer `insert_line` and a string `new_str`."
+                )
+            file_text_lines = file_content.split("\n")
+            self._validate_insert_line(insert_line, len(file_text_lines))
+            return "\n".join(
+                file_text_lines[:insert_line]
+                + new_str.expandtabs().split("\n")
+                + file_text_lines[insert_line:]
+            )
+        old_str = edit.get("old_str")
+        if not isinstance(old_str, str) or not isinstance(new_str, str | None):
+            raise ToolError(
+                "An edit needs either `old_str` and `new_str` strings, or `insert_line` and `new_str`."
+            )
+        old_str = old_str.expandtabs()
+        self._validate_old_str(file_content, old_str, path)
+        return file_content.replace(old_str, (new_str or "").expandtabs())
 
     def insert(self, path: Path, insert_line: int, new_str: str):
+        # reject an invalid line before reading the whole file when it is indexed
+        if index := self._line_index(path):
+            self._validate_insert_line(insert_line, index.n_lines)
         file_text = self.read_file(path).expandtabs()
         new_str = new_str.expandtabs()
         file_text_lines = file_text.split("\n")
         n_lines_file = len(file_text_lines)
-
-        if insert_line < 0 or insert_line > n_lines_file:
-            raise ToolError(
-                f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
-            )
+        self._validate_insert_line(insert_line, n_lines_file)
 
         new_str_lines = new_str.split("\n")
         new_file_text_lines = (
@@ -204,7 +378,11 @@ class EditTool20250124(BaseAnthropicTool):
         snippet = "\n".join(snippet_lines)
 
         self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        self._file_history.push(path, file_text, new_file_text)
+        if self.result_format == "diff":
+            return self._diff_result(
+                f"The file {path} has been edited.", file_text, new_file_text
+            )
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -213,17 +391,62 @@ class EditTool20250124(BaseAnthropicTool):
             max(1, insert_line - SNIPPET_LINES + 1),
         )
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
-        return CLIResult(output=success_msg)
+        return CLIResult(output=self._cap(success_msg))
 
     def undo_edit(self, path: Path):
-        if not self._file_history[path]:
+        if path not in self._file_history:
             raise ToolError(f"No edit history found for {path}.")
-        old_text = self._file_history[path].pop()
+        file_text = self.read_file(path)
+        old_text = cast(str, self._file_history.pop(path))
         self.write_file(path, old_text)
+        message = f"Last edit to {path} undone successfully."
+        if self.result_format == "diff":
+            return self._diff_result(message, file_text, old_text)
+
+        # show only the lines the undo restored
+        first, _, _, groups = self._line_diff(file_text, old_text, 0)
+        changes = [op for group in groups for op in group]
+        first_line = first + min((j1 for *_, j1, _ in changes), default=0)
+        last_line = first + max((j2 for *_, j2 in changes), default=0) - 1
+        start_line = max(0, first_line - SNIPPET_LINES)
+        end_line = max(first_line, last_line) + SNIPPET_LINES
+        snippet = "\n".join(old_text.split("\n")[start_line : end_line + 1])
         return CLIResult(
-            output=f"Last edit to {path} undone successfully. {self._make_output(old_text, str(path))}"
+            output=self._cap(
+                f"{message} {self._make_output(snippet, f'a snippet of {path}', start_line + 1)}"
+            )
         )
 
+    def _validate_old_str(self, file_content: str, old_str: str, path: Path):
+        occurrences = file_content.count(old_str)
+        if occurrences == 0:
+            raise ToolError(
+                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
+            )
+        elif occurrences > 1:
+            file_content_lines = file_content.split("\n")
+            lines = [
+                idx + 1
+                for idx, line in enumerate(file_content_lines)
+                if old_str in line
+            ]
+            raise ToolError(
+                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+            )
+
+    def _validate_insert_line(self, insert_line: int, n_lines_file: int):
+        if insert_line < 0 or insert_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
+            )
+
+    def _line_index(self, path: Path) -> LineIndex | None:
+        """The cached line index of a file, or None if it can't be indexed."""
+        try:
+            return LINE_INDEXES.get(path)
+        except (OSError, ValueError):
+            return None
+
     def read_file(self, path: Path):
         try:
             return path.read_text()
@@ -231,10 +454,82 @@ class EditTool20250124(BaseAnthropicTool):
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
     def write_file(self, path: Path, file: str):
+        """
+        Write through a temporary file renamed over `path`, so views, which don't wait
+        for edits, never read a partly written file. An existing file keeps its
+        permissions and a symlink is written through to its target.
+        """
         try:
-            path.write_text(file)
+            target = Path(os.path.realpath(path))
+            try:
+                mode = target.stat().st_mode
+            except FileNotFoundError:
+                mode = None
+            fd, temp_path = tempfile.mkstemp(
+                dir=target.parent, prefix=f".{target.name}."
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(file)
+                os.chmod(temp_path, mode if mode is not None else 0o666 & ~_umask())
+                os.replace(temp_path, target)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+        LINE_INDEXES.invalidate(path)
+        SEARCH_INDEXES.invalidate(path)
+
+    def _diff_result(self, message: str, old_text: str, new_text: str):
+        diff = self._make_diff(old_text, new_text)
+        if not diff:
+            return CLIResult(output=f"{message} No lines changed.")
+        return CLIResult(output=self._cap(f"{message} Here's the diff:\n{diff}\n"))
+
+    def _line_diff(self, old_text: str, new_text: str, context: int):
+        """
+        The grouped line opcodes of the lines around the single span that differs,
+        offset by the index of the first line compared.
+        """
+        patch = Patch.between(old_text, new_text)
+        old_lines = old_text.split("\n")
+        new_lines = new_text.split("\n")
+        first = max(0, old_text.count("\n", 0, patch.start) - context)
+        n_tail = max(0, old_text.count("\n", patch.end) - context)
+        old_window = old_lines[first : len(old_lines) - n_tail]
+        new_window = new_lines[first : len(new_lines) - n_tail]
+        matcher = SequenceMatcher(None, old_window, new_window, autojunk=False)
+        return first, old_window, new_window, list(matcher.get_grouped_opcodes(context))
+
+    def _make_diff(self, old_text: str, new_text: str) -> str:
+        """A unified diff of the lines that changed, without file headers."""
+        first, old_window, new_window, groups = self._line_diff(
+            old_text, new_text, DIFF_CONTEXT_LINES
+        )
+        diff_lines = []
+        for group in groups:
+            i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+            # an empty range starts at the line before it, like `diff -u`
+            old_start = first + i1 + (1 if i2 > i1 else 0)
+            new_start = first + j1 + (1 if j2 > j1 else 0)
+            diff_lines.append(f"@@ -{old_start},{i2 - i1} +{new_start},{j2 - j1} @@")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    diff_lines.extend(f" {line}" for line in old_window[i1:i2])
+                    continue
+                diff_lines.extend(f"-{line}" for line in old_window[i1:i2])
+                diff_lines.extend(f"+{line}" for line in new_window[j1:j2])
+        return "\n".join(diff_lines)
+
+    def _cap(self, output: str) -> str:
+        """Clip an edit result to `max_result_bytes` of UTF-8."""
+        encoded = output.encode()
+        if len(encoded) <= self.max_result_bytes:
+            return output
+        return (
+            encoded[: self.max_result_bytes].decode(errors="ignore") + TRUNCATED_MESSAGE
+        )
 
     def _make_output(
         self,
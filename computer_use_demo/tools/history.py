@@ -0,0 +1,276 @@
+"""Bounded edit history that stores reverse patches instead of copies of files."""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_CHUNK_SIZE = 2**16
+# counted for every patch on top of its text, so empty patches aren't free
+_PATCH_OVERHEAD = 64
+
+
+def _common_prefix_len(a: str, b: str, limit: int) -> int:
+    start = 0
+    # skip over equal chunks, then narrow down within the first differing one
+    while start < limit:
+        end = min(start + _CHUNK_SIZE, limit)
+        if a[start:end] != b[start:end]:
+            break
+        start = end
+    else:
+        return limit
+    while a[start] == b[start]:
+        start += 1
+    return start
+
+
+def _common_suffix_len(a: str, b: str, limit: int) -> int:
+    length = 0
+    while length < limit:
+        end = min(length + _CHUNK_SIZE, limit)
+        if a[len(a) - end : len(a) - length] != b[len(b) - end : len(b) - length]:
+            break
+        length = end
+    else:
+        return limit
+    while a[len(a) - length - 1] == b[len(b) - length - 1]:
+        length += 1
+    return length
+
+
+@dataclass(frozen=True)
+class Patch:
+    """Replaces `text[start:end]` with `replacement`."""
+
+    start: int
+    end: int
+    replacement: str
+
+    @classmethod
+    def between(cls, source: str, target: str) -> "Patch":
+        """Returns the smallest single-hunk patch that turns `source` into `target`."""
+        limit = min(len(source), len(target))
+        prefix = _common_prefix_len(source, target, limit)
+        suffix = _common_suffix_len(source, target, limit - prefix)
+        return cls(prefix, len(source) - suffix, target[prefix : len(target) - suffix])
+
+    def apply(self, text: str) -> str:
+        return text[: self.start] + self.replacement + text[self.end :]
+
+    def size(self):
+        return _PATCH_OVERHEAD + len(self.replacement)
+
+
+@dataclass
+class _Entry:
+    sequence: int
+    # turns the content written by the edit back into the content it replaced
+    undo: Patch
+    # turns the content the edit replaced into the content written by the previous
+    # edit, when the file was changed outside of the editor in between
+    bridge: Patch | None = None
+
+    def size(self):
+        return self.undo.size() + (self.bridge.size() if self.bridge else 0)
+
+
+@dataclass
+class _FileHistory:
+    # the content written by the most recent edit, the undo patches apply to it
+    latest: str
+    entries: list[_Entry] = field(default_factory=list)
+
+    def size(self):
+        return len(self.latest) + sum(entry.size() for entry in self.entries)
+
+    def to_json(self, path: Path):
+        return {
+            "path": str(path),
+            "latest": self.latest,
+            "entries": [
+                [
+                    entry.sequence,
+                    [entry.undo.start, entry.undo.end, entry.undo.replacement],
+                    [entry.bridge.start, entry.bridge.end, entry.bridge.replacement]
+                    if entry.bridge
+                    else None,
+                ]
+                for entry in self.entries
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data) -> tuple[Path, "_FileHistory"]:
+        return Path(data["path"]), cls(
+            latest=data["latest"],
+            entries=[
+                _Entry(sequence, Patch(*undo), Patch(*bridge) if bridge else None)
+                for sequence, undo, bridge in data["entries"]
+            ],
+        )
+
+
+class EditHistory:
+    """
+    Per-file undo history of an editor, kept as reverse patches against the content of
+    the most recent edit. Sizes are counted in characters; the oldest entries are
+    dropped once a file or the whole history exceeds its cap, but the most recent
+    entry of a file is always kept. If `directory` is set, the history of each file is
+    saved to a file of its own there whenever it changes, and loaded when the file is
+    first looked up, so only the histories in use are read and count towards the caps.
+    The caps can be set with the `EDIT_HISTORY_MAX_FILE_SIZE` and
+    `EDIT_HISTORY_MAX_TOTAL_SIZE` environment variables.
+    """
+
+    max_file_size: int = int(os.getenv("EDIT_HISTORY_MAX_FILE_SIZE") or 8 * 2**20)
+    max_total_size: int = int(os.getenv("EDIT_HISTORY_MAX_TOTAL_SIZE") or 64 * 2**20)
+
+    def __init__(self, directory: Path | None = None):
+        self.directory = directory
+        self._files: dict[Path, _FileHistory] = {}
+        # the paths whose saved history was looked for
+        self._loaded: set[Path] = set()
+        self._sequence = 0
+
+    def push(self, path: Path, old_text: str, new_text: str):
+        """Record an edit of `path` from `old_text` to `new_text`."""
+        # ordered after the entries an earlier editor saved, which are loaded lazily
+        self._sequence = max(self._sequence + 1, time.time_ns())
+        entry = _Entry(self._sequence, Patch.between(new_text, old_text))
+        history = self._history(path)
+        if history is None:
+            history = self._files[path] = _FileHistory(latest=new_text)
+        else:
+            if history.latest != old_text:
+                entry.bridge = Patch.between(old_text, history.latest)
+            history.latest = new_text
+        history.entries.append(entry)
+        for changed_path in {path, *self._evict(path)}:
+            self._save(changed_path)
+
+    def pop(self, path: Path) -> str | None:
+        """Undo the most recent edit of `path`, returning the content it replaced."""
+        history = self._history(path)
+        if history is None or not history.entries:
+            return None
+        entry = history.entries.pop()
+        old_text = entry.undo.apply(history.latest)
+        history.latest = entry.bridge.apply(old_text) if entry.bridge else old_text
+        if not history.entries:
+            del self._files[path]
+        self._save(path)
+        return old_text
+
+    def __contains__(self, path: Path):
+        return self._history(path) is not None
+
+    def __getitem__(self, path: Path) -> list[str]:
+        """The contents replaced by each edit of `path` that can be undone, oldest first."""
+        history = self._history(path)
+        if history is None:
+            return []
+        versions = []
+        latest = history.latest
+        for entry in reversed(history.entries):
+            old_text = entry.undo.apply(latest)
+            versions.append(old_text)
+            latest = entry.bridge.apply(old_text) if entry.bridge else old_text
+        return versions[::-1]
+
+    def clear(self):
+        self._files.clear()
+        if self.directory is not None and self.directory.is_dir():
+            for history_file in self.directory.glob("*.json"):
+                history_file.unlink(missing_ok=True)
+
+    def size(self):
+        return sum(history.size() for history in self._files.values())
+
+    def _evict(self, path: Path) -> set[Path]:
+        """Drop the oldest entries over the caps, returning the files that lost any."""
+        history = self._files[path]
+        while len(history.entries) > 1 and history.size() > self.max_file_size:
+            self._drop_oldest(path)
+        evicted: set[Path] = set()
+        while self.size() > self.max_total_size:
+            evictable = [
+                (history.entries[0].sequence, evict_path)
+                for evict_path, history in self._files.items()
+                if len(history.entries) > 1 or evict_path != path
+            ]
+            if not evictable:
+                break
+            evict_path = min(evictable)[1]
+            self._drop_oldest(evict_path)
+            evicted.add(evict_path)
+        return evicted
+
+    def _drop_oldest(self, path: Path):
+        history = self._files[path]
+        del history.entries[0]
+        if not history.entries:
+            del self._files[path]
+
+    def _file_of(self, path: Path) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{hashlib.sha1(str(path).encode()).hexdigest()}.json"
+
+    def _save(self, path: Path):
+        """Write the history of one file, or remove it once it has no entries left."""
+        if self.directory is None:
+            return
+        history_file = self._file_of(path)
+        history = self._files.get(path)
+        if history is None:
+            history_file.unlink(missing_ok=True)
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp_path = history_file.with_name(f".{history_file.name}.tmp")
+        temp_path.write_text(json.dumps(history.to_json(path)))
+        os.replace(temp_path, history_file)
+
+    def _history(self, path: Path) -> _FileHistory | None:
+        if self.directory is not None and path not in self._loaded:
+            self._loaded.add(path)
+            self._load(path)
+        return self._files.get(path)
+
+    def _load(self, path: Path):
+        history_file = self._file_of(path)
+        if path in self._files or not history_file.exists():
+            return
+        # a history that can't be read is dropped, it only backs undo_edit
+        try:
+            saved_path, history = _FileHistory.from_json(
+                json.loads(history_file.read_text())
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            history_file.unlink(missing_ok=True)
+            return
+        if saved_path != path or not history.entries:
+            return
+        self._files[path] = history
+        self._sequence = max(
+            self._sequence, *(entry.sequence for entry in history.entries)
+        )
+
+
+def remove_stale_histories(directory: Path, max_age: float):
+    """Remove the saved histories in `directory` not changed for `max_age` seconds."""
+    if not directory.is_dir():
+        return
+    cutoff = time.time() - max_age
+    for entry in directory.iterdir():
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except OSError:
+            continue
@@ -0,0 +1,94 @@
+"""Line offset indexes to read line ranges of large files without loading them."""
+
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from pathlib import Path
+
+
+class LineIndex:
+    """
+    The start offset of every line of a file, with lines counted like
+    `str.split("\n")`: a trailing newline starts one last empty line.
+    """
+
+    def __init__(self, path: Path):
+        stat = path.stat()
+        self.path = path
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+        self._starts = array("Q", [0])
+        if not self.size:
+            return
+        with (
+            path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            # the running total ends with the file size, which only starts a line
+            # when the file ends with a newline
+            self._starts = array(
+                "Q", accumulate(map(len, iter(mm.readline, b"")), initial=0)
+            )
+            if mm[-1:] != b"\n":
+                self._starts.pop()
+
+    @property
+    def n_lines(self):
+        return len(self._starts)
+
+    def read_lines(self, first: int, last: int) -> str:
+        """Read lines `first` to `last` (1-based, inclusive) through an mmap."""
+        start = self._starts[first - 1]
+        # exclude the newline that ends the last line, the file may not end with one
+        end = self._starts[last] - 1 if last < self.n_lines else self.size
+        if start >= end:
+            return ""
+        with (
+            self.path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            content = mm[start:end].decode(errors="replace")
+        # match the universal newlines of `Path.read_text`
+        return content.replace("\r\n", "\n").removesuffix("\r")
+
+    def nbytes(self):
+        return self._starts.itemsize * len(self._starts)
+
+
+class LineIndexCache:
+    """An LRU cache of line indexes, invalidated when a file's mtime or size changes."""
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self._indexes: OrderedDict[Path, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> LineIndex:
+        """Return the index of a file, building it if the file changed. Raises OSError."""
+        stat = path.stat()
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is not None and index.key == (stat.st_mtime_ns, stat.st_size):
+                self._indexes.move_to_end(path)
+                return index
+        # built without the lock, so a large file doesn't hold up other lookups
+        index = LineIndex(path)
+        with self._lock:
+            self._indexes[path] = index
+            self._indexes.move_to_end(path)
+            while (
+                len(self._indexes) > 1
+                and sum(index.nbytes() for index in self._indexes.values())
+                > self.max_bytes
+            ):
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            self._indexes.pop(path, None)
+
+
+LINE_INDEXES = LineIndexCache()
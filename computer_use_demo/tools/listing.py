@@ -0,0 +1,125 @@
+"""In-process directory listings for the editor, cached until a directory changes."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+MAX_ENTRIES = 250
+# directories modified this recently may change again within their mtime resolution
+_RACY_MTIME_NS = 2 * 10**9
+
+
+@dataclass(frozen=True)
+class DirectoryListing:
+    text: str
+    # the mtime of every directory the listing read, it is valid while they match
+    mtimes: tuple[tuple[str, int], ...]
+
+    def is_current(self):
+        try:
+            return all(
+                os.stat(path).st_mtime_ns == mtime for path, mtime in self.mtimes
+            )
+        except OSError:
+            return False
+
+
+def _visible_entries(path: str) -> list[os.DirEntry]:
+    with os.scandir(path) as it:
+        return sorted(
+            (entry for entry in it if not entry.name.startswith(".")),
+            key=lambda entry: entry.name,
+        )
+
+
+def _is_dir(entry: os.DirEntry):
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def _summary(entries: list[os.DirEntry]):
+    n_dirs = sum(map(_is_dir, entries))
+    n_files = len(entries) - n_dirs
+    return (
+        f"{n_files} file{'s' if n_files != 1 else ''}, "
+        f"{n_dirs} director{'ies' if n_dirs != 1 else 'y'}"
+    )
+
+
+def list_directory(path: Path, max_entries: int = MAX_ENTRIES) -> DirectoryListing:
+    """
+    List the non-hidden files and directories up to 2 levels deep in `path`, like
+    `find -maxdepth 2`, with entry counts for each subdirectory. The walk stops after
+    `max_entries` entries. Raises OSError if `path` can't be read.
+    """
+    root = str(path)
+    mtimes = [(root, os.stat(root).st_mtime_ns)]
+    lines = [root]
+    n_entries = 0
+    truncated = False
+    for entry in _visible_entries(root):
+        if n_entries >= max_entries:
+            truncated = True
+            break
+        n_entries += 1
+        if not _is_dir(entry):
+            lines.append(entry.path)
+            continue
+        try:
+            mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+            children = _visible_entries(entry.path)
+        except OSError as e:
+            lines.append(f"{entry.path} ({e.strerror or 'unreadable'})")
+            continue
+        mtimes.append((entry.path, mtime))
+        lines.append(f"{entry.path} ({_summary(children)})")
+        for child in children:
+            if n_entries >= max_entries:
+                truncated = True
+                break
+            n_entries += 1
+            lines.append(child.path)
+    if truncated:
+        lines.append(
+            f"... stopped after {max_entries} entries, view a subdirectory to see more"
+        )
+    return DirectoryListing("\n".join(lines), tuple(mtimes))
+
+
+class DirectoryListingCache:
+    """An LRU cache of directory listings, walked again once a directory changes."""
+
+    def __init__(self, max_listings: int = 64):
+        self.max_listings = max_listings
+        self._listings: OrderedDict[Path, DirectoryListing] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> str:
+        """Return the listing of a directory, walking it if it changed. Raises OSError."""
+        with self._lock:
+            listing = self._listings.get(path)
+        if listing is not None and listing.is_current():
+            with self._lock:
+                if path in self._listings:
+                    self._listings.move_to_end(path)
+            return listing.text
+        # walked without the lock, so a large directory doesn't hold up other lookups
+        started_ns = time.time_ns()
+        listing = list_directory(path)
+        with self._lock:
+            if any(mtime > started_ns - _RACY_MTIME_NS for _, mtime in listing.mtimes):
+                self._listings.pop(path, None)
+                return listing.text
+            self._listings[path] = listing
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.max_listings:
+                self._listings.popitem(last=False)
+        return listing.text
+
+
+DIRECTORY_LISTINGS = DirectoryListingCache()
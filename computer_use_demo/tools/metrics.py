@@ -0,0 +1,253 @@
+"""
+In-process counters, gauges and histograms, exposed in the Prometheus text format.
+Recording is skipped when METRICS_ENABLED is 0, so instrumented code costs a flag
+check.
+"""
+
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+
+from .proc import REAPER_COUNTERS
+
+LabelValues = tuple[str, ...]
+
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+SIZE_BUCKETS = tuple(2.0**power for power in range(14, 24))
+LOOP_LAG_INTERVAL = 0.1  # seconds
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """A metric of the registry, one value for each combination of its labels."""
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        registry: "Registry | None" = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key: LabelValues, extra: str = "") -> str:
+        pairs = [
+            f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A total that only goes up, or is read from `function` when scraped."""
+
+    kind = "counter"
+
+    def __init__(self, *args, function: Callable[[], float] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.function = function
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            yield f"{self.name} {_format_value(self.function())}"
+            return
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{self._label_text(key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels: str):
+        """Count the code running in the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """The distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DURATION_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = (*sorted(buckets), math.inf)
+        # the count of each bucket, then the sum of the values
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the seconds the block took."""
+        if not self.registry.enabled:
+            yield
+            return
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{self._label_text(key, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(key)} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{self._label_text(key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry(enabled=os.getenv("METRICS_ENABLED", "1") != "0")
+
+ACTIVE_WEBSOCKETS = Gauge("websockets_active", "Open WebSocket connections.")
+ACTIVE_SESSIONS = Gauge("agent_sessions_active", "Sessions running the agent loop.")
+WAITING_TOOL_CALLS = Gauge(
+    "tool_calls_waiting", "Tool calls queued behind conflicting calls of their turn."
+)
+API_REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds", "Latency of Messages API calls.", ["model"]
+)
+API_TOKENS = Counter(
+    "api_tokens_total",
+    "Tokens of Messages API calls, by kind: input, output, cache_read or cache_creation.",
+    ["model", "kind"],
+)
+TOOL_SECONDS = Histogram(
+    "tool_duration_seconds", "Latency of tool calls.", ["tool", "action"]
+)
+TOOL_ERRORS = Counter("tool_errors_total", "Tool calls that failed.", ["tool"])
+SCREENSHOT_CAPTURE_SECONDS = Histogram(
+    "screenshot_capture_duration_seconds", "Time to capture a screenshot."
+)
+SCREENSHOT_ENCODE_SECONDS = Histogram(
+    "screenshot_encode_duration_seconds",
+    "Time to scale and base64 encode a screenshot.",
+)
+SCREENSHOT_BYTES = Histogram(
+    "screenshot_size_bytes", "Size of the encoded screenshots.", buckets=SIZE_BUCKETS
+)
+DB_COMMIT_SECONDS = Histogram(
+    "db_commit_duration_seconds", "Latency of database commits.", ["operation"]
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    f"How late a timer firing every {LOOP_LAG_INTERVAL}s runs.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked_total",
+    "Times the event loop was blocked past the threshold of the watchdog.",
+)
+Counter(
+    "processes_reaped_total",
+    "Processes killed after a command timed out or was cancelled.",
+    function=lambda: REAPER_COUNTERS.reaped,
+)
+Counter(
+    "processes_leaked_total",
+    "Processes still running after they were sent SIGKILL.",
+    function=lambda: REAPER_COUNTERS.leaked,
+)
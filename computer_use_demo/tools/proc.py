@@ -0,0 +1,273 @@
+"""Utilities to inspect and reap process groups through procfs."""
+
+import asyncio
+import os
+import signal
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+PROC_ROOT = Path("/proc")
+_CLOCK_TICKS: int = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE_KB: int = os.sysconf("SC_PAGE_SIZE") // 1024
+# the children of processes are listed with CONFIG_PROC_CHILDREN
+_HAS_CHILDREN_FILES = (PROC_ROOT / "thread-self" / "children").exists()
+
+
+@dataclass(kw_only=True, frozen=True)
+class ResourceUsage:
+    """Represents the resources consumed by a command, zero where unavailable."""
+
+    wall_time: float = 0.0  # seconds
+    user_time: float = 0.0  # seconds
+    system_time: float = 0.0  # seconds
+    max_rss_kb: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+    def merge(self, sample: "ResourceUsage"):
+        """Returns the running maximum of this usage and a newer sample."""
+        return ResourceUsage(
+            wall_time=max(self.wall_time, sample.wall_time),
+            user_time=max(self.user_time, sample.user_time),
+            system_time=max(self.system_time, sample.system_time),
+            max_rss_kb=max(self.max_rss_kb, sample.max_rss_kb),
+            read_bytes=max(self.read_bytes, sample.read_bytes),
+            write_bytes=max(self.write_bytes, sample.write_bytes),
+        )
+
+    def __add__(self, other: "ResourceUsage"):
+        return ResourceUsage(
+            wall_time=self.wall_time + other.wall_time,
+            user_time=self.user_time + other.user_time,
+            system_time=self.system_time + other.system_time,
+            max_rss_kb=max(self.max_rss_kb, other.max_rss_kb),
+            read_bytes=self.read_bytes + other.read_bytes,
+            write_bytes=self.write_bytes + other.write_bytes,
+        )
+
+    def __sub__(self, earlier: "ResourceUsage"):
+        """Returns the counters accumulated since an earlier sample of the same processes."""
+        return ResourceUsage(
+            wall_time=max(0.0, self.wall_time - earlier.wall_time),
+            user_time=max(0.0, self.user_time - earlier.user_time),
+            system_time=max(0.0, self.system_time - earlier.system_time),
+            max_rss_kb=self.max_rss_kb,
+            read_bytes=max(0, self.read_bytes - earlier.read_bytes),
+            write_bytes=max(0, self.write_bytes - earlier.write_bytes),
+        )
+
+    def replace(self, **kwargs):
+        """Returns a new ResourceUsage with the given fields replaced."""
+        return replace(self, **kwargs)
+
+    def __str__(self):
+        return (
+            f"wall {self.wall_time:.2f}s, cpu {self.user_time:.2f}s user / "
+            f"{self.system_time:.2f}s sys, peak rss {self.max_rss_kb / 1024:.1f} MB, "
+            f"io {self.read_bytes / 2**20:.1f} MB read / "
+            f"{self.write_bytes / 2**20:.1f} MB written"
+        )
+
+
+def _read_stat(pid: int) -> list[str] | None:
+    """Returns the fields of /proc/<pid>/stat that follow the command name."""
+    try:
+        stat = (PROC_ROOT / str(pid) / "stat").read_text()
+    except OSError:
+        return None
+    # the command name is wrapped in parentheses and may itself contain spaces
+    return stat[stat.rindex(")") + 2 :].split()
+
+
+def _read_io(pid: int) -> tuple[int, int]:
+    try:
+        lines = (PROC_ROOT / str(pid) / "io").read_text().splitlines()
+    except OSError:
+        return 0, 0
+    counters = dict(line.split(": ") for line in lines)
+    return int(counters.get("read_bytes", 0)), int(counters.get("write_bytes", 0))
+
+
+def _all_processes():
+    """Yield the pid and stat fields of every process."""
+    for entry in os.scandir(PROC_ROOT):
+        if entry.name.isdigit() and (fields := _read_stat(int(entry.name))):
+            yield int(entry.name), fields
+
+
+def _group_members(pgid: int):
+    """Yield the pid and stat fields of every live process in a process group."""
+    # fields[2] is the process group, see proc(5) for the field layout
+    for pid, fields in _all_processes():
+        if int(fields[2]) == pgid:
+            yield pid, fields
+
+
+def group_children(pgid: int) -> list[int]:
+    """Return the processes of a group that are direct children of its leader."""
+    # fields[1] is the parent pid
+    return [pid for pid, fields in _group_members(pgid) if int(fields[1]) == pgid]
+
+
+def process_children(pid: int) -> list[int] | None:
+    """
+    Return the children of a process from the `children` files of its threads, or
+    None where the kernel doesn't provide them.
+    """
+    if not _HAS_CHILDREN_FILES:
+        return None
+    children: list[int] = []
+    try:
+        tasks = list((PROC_ROOT / str(pid) / "task").iterdir())
+    except OSError:
+        return children
+    for task in tasks:
+        try:
+            children += map(int, (task / "children").read_text().split())
+        except OSError:
+            # the thread exited meanwhile
+            continue
+    return children
+
+
+def _tree(pid: int):
+    """Yield the pid and stat fields of a process and of its live descendants."""
+    pending = [pid]
+    while pending:
+        process_pid = pending.pop()
+        if fields := _read_stat(process_pid):
+            yield process_pid, fields
+            pending += process_children(process_pid) or []
+
+
+def _sample(processes) -> ResourceUsage | None:
+    user_ticks = system_ticks = rss_pages = read_bytes = write_bytes = 0
+    found = False
+    for pid, fields in processes:
+        found = True
+        # utime and stime, then the cutime and cstime of the children it has reaped
+        user_ticks += int(fields[11]) + int(fields[13])
+        system_ticks += int(fields[12]) + int(fields[14])
+        rss_pages += int(fields[21])
+        process_read, process_write = _read_io(pid)
+        read_bytes += process_read
+        write_bytes += process_write
+    if not found:
+        return None
+    return ResourceUsage(
+        user_time=user_ticks / _CLOCK_TICKS,
+        system_time=system_ticks / _CLOCK_TICKS,
+        max_rss_kb=rss_pages * _PAGE_SIZE_KB,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+    )
+
+
+def sample_process_group(pgid: int) -> ResourceUsage | None:
+    """
+    Sample the cumulative usage of every live process in a process group.
+
+    CPU time and I/O include children that have already been reaped by a group
+    member, rss is the current total of the group. Returns None once the group has
+    no live processes left. It scans every process, so run it off the event loop.
+    """
+    return _sample(_group_members(pgid))
+
+
+def sample_process_tree(pid: int) -> ResourceUsage | None:
+    """
+    Sample the cumulative usage of a process and of its live descendants, like
+    `sample_process_group` but reading only their own procfs files. Descendants are
+    missed where the kernel doesn't list the children of a process.
+    """
+    return _sample(_tree(pid))
+
+
+def sample_process(pid: int) -> ResourceUsage | None:
+    """
+    Sample the cumulative usage of one process and of the children it has reaped,
+    from procfs. Returns None once the process has been reaped itself.
+    """
+    fields = _read_stat(pid)
+    return _sample([(pid, fields)] if fields else [])
+
+
+@dataclass
+class ReaperCounters:
+    """Counts of the processes killed after a command timed out or was cancelled."""
+
+    reaped: int = 0
+    # processes still running after they were sent SIGKILL
+    leaked: int = 0
+
+
+REAPER_COUNTERS = ReaperCounters()
+_LEAK_CHECK_DELAY: float = 1.0  # seconds
+
+
+def _is_running(pid: int, starttime: str | None = None):
+    """
+    Whether a process is alive, and still the one started at `starttime` rather than
+    another that reused its pid.
+    """
+    # fields[0] is the state, zombies are dead and only wait to be reaped, fields[19]
+    # the time the process started after boot
+    fields = _read_stat(pid)
+    return (
+        fields is not None
+        and fields[0] != "Z"
+        and (starttime is None or fields[19] == starttime)
+    )
+
+
+def _check_leaked(targets: dict[int, str]):
+    REAPER_COUNTERS.leaked += sum(
+        _is_running(pid, starttime) for pid, starttime in targets.items()
+    )
+
+
+def _kill_process_tree(pid: int) -> dict[int, str]:
+    """Kill the tree of a process, returning the pid and start time of each killed."""
+    children: dict[int, list[int]] = {}
+    targets: dict[int, str] = {}
+    starttimes: dict[int, str] = {}
+    for process_pid, fields in _all_processes():
+        # fields[1] is the parent pid and fields[2] the process group
+        children.setdefault(int(fields[1]), []).append(process_pid)
+        if fields[0] != "Z":
+            starttimes[process_pid] = fields[19]
+            if int(fields[2]) == pid:
+                targets[process_pid] = fields[19]
+    pending = [pid]
+    while pending:
+        parent = pending.pop()
+        for child in children.get(parent, []):
+            if child not in targets and child in starttimes:
+                targets[child] = starttimes[child]
+            pending.append(child)
+
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    for target in targets:
+        try:
+            os.kill(target, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    return targets
+
+
+async def kill_process_tree(pid: int) -> set[int]:
+    """
+    SIGKILL a process, its process group and every descendant that left the group.
+
+    `pid` must lead its own process group, see `start_new_session`. The process table
+    is scanned in a thread, it's called when the loop is busy already. Processes still
+    running shortly afterwards are counted as leaked in `REAPER_COUNTERS`.
+    """
+    targets = await asyncio.to_thread(_kill_process_tree, pid)
+    REAPER_COUNTERS.reaped += len(targets)
+    if targets:
+        asyncio.get_running_loop().call_later(_LEAK_CHECK_DELAY, _check_leaked, targets)
+    return set(targets)
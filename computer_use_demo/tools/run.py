@@ -1,6 +1,17 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import os
+import shlex
+import time
+from collections.abc import Sequence
+
+from .proc import (
+    ResourceUsage,
+    kill_process_tree,
+    sample_process,
+    sample_process_group,
+)
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
@@ -15,28 +26,185 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
     )
 
 
+class _UsageSampler:
+    """
+    Samples the usage of a command and its process group through procfs while it runs.
+
+    asyncio reaps a command as soon as it exits, after which procfs no longer has its
+    counters, so the last sample is taken once its output is closed. What a command did
+    after that sample is missed, but never charged to another one.
+    """
+
+    _interval: float = 0.2  # seconds
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.usage = ResourceUsage()
+        self._started_at = time.monotonic()
+        self._task = asyncio.create_task(self._sample_periodically())
+
+    async def _sample_periodically(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            if sample := await asyncio.to_thread(sample_process_group, self.pid):
+                self.usage = self.usage.merge(sample)
+
+    def stop(self) -> ResourceUsage:
+        """Take the last sample and return the usage of the command so far."""
+        self._task.cancel()
+        if sample := sample_process(self.pid):
+            self.usage = self.usage.merge(sample)
+        return self.usage.replace(wall_time=time.monotonic() - self._started_at)
+
+
 async def run(
     cmd: str,
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
 ):
     """Run a shell command asynchronously with a timeout."""
+    returncode, stdout, stderr, _ = await run_with_usage(
+        cmd, timeout=timeout, truncate_after=truncate_after
+    )
+    return returncode, stdout, stderr
+
+
+async def run_with_usage(
+    cmd: str,
+    timeout: float | None = 120.0,  # seconds
+    truncate_after: int | None = MAX_RESPONSE_LEN,
+) -> tuple[int, str, str, ResourceUsage]:
+    """Run a shell command like `run()`, also returning the resources it used."""
     process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
     )
+    sampler = _UsageSampler(process.pid)
+
+    async def communicate():
+        assert process.stdout and process.stderr
+        stdout, stderr = await asyncio.gather(
+            process.stdout.read(), process.stderr.read()
+        )
+        usage = sampler.stop()
+        await process.wait()
+        return stdout, stderr, usage
 
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        stdout, stderr, usage = await asyncio.wait_for(communicate(), timeout=timeout)
         return (
             process.returncode or 0,
             maybe_truncate(stdout.decode(), truncate_after=truncate_after),
             maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+            usage,
         )
     except asyncio.TimeoutError as exc:
-        try:
-            process.kill()
-        except ProcessLookupError:
-            pass
+        sampler.stop()
+        # killing only the `/bin/sh` wrapper would orphan the command itself
+        await kill_process_tree(process.pid)
+        await process.wait()
         raise TimeoutError(
             f"Command '{cmd}' timed out after {timeout} seconds"
         ) from exc
+    except asyncio.CancelledError:
+        sampler.stop()
+        await kill_process_tree(process.pid)
+        await process.wait()
+        raise
+
+
+def split_command(cmd: str) -> tuple[list[str], dict[str, str]]:
+    """Split a simple command line into its argv and leading `NAME=value` assignments."""
+    argv = shlex.split(cmd)
+    env: dict[str, str] = {}
+    while argv and "=" in argv[0] and argv[0].split("=", 1)[0].isidentifier():
+        name, value = argv.pop(0).split("=", 1)
+        env[name] = value
+    return argv, env
+
+
+async def _read_capped(
+    process: asyncio.subprocess.Process, fd: int, limit: int | None
+) -> tuple[bytes, bool]:
+    """
+    Read a pipe until EOF or until more than `limit` bytes have been read, then kill
+    the process rather than leave it blocked on a pipe no one reads.
+    """
+    stream = process.stdout if fd == 1 else process.stderr
+    assert stream
+    buffer = bytearray()
+    while chunk := await stream.read(2**16):
+        buffer += chunk
+        if limit is not None and len(buffer) > limit:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            return bytes(buffer[:limit]), True
+    return bytes(buffer), False
+
+
+def _decode_capped(output: bytes, clipped: bool):
+    if clipped:
+        # the cap may have split a multi-byte character
+        return output.decode(errors="ignore") + TRUNCATED_MESSAGE
+    return output.decode()
+
+
+async def run_exec(
+    argv: Sequence[str],
+    timeout: float | None = 120.0,  # seconds
+    truncate_after: int | None = MAX_RESPONSE_LEN,
+    env: dict[str, str] | None = None,
+) -> tuple[int, str, str, ResourceUsage]:
+    """
+    Run a command without a shell, returning like `run_with_usage()`.
+
+    Output is read into buffers capped at `truncate_after` bytes, a command writing past
+    the cap is killed. On timeout the whole process tree of the command is killed. A
+    command that can't be started fails with returncode 127 like in a shell, with the
+    error as its stderr.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **env} if env else None,
+            start_new_session=True,
+        )
+    except OSError as e:
+        return 127, "", str(e), ResourceUsage()
+    sampler = _UsageSampler(process.pid)
+
+    async def communicate():
+        (stdout, stdout_clipped), (stderr, stderr_clipped) = await asyncio.gather(
+            _read_capped(process, 1, truncate_after),
+            _read_capped(process, 2, truncate_after),
+        )
+        usage = sampler.stop()
+        await process.wait()
+        return (
+            _decode_capped(stdout, stdout_clipped),
+            _decode_capped(stderr, stderr_clipped),
+            usage,
+        )
+
+    try:
+        stdout, stderr, usage = await asyncio.wait_for(communicate(), timeout=timeout)
+    except asyncio.TimeoutError as exc:
+        sampler.stop()
+        await kill_process_tree(process.pid)
+        await process.wait()
+        raise TimeoutError(
+            f"Command '{shlex.join(argv)}' timed out after {timeout} seconds"
+        ) from exc
+    except asyncio.CancelledError:
+        sampler.stop()
+        await kill_process_tree(process.pid)
+        await process.wait()
+        raise
+
+    return process.returncode or 0, stdout, stderr, usage
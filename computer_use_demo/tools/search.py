@@ -0,0 +1,350 @@
+"""Trigram indexes to search the files under a directory without reading them all."""
+
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+MAX_FILE_SIZE = 2**20
+MAX_FILES = 20_000
+MAX_RESULTS = 50
+CONTEXT_LINES = 1
+MAX_LINE_LENGTH = 200
+# hidden directories are skipped as well
+SKIPPED_DIRS = frozenset({"node_modules", "__pycache__"})
+# the seconds an index trusts its last walk of the directory for, files written by the
+# editor are updated sooner
+UPDATE_INTERVAL = 5.0
+# roughly what a trigram costs besides its postings: a dict entry and an empty array
+_TRIGRAM_BYTES = 150
+
+
+def _trigrams(text: bytes) -> set[int]:
+    """
+    The trigrams of lowercase UTF-8 text encoded as ints, leaving out those with
+    whitespace: a query found in a line has the trigrams of its words in the words of
+    the line, and the words of a file repeat far more than its text.
+    """
+    trigrams: set[tuple[int, int, int]] = set()
+    for word in set(text.split()):
+        if len(word) > 2:
+            trigrams.update(zip(word, word[1:], word[2:]))
+    return {(a << 16) | (b << 8) | c for a, b, c in trigrams}
+
+
+@dataclass(frozen=True)
+class Match:
+    path: str
+    line: int
+    score: int
+
+
+class TrigramIndex:
+    """
+    The lowercase trigrams of every text file under `root`, updated from the file
+    mtimes and sizes by `update` at most every UPDATE_INTERVAL seconds, and from the
+    paths invalidated in between. Postings are arrays of file ids; a file that changes
+    gets a new id and the old one is left in the postings until they are compacted.
+
+    Once the postings take more than `max_bytes` they are dropped, and every file is a
+    candidate of every query: the search falls back to scanning them all.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 64 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.update_interval = UPDATE_INTERVAL
+        # held while the index is updated or queried, an update changes it in place
+        self.lock = threading.Lock()
+        # more than MAX_FILES files were found, the rest aren't indexed
+        self.truncated = False
+        self._keys: dict[str, tuple[int, int]] = {}
+        # the text files by id, None once they were removed or changed
+        self._paths: list[str | None] = []
+        self._ids: dict[str, int] = {}
+        self._postings: dict[int, array] | None = {}
+        self._nbytes = 0
+        self._walked_at: float | None = None
+        # the paths written since, guarded by their own lock so writes don't wait for
+        # an update
+        self._invalidated: set[str] = set()
+        self._invalidated_lock = threading.Lock()
+
+    def update(self):
+        if (
+            self._walked_at is None
+            or time.monotonic() - self._walked_at >= self.update_interval
+        ):
+            with self._invalidated_lock:
+                self._invalidated.clear()
+            self._walked_at = time.monotonic()
+            found = self._walk()
+            for path in self._keys.keys() - found.keys():
+                self._remove(path)
+            for path, key in found.items():
+                self._refresh(path, key)
+        else:
+            with self._invalidated_lock:
+                invalidated, self._invalidated = self._invalidated, set()
+            for path in invalidated:
+                try:
+                    stat = os.stat(path, follow_symlinks=False)
+                except OSError:
+                    self._remove(path)
+                    continue
+                if path in self._keys or len(self._keys) < MAX_FILES:
+                    self._refresh(path, (stat.st_mtime_ns, stat.st_size))
+        if len(self._paths) > 2 * len(self._ids) + 1000:
+            self._compact()
+
+    def invalidate(self, path: str):
+        """Update a file under `root` on the next `update`, even before a walk."""
+        relative = os.path.relpath(path, self.root).split(os.sep)
+        if relative[0] == ".." or any(
+            part.startswith(".") or part in SKIPPED_DIRS for part in relative
+        ):
+            return
+        with self._invalidated_lock:
+            self._invalidated.add(path)
+
+    def candidates(self, query: str) -> list[str]:
+        """The text files that contain every trigram of a lowercase query, sorted."""
+        trigrams = _trigrams(query.encode())
+        if not trigrams or self._postings is None:
+            return sorted(self._ids)
+        postings = sorted(
+            (self._postings.get(trigram, ()) for trigram in trigrams), key=len
+        )
+        ids = set(postings[0])
+        for posting in postings[1:]:
+            if not ids:
+                break
+            ids.intersection_update(posting)
+        paths = (self._paths[file_id] for file_id in ids)
+        return sorted(path for path in paths if path is not None)
+
+    def _walk(self) -> dict[str, tuple[int, int]]:
+        found = {}
+        self.truncated = False
+        directories = [str(self.root)]
+        while directories:
+            try:
+                it = os.scandir(directories.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in SKIPPED_DIRS:
+                                directories.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stat.st_size > MAX_FILE_SIZE:
+                        continue
+                    if len(found) >= MAX_FILES:
+                        self.truncated = True
+                        return found
+                    found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def _refresh(self, path: str, key: tuple[int, int]):
+        if self._keys.get(path) != key:
+            self._remove(path)
+            if key[1] <= MAX_FILE_SIZE:
+                self._add(path, key)
+
+    def _add(self, path: str, key: tuple[int, int]):
+        self._keys[path] = key
+        try:
+            with open(path, "rb") as f:
+                # only whether it's binary matters to an index without postings
+                data = f.read(MAX_FILE_SIZE if self._postings is not None else 8192)
+        except OSError:
+            return
+        # binary files are remembered so they aren't read again, but not indexed
+        if b"\0" in data[:8192]:
+            return
+        file_id = len(self._paths)
+        self._paths.append(path)
+        self._ids[path] = file_id
+        if self._postings is None:
+            return
+        postings = self._postings
+        get = postings.get
+        trigrams = _trigrams(data.decode(errors="replace").lower().encode())
+        n_new = 0
+        for trigram in trigrams:
+            posting = get(trigram)
+            if posting is None:
+                posting = postings[trigram] = array("I")
+                n_new += 1
+            posting.append(file_id)
+        self._nbytes += 4 * len(trigrams) + _TRIGRAM_BYTES * n_new
+        if self._nbytes > self.max_bytes:
+            # too large to keep, every file is scanned instead
+            self._postings = None
+
+    def _remove(self, path: str):
+        self._keys.pop(path, None)
+        file_id = self._ids.pop(path, None)
+        if file_id is not None:
+            self._paths[file_id] = None
+
+    def _compact(self):
+        """Renumber the files, dropping the ids of removed ones from the postings."""
+        new_ids = {
+            file_id: new_id
+            for new_id, file_id in enumerate(
+                file_id for file_id, path in enumerate(self._paths) if path is not None
+            )
+        }
+        self._paths = [path for path in self._paths if path is not None]
+        self._ids = {path: file_id for file_id, path in enumerate(self._paths)}
+        if self._postings is None:
+            return
+        postings: dict[int, array] = {}
+        self._nbytes = 0
+        for trigram, posting in self._postings.items():
+            kept = array("I", (new_ids[i] for i in posting if i in new_ids))
+            if kept:
+                postings[trigram] = kept
+                self._nbytes += _TRIGRAM_BYTES + 4 * len(kept)
+        self._postings = postings
+
+
+class TrigramIndexCache:
+    """An LRU cache of the trigram indexes of directories, `max_bytes` each."""
+
+    def __init__(self, max_roots: int = 4, max_bytes: int = 64 * 2**20):
+        self.max_roots = max_roots
+        self.max_bytes = max_bytes
+        self._indexes: OrderedDict[Path, TrigramIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def candidates(self, root: Path, query: str) -> tuple[list[str], bool]:
+        """
+        Update the index of a directory with the files changed since, and return the
+        candidates for a lowercase query and whether the index is truncated.
+        """
+        index = self._get(root)
+        # only searches of the same directory wait for each other's updates
+        with index.lock:
+            index.update()
+            return index.candidates(query), index.truncated
+
+    def invalidate(self, path: Path):
+        """Update a written file in the indexes of the directories it's in."""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            index.invalidate(str(path))
+
+    def _get(self, root: Path) -> TrigramIndex:
+        with self._lock:
+            index = self._indexes.get(root)
+            if index is None:
+                index = self._indexes[root] = TrigramIndex(root, self.max_bytes)
+            self._indexes.move_to_end(root)
+            while len(self._indexes) > self.max_roots:
+                self._indexes.popitem(last=False)
+            return index
+
+
+SEARCH_INDEXES = TrigramIndexCache()
+
+
+def _read_lines(path: str) -> list[str]:
+    try:
+        with open(path, errors="replace") as f:
+            return f.read(MAX_FILE_SIZE).split("\n")
+    except OSError:
+        return []
+
+
+def _clip(line: str):
+    if len(line) <= MAX_LINE_LENGTH:
+        return line
+    return line[:MAX_LINE_LENGTH] + "..."
+
+
+def search(
+    path: Path,
+    query: str,
+    max_results: int = MAX_RESULTS,
+    context: int = CONTEXT_LINES,
+) -> str:
+    """
+    Search a file, or the text files under a directory through its trigram index, for
+    lines containing `query`, case-insensitively unless it has uppercase letters. The
+    best `max_results` matches are shown like `grep -n -C`; matches in files whose name
+    contains the query, then whole word matches, rank first.
+    """
+    truncated = False
+    if path.is_dir():
+        candidates, truncated = SEARCH_INDEXES.candidates(path, query.lower())
+    else:
+        candidates = [str(path)]
+
+    case_sensitive = query != query.lower()
+    folded_query = query if case_sensitive else query.lower()
+    word = re.compile(
+        rf"(?<!\w){re.escape(query)}(?!\w)", 0 if case_sensitive else re.IGNORECASE
+    )
+    matches: list[Match] = []
+    for candidate in candidates:
+        name = os.path.basename(candidate)
+        in_name = folded_query in (name if case_sensitive else name.lower())
+        for i, line in enumerate(_read_lines(candidate)):
+            if folded_query not in (line if case_sensitive else line.lower()):
+                continue
+            score = 4 if in_name else 1
+            if word.search(line):
+                score += 2
+            matches.append(Match(candidate, i + 1, score))
+
+    if not matches:
+        return f"No matches found for `{query}` in {path}."
+    best = sorted(matches, key=lambda match: (-match.score, match.path, match.line))
+    best = best[:max_results]
+    # show files in the order of their best match, and their matches in line order
+    file_order: dict[str, int] = {}
+    for match in best:
+        file_order.setdefault(match.path, len(file_order))
+    best.sort(key=lambda match: (file_order[match.path], match.line))
+    matched_lines = {(match.path, match.line) for match in best}
+    file_lines = {file: _read_lines(file) for file in file_order}
+
+    header = f"Found {len(matches)} matches for `{query}` in {path}"
+    if len(matches) > max_results:
+        header += f", showing the best {max_results}"
+    if truncated:
+        header += f" (only the first {MAX_FILES} files were searched)"
+    blocks: list[list[str]] = []
+    # the last line shown, context lines are shown once when matches are close
+    shown = ("", 0)
+    for match in best:
+        lines = file_lines[match.path]
+        first = max(1, match.line - context)
+        end = min(len(lines), match.line + context)
+        if shown[0] == match.path and first <= shown[1] + 1:
+            first = shown[1] + 1
+        else:
+            blocks.append([])
+        for number in range(first, end + 1):
+            separator = ":" if (match.path, number) in matched_lines else "-"
+            blocks[-1].append(
+                f"{match.path}{separator}{number}{separator}{_clip(lines[number - 1])}"
+            )
+        shown = (match.path, end)
+    return header + ":\n" + "\n--\n".join("\n".join(block) for block in blocks) + "\n"
@@ -0,0 +1,117 @@
+"""
+Spans of where the time of a turn goes: the model, the tools and their commands,
+settle delays, screenshots and database writes. The spans of a turn are appended as
+JSON lines to a file for each session under TRACE_DIR when the turn ends, see
+`benchmarks.trace_report` for a breakdown of them. Nothing is recorded unless
+TRACE_DIR is set.
+"""
+
+import itertools
+import json
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+TRACE_DIR = (
+    Path(os.environ["TRACE_DIR"]).expanduser() if "TRACE_DIR" in os.environ else None
+)
+
+
+class _Trace:
+    """The spans of one turn, written to the trace file of its session at the end."""
+
+    def __init__(self, session_id: str, path: Path):
+        self.id = uuid4().hex
+        self.session_id = session_id
+        self.path = path
+        self.span_ids = itertools.count(1)
+        self.records: list[dict[str, Any]] = []
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as f:
+            f.writelines(json.dumps(record) + "\n" for record in self.records)
+
+
+@dataclass
+class _Span:
+    trace: _Trace
+    name: str
+    parent_id: int | None
+    attributes: dict[str, Any]
+    id: int = field(init=False)
+
+    def __post_init__(self):
+        self.id = next(self.trace.span_ids)
+
+
+# the innermost open span of the running task, tasks inherit it when created
+_current_span: ContextVar[_Span | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def _record(span: _Span) -> Iterator[dict[str, Any]]:
+    parent = _current_span.get()
+    _current_span.set(span)
+    start = time.time()
+    started_at = time.perf_counter()
+    try:
+        yield span.attributes
+    except BaseException as e:
+        span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        # set rather than reset with a token, a generator may close in another context
+        _current_span.set(parent)
+        span.trace.records.append(
+            {
+                "trace": span.trace.id,
+                "session": span.trace.session_id,
+                "span": span.id,
+                "parent": span.parent_id,
+                "name": span.name,
+                "start": start,
+                "duration_ms": (time.perf_counter() - started_at) * 1000,
+                "attributes": span.attributes,
+            }
+        )
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+    """
+    Time the block as a child of the open span, with the attributes it yields. Outside
+    of a trace it only yields the attributes.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield attributes
+        return
+    with _record(_Span(parent.trace, name, parent.id, attributes)) as span_attributes:
+        yield span_attributes
+
+
+@contextmanager
+def trace(
+    session_id: str, name: str = "turn", **attributes: Any
+) -> Iterator[dict[str, Any]]:
+    """
+    Time the block as the root span of a trace, written to the trace file of the
+    session when it ends. Inside another trace it's a span of that one.
+    """
+    if TRACE_DIR is None or _current_span.get() is not None:
+        with span(name, **attributes) as span_attributes:
+            yield span_attributes
+        return
+    new_trace = _Trace(session_id, TRACE_DIR / f"{Path(session_id).name}.jsonl")
+    try:
+        with _record(_Span(new_trace, name, None, attributes)) as span_attributes:
+            yield span_attributes
+    finally:
+        new_trace.write()
@@ -0,0 +1,82 @@
+"""
+A watchdog of the event loop: a coroutine wakes every LOOP_LAG_INTERVAL to measure
+how late its timer fires, and a thread logs the stack of the code running on the loop
+when it's late by more than LOOP_LAG_THRESHOLD seconds, while it still blocks.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+
+from .metrics import EVENT_LOOP_BLOCKED, EVENT_LOOP_LAG_SECONDS, LOOP_LAG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BlockedLoop:
+    # how late the timer was when the stack was taken, the loop may block for longer
+    lag: float
+    stack: str
+
+
+class LoopWatchdog:
+    """Measures the lag of the running event loop and reports what blocks it."""
+
+    threshold = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+    interval = LOOP_LAG_INTERVAL
+
+    def __init__(self):
+        # the latest reports, for inspection
+        self.blocked: deque[BlockedLoop] = deque(maxlen=20)
+        # when the timer of the coroutine is due
+        self._due: float | None = None
+
+    async def run(self):
+        """Watch the running loop until cancelled, a threshold of 0 only measures lag."""
+        stop = threading.Event()
+        if self.threshold > 0:
+            threading.Thread(
+                target=self._watch,
+                args=(threading.get_ident(), stop),
+                name="loop-watchdog",
+                daemon=True,
+            ).start()
+        try:
+            while True:
+                self._due = time.perf_counter() + self.interval
+                await asyncio.sleep(self.interval)
+                EVENT_LOOP_LAG_SECONDS.observe(
+                    max(0.0, time.perf_counter() - self._due)
+                )
+        finally:
+            self._due = None
+            stop.set()
+
+    def _watch(self, loop_thread: int, stop: threading.Event):
+        reported_due = None
+        while not stop.wait(self.threshold / 2):
+            due = self._due
+            if due is None or due == reported_due:
+                continue
+            lag = time.perf_counter() - due
+            if lag < self.threshold:
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            # one report for each time the loop blocks
+            reported_due = due
+            stack = "".join(traceback.format_stack(frame))
+            del frame
+            self.blocked.append(BlockedLoop(lag, stack))
+            EVENT_LOOP_BLOCKED.inc()
+            logger.warning(
+                "Event loop blocked for %.0f ms so far, in:\n%s", lag * 1000, stack
+            )
@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+
+from benchmarks.micro import BENCHMARKS, Result, main, regressions, run
+
+
+def _args(tmp_path, **kwargs) -> argparse.Namespace:
+    defaults = {
+        "filter": "scale_coordinates",
+        "baseline": tmp_path / "micro.json",
+        "save": False,
+        "threshold": 0.2,
+        "min_time": 0.001,
+        "repeats": 2,
+    }
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+
+def test_every_benchmark_runs(tmp_path):
+    with_large_setups = {"editor", "ImageRetention", "history", "_make_api"}
+    names = [
+        name
+        for name in BENCHMARKS
+        if not any(part in name for part in with_large_setups)
+    ]
+    environ = dict(os.environ)
+    results = run(names, min_time=0.001, repeats=2)
+    assert dict(os.environ) == environ
+    assert [result.name for result in results] == names
+    assert all(0 < result.best_us <= result.median_us for result in results)
+
+
+def test_regressions():
+    baseline = {
+        "results": {
+            "fast": {"best_us": 10.0},
+            "slow": {"best_us": 10.0},
+        }
+    }
+    results = [
+        Result("fast", 1000, 11.0, 12.0),
+        Result("slow", 1000, 12.5, 13.0),
+        Result("new", 1000, 100.0, 100.0),
+    ]
+    assert regressions(results, baseline, threshold=0.2) == ["slow"]
+
+
+def test_baseline(tmp_path, capsys):
+    assert main(_args(tmp_path)) == 0
+    assert "No baseline" in capsys.readouterr().out
+
+    assert main(_args(tmp_path, save=True)) == 0
+    saved = json.loads((tmp_path / "micro.json").read_text())
+    assert list(saved["results"]) == ["scale_coordinates"]
+
+    # a baseline far faster than any run
+    saved["results"]["scale_coordinates"]["best_us"] = 1e-6
+    (tmp_path / "micro.json").write_text(json.dumps(saved))
+    assert main(_args(tmp_path)) == 1
+    assert "REGRESSION: scale_coordinates" in capsys.readouterr().out
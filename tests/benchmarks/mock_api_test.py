@@ -0,0 +1,94 @@
+import random
+
+import pytest
+from anthropic import Anthropic, APIStatusError
+from fastapi.testclient import TestClient
+
+from benchmarks.mock_api import create_app, parse_latency
+
+SCRIPT = [
+    [
+        {"type": "text", "text": "Listing the files of the current directory."},
+        {"type": "tool_use", "name": "bash", "input": {"command": "ls"}},
+    ]
+]
+
+
+def _client(**kwargs) -> Anthropic:
+    return Anthropic(
+        api_key="mock",
+        base_url="http://testserver",
+        http_client=TestClient(create_app(SCRIPT, **kwargs)),
+        max_retries=0,
+    )
+
+
+def _create(client: Anthropic, messages: list, **kwargs):
+    return client.beta.messages.with_raw_response.create(
+        max_tokens=1024, messages=messages, model="mock-model", **kwargs
+    )
+
+
+def test_scripted_turns():
+    client = _client()
+    messages = [{"role": "user", "content": "list the files"}]
+    raw_response = _create(client, messages)
+    assert raw_response.http_response.headers["request-id"] == "req_mock_1"
+    response = raw_response.parse()
+    assert response.stop_reason == "tool_use"
+    assert response.content[1].type == "tool_use"
+    assert response.content[1].input == {"command": "ls"}
+    assert response.usage.input_tokens > 0
+
+    messages += [
+        {
+            "role": "assistant",
+            "content": [block.model_dump() for block in response.content],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": response.content[1].id,
+                    "content": "file.txt",
+                }
+            ],
+        },
+    ]
+    response = _create(client, messages).parse()
+    assert response.stop_reason == "end_turn"
+    assert response.content[0].text == "Done."
+
+
+def test_streaming():
+    client = _client()
+    with client.beta.messages.stream(
+        max_tokens=1024,
+        messages=[{"role": "user", "content": "list the files"}],
+        model="mock-model",
+    ) as stream:
+        text = "".join(stream.text_stream)
+        message = stream.get_final_message()
+    assert text == SCRIPT[0][0]["text"]
+    assert message.content[1].input == {"command": "ls"}
+    assert message.stop_reason == "tool_use"
+
+
+def test_errors():
+    client = _client(error_rate=1)
+    with pytest.raises(APIStatusError) as exc_info:
+        _create(client, [{"role": "user", "content": "hi"}])
+    assert exc_info.value.status_code == 529
+
+
+def test_parse_latency():
+    rng = random.Random(0)
+    assert parse_latency("fixed:250")(rng) == 0.25
+    samples = [parse_latency("uniform:100,200")(rng) for _ in range(100)]
+    assert all(0.1 <= sample <= 0.2 for sample in samples)
+    assert parse_latency("normal:0,10")(rng) >= 0
+    with pytest.raises(ValueError):
+        parse_latency("uniform:100")
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1,2")
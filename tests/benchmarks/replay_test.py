@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import io
+import json
+import uuid
+from unittest.mock import AsyncMock, patch
+
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from backend.models import Base, ChatMessage, Session as ChatSession
+from benchmarks.replay import RecordedCall, Replayer, frame_diff, load_calls, report
+from computer_use_demo.tools import (
+    BashTool20250124,
+    ComputerTool20250124,
+    EditTool20250124,
+    ToolCollection,
+    ToolResult,
+)
+from computer_use_demo.tools.proc import ResourceUsage
+
+
+def _png(color: str, size=(64, 48)) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_load_calls(tmp_path):
+    db = tmp_path / "chat.db"
+    engine = create_engine(f"sqlite:///{db}")
+    Base.metadata.create_all(engine)
+    session_id = uuid.uuid4()
+    tool_use = {"type": "tool_use", "id": "toolu_1", "name": "computer"}
+    with Session(engine) as session:
+        session.add(ChatSession(id=session_id))
+        session.add_all(
+            [
+                ChatMessage(session_id=session_id, role="user", content="hi"),
+                ChatMessage(
+                    session_id=session_id,
+                    role="assistant",
+                    content=json.dumps(
+                        [
+                            {"type": "text", "text": "taking a screenshot"},
+                            {**tool_use, "input": {"action": "screenshot"}},
+                        ]
+                    ),
+                ),
+                ChatMessage(
+                    session_id=session_id,
+                    role="tool",
+                    content=json.dumps(
+                        [
+                            {
+                                "type": "tool_result",
+                                "tool_use_id": "toolu_1",
+                                "content": [
+                                    {
+                                        "type": "image",
+                                        "source": {"type": "base64", "data": "abc"},
+                                    }
+                                ],
+                            }
+                        ]
+                    ),
+                ),
+            ]
+        )
+        session.commit()
+
+    assert load_calls(db, str(session_id)) == [
+        RecordedCall("computer", {"action": "screenshot"}, "abc")
+    ]
+    assert load_calls(db, str(uuid.uuid4())) == []
+
+
+def test_frame_diff():
+    assert frame_diff(_png("red"), _png("red")) == {
+        "changed_pixels": 0.0,
+        "mean_difference": 0.0,
+    }
+    assert (
+        frame_diff(_png("black"), _png("white", size=(32, 24)))["changed_pixels"] == 1.0
+    )
+
+
+async def test_replay(tmp_path):
+    computer = ComputerTool20250124()
+    tool_collection = ToolCollection(computer, BashTool20250124(), EditTool20250124())
+
+    async def screenshot():
+        await asyncio.sleep(0.02)
+        return ToolResult(base64_image=_png("red"))
+
+    computer.screenshot = screenshot
+    path = tmp_path / "notes.txt"
+    calls = [
+        RecordedCall("computer", {"action": "left_click"}, _png("blue")),
+        RecordedCall("bash", {"command": "echo replayed"}),
+        RecordedCall(
+            "str_replace_editor",
+            {"command": "create", "path": str(path), "file_text": "notes\n"},
+        ),
+        RecordedCall("computer", {"action": "zoom_out"}),
+    ]
+    with patch(
+        "computer_use_demo.tools.computer.run_exec",
+        AsyncMock(return_value=(0, "", "", ResourceUsage())),
+    ):
+        replayed = await Replayer(tool_collection, settle=0.05).replay(calls)
+
+    click, bash, edit, invalid = replayed
+    assert click.label == "computer.left_click"
+    assert click.phases["settle"] >= 50
+    assert click.phases["screenshot"] >= 20
+    assert click.frame_diff["changed_pixels"] == 1.0
+    assert bash.label == "bash" and bash.error is None
+    assert edit.label == "str_replace_editor.create"
+    assert path.read_text() == "notes\n"
+    assert invalid.error
+
+    result = report(replayed)
+    assert result["calls"] == 4
+    assert result["errors"] == 1
+    assert result["phase_ms"]["settle"]["count"] == 1
+    assert set(result["latency_ms"]) == {
+        "computer.left_click",
+        "bash",
+        "str_replace_editor.create",
+        "computer.zoom_out",
+    }
@@ -0,0 +1,56 @@
+import json
+
+from benchmarks.trace_report import build_tree, folded, load_spans, report, top_sinks
+
+
+def _span(trace, span, parent, name, duration_ms, attributes=None):
+    return {
+        "trace": trace,
+        "session": "session",
+        "span": span,
+        "parent": parent,
+        "name": name,
+        "start": 0,
+        "duration_ms": duration_ms,
+        "attributes": attributes or {},
+    }
+
+
+def _write_traces(directory):
+    records = [
+        _span(trace, *span)
+        for trace in ("t1", "t2")
+        for span in [
+            (1, None, "turn", 1000),
+            (2, 1, "model", 600),
+            (3, 1, "tools", 350),
+            (4, 3, "tool.computer", 300, {"action": "left_click"}),
+            (5, 4, "settle", 200),
+        ]
+    ]
+    directory.mkdir()
+    (directory / "session.jsonl").write_text(
+        "".join(json.dumps(record) + "\n" for record in records)
+    )
+
+
+def test_breakdown(tmp_path):
+    _write_traces(tmp_path / "traces")
+    traces = load_spans([tmp_path / "traces"])
+    root = build_tree(traces)
+
+    turn = root.children["turn"]
+    assert turn.durations == [1000, 1000]
+    assert turn.self_ms == 100
+    click = turn.children["tools"].children["tool.computer.left_click"]
+    assert click.self_ms == 200
+    assert "turn;tools;tool.computer.left_click 200000" in folded(root)
+
+    sinks = top_sinks(traces, limit=2)
+    assert [sink["span"] for sink in sinks] == ["model", "settle"]
+    assert sinks[0]["share"] == 0.6
+    assert sinks[0]["count"] == 2
+
+    lines = report(traces)
+    assert lines[0] == "2 turns in 1 sessions"
+    assert any(line.startswith("    tool.computer.left_click") for line in lines)
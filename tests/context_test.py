@@ -0,0 +1,136 @@
+import base64
+import io
+
+from anthropic.types.beta import BetaMessageParam, BetaUsage
+from PIL import Image
+
+from computer_use_demo.context import (
+    ELIDED_OUTPUT_MARKER,
+    ContextBudget,
+    estimate_message_tokens,
+)
+
+
+def _turn(i: int, output: str) -> list[BetaMessageParam]:
+    return [
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "text", "text": f"step {i}"},
+                {
+                    "type": "tool_use",
+                    "id": f"tool_{i}",
+                    "name": "bash",
+                    "input": {"command": f"cat file_{i}"},
+                },
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"tool_{i}",
+                    "content": [{"type": "text", "text": output}],
+                }
+            ],
+        },
+    ]
+
+
+def _conversation(n_turns: int, output_chars: int) -> list[BetaMessageParam]:
+    messages: list[BetaMessageParam] = [{"role": "user", "content": "do the task"}]
+    for i in range(n_turns):
+        messages.extend(_turn(i, f"output {i} " + "x" * output_chars))
+    return messages
+
+
+def _budget(monkeypatch, context_window: int) -> ContextBudget:
+    monkeypatch.setattr(ContextBudget, "context_window", context_window)
+    monkeypatch.setattr(ContextBudget, "keep_recent_messages", 4)
+    return ContextBudget()
+
+
+def test_estimate_message_tokens():
+    buffer = io.BytesIO()
+    Image.new("RGB", (1024, 768)).save(buffer, format="PNG")
+    image = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/png",
+            "data": base64.b64encode(buffer.getvalue()).decode(),
+        },
+    }
+    text_only = estimate_message_tokens({"role": "user", "content": "x" * 4000})
+    assert 1000 <= text_only < 1010
+    with_image = estimate_message_tokens(
+        {
+            "role": "user",
+            "content": [
+                {"type": "tool_result", "tool_use_id": "1", "content": [image]}
+            ],
+        }
+    )
+    assert 1048 <= with_image < 1070
+
+
+def test_estimate_from_usage(monkeypatch):
+    budget = _budget(monkeypatch, 100_000)
+    messages = _conversation(2, 400)
+    budget.record_usage(BetaUsage(input_tokens=500, output_tokens=10), messages)
+    assert budget.estimate(messages) == 500
+
+    messages.extend(_turn(2, "x" * 4000))
+    # the usage of the last request and estimates of the messages since
+    assert 1500 <= budget.estimate(messages) < 1550
+
+
+def test_compaction_elides_old_tool_outputs(monkeypatch):
+    budget = _budget(monkeypatch, 7_000)
+    messages = _conversation(6, 4000)
+    assert not budget.maybe_compact(_conversation(5, 4000))
+
+    assert budget.maybe_compact(messages)
+    assert budget.estimate(messages) <= 3_500
+    assert len(messages) == 13
+    outputs = [block["content"][0]["text"] for block in _tool_results(messages)]
+    assert outputs[0].startswith("output 0 xxx")
+    assert outputs[0].endswith(ELIDED_OUTPUT_MARKER)
+    # the recent outputs are kept whole
+    assert outputs[-2:] == [f"output {i} " + "x" * 4000 for i in (4, 5)]
+
+
+def test_compaction_summarizes_oldest_turns(monkeypatch):
+    budget = _budget(monkeypatch, 2_000)
+    messages = _conversation(20, 400)
+
+    assert budget.maybe_compact(messages)
+    # the summary itself takes some of the room freed
+    assert budget.estimate(messages) <= 1_600
+    assert budget.compactions == 1
+    first = messages[0]["content"]
+    assert first[0] == {"type": "text", "text": "do the task"}
+    assert first[1]["text"].startswith("Summary of ")
+    assert '- called bash {"command": "cat file_0"}' in first[1]["text"]
+    # whole turns were removed, every tool result still follows its tool use
+    assert [message["role"] for message in messages[1:3]] == ["assistant", "user"]
+    tool_uses = [
+        block["id"]
+        for message in messages
+        if message["role"] == "assistant"
+        for block in message["content"]
+        if block["type"] == "tool_use"
+    ]
+    assert [block["tool_use_id"] for block in _tool_results(messages)] == tool_uses
+    assert tool_uses[-1] == "tool_19"
+
+
+def _tool_results(messages: list[BetaMessageParam]) -> list[dict]:
+    return [
+        block
+        for message in messages
+        if isinstance(message["content"], list)
+        for block in message["content"]
+        if block["type"] == "tool_result"
+    ]
@@ -1,9 +1,30 @@
+import base64
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
+import httpx
 from anthropic.types import TextBlock, ToolUseBlock
-from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaTextBlockParam
+from anthropic.types.beta import (
+    BetaMessage,
+    BetaMessageParam,
+    BetaTextBlockParam,
+    BetaUsage,
+)
+from PIL import Image
 
-from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.loop import (
+    REMOVED_IMAGE_PLACEHOLDER,
+    APIProvider,
+    ImageRetention,
+    _client,
+    _get_client,
+    _trace_connection,
+    connection_overhead,
+    sampling_loop,
+)
+from computer_use_demo.tools import close_bash_sessions
 
 
 async def test_loop():
@@ -18,19 +39,26 @@ async def test_loop():
                     type="tool_use", id="1", name="computer", input={"action": "test"}
                 ),
             ],
+            usage=BetaUsage(input_tokens=1000, output_tokens=10),
+        ),
+        mock.Mock(
+            spec=BetaMessage,
+            content=[TextBlock(type="text", text="Done!")],
+            usage=BetaUsage(input_tokens=1010, output_tokens=10),
         ),
-        mock.Mock(spec=BetaMessage, content=[TextBlock(type="text", text="Done!")]),
     ]
 
     tool_collection = mock.AsyncMock()
-    tool_collection.run.return_value = mock.Mock(
-        output="Tool output", error=None, base64_image=None
-    )
+    tool_collection.to_params = mock.Mock(return_value=[])
+    tool_collection.run_all.return_value = [
+        mock.Mock(output="Tool output", error=None, base64_image=None)
+    ]
 
     output_callback = mock.Mock()
     tool_output_callback = mock.Mock()
     api_response_callback = mock.Mock()
 
+    _client.cache_clear()
     with (
         mock.patch("computer_use_demo.loop.Anthropic", return_value=client),
         mock.patch(
@@ -57,12 +85,228 @@ async def test_loop():
         assert result[3]["role"] == "assistant"
 
         assert client.beta.messages.with_raw_response.create.call_count == 2
-        tool_collection.run.assert_called_once_with(
-            name="computer", tool_input={"action": "test"}
+        tool_collection.run_all.assert_called_once_with(
+            [("computer", {"action": "test"})]
         )
+        tool_collection.close.assert_awaited_once()
         output_callback.assert_called_with(
             BetaTextBlockParam(text="Done!", type="text", citations=None)
         )
         assert output_callback.call_count == 3
         assert tool_output_callback.call_count == 1
         assert api_response_callback.call_count == 2
+
+        _client.cache_clear()
+    await close_bash_sessions()
+
+
+def test_clients_are_reused():
+    _client.cache_clear()
+    with mock.patch(
+        "computer_use_demo.loop.Anthropic", side_effect=lambda **kwargs: mock.Mock()
+    ) as anthropic:
+        client = _get_client(APIProvider.ANTHROPIC, "key")
+        assert _get_client(APIProvider.ANTHROPIC, "key") is client
+        assert _get_client(APIProvider.ANTHROPIC, "other key") is not client
+        assert anthropic.call_count == 2
+        # every client shares one connection pool
+        assert (
+            anthropic.call_args_list[0].kwargs["http_client"]
+            is anthropic.call_args_list[1].kwargs["http_client"]
+        )
+    _client.cache_clear()
+
+
+def test_clients_follow_the_environment(monkeypatch):
+    _client.cache_clear()
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    with mock.patch(
+        "computer_use_demo.loop.AnthropicBedrock",
+        side_effect=lambda **kwargs: mock.Mock(),
+    ):
+        client = _get_client(APIProvider.BEDROCK, "")
+        assert _get_client(APIProvider.BEDROCK, "") is client
+        monkeypatch.setenv("AWS_REGION", "eu-west-1")
+        assert _get_client(APIProvider.BEDROCK, "") is not client
+    _client.cache_clear()
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_connection_overhead_is_traced():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        with httpx.Client(event_hooks={"request": [_trace_connection]}) as client:
+            first = client.get(url)
+            second = client.get(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert connection_overhead(first.request).startswith("new connection: connect_tcp")
+    assert connection_overhead(second.request) == "reused a kept-alive connection"
+    assert connection_overhead(httpx.Request("GET", url)) == (
+        "connection setup not traced"
+    )
+
+
+def _screenshot_turn(turn: int) -> list[BetaMessageParam]:
+    return [
+        {"role": "assistant", "content": [{"type": "text", "text": f"turn {turn}"}]},
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"tool_{turn}",
+                    "content": [
+                        {"type": "text", "text": f"result {turn}"},
+                        {"type": "image", "source": {"data": f"image {turn}"}},
+                    ],
+                }
+            ],
+        },
+    ]
+
+
+def _image_data(messages: list[BetaMessageParam]) -> list[str]:
+    return [
+        content["source"]["data"]
+        for message in messages
+        if isinstance(message["content"], list)
+        for item in message["content"]
+        if item["type"] == "tool_result"
+        for content in item["content"]
+        if content["type"] == "image"
+    ]
+
+
+async def test_image_retention_removes_in_chunks():
+    messages: list[BetaMessageParam] = [{"role": "user", "content": "start"}]
+    retention = ImageRetention()
+    kept = []
+    for turn in range(10):
+        messages.extend(_screenshot_turn(turn))
+        retention.track(messages)
+        await retention.evict(3, min_removal_threshold=3)
+        kept.append(len(_image_data(messages)))
+
+    # images are only removed once 3 more than the 3 to keep have accumulated
+    assert kept == [1, 2, 3, 4, 5, 3, 4, 5, 3, 4]
+    assert _image_data(messages) == ["image 6", "image 7", "image 8", "image 9"]
+    assert len(retention) == 4
+    # the text of the tool results is kept, without thumbnails nothing replaces images
+    assert messages[2]["content"][0]["content"] == [
+        {"type": "text", "text": "result 0"},
+    ]
+
+
+async def test_image_retention_after_rewrite():
+    messages: list[BetaMessageParam] = []
+    retention = ImageRetention()
+    for turn in range(4):
+        messages.extend(_screenshot_turn(turn))
+    retention.track(messages)
+    assert len(retention) == 4
+
+    # the conversation was replaced with a shorter one
+    messages[:] = _screenshot_turn(4)
+    retention.track(messages)
+    await retention.evict(0, min_removal_threshold=1)
+    assert len(retention) == 0
+    assert _image_data(messages) == []
+
+
+def _png_screenshot_turn(turn: int) -> list[BetaMessageParam]:
+    buffer = io.BytesIO()
+    Image.new("RGB", (1024, 768), "red").save(buffer, format="PNG")
+    messages = _screenshot_turn(turn)
+    messages[-1]["content"][0]["content"][1]["source"] = {
+        "type": "base64",
+        "media_type": "image/png",
+        "data": base64.b64encode(buffer.getvalue()).decode(),
+    }
+    return messages
+
+
+def _media_types(messages: list[BetaMessageParam]) -> list[str | None]:
+    return [
+        content["source"]["media_type"] if content["type"] == "image" else None
+        for message in messages[1::2]
+        for content in message["content"][0]["content"][1:]
+    ]
+
+
+async def test_image_retention_downsamples_older_images():
+    messages: list[BetaMessageParam] = []
+    retention = ImageRetention()
+    for turn in range(8):
+        messages.extend(_png_screenshot_turn(turn))
+        retention.track(messages)
+        await retention.evict(2, min_removal_threshold=2, thumbnails_to_keep=2)
+
+    media_types = _media_types(messages)
+    assert media_types == [None] * 4 + ["image/jpeg"] * 2 + ["image/png"] * 2
+    # with thumbnails, the oldest images leave a placeholder
+    assert messages[1]["content"][0]["content"][1] == {
+        "type": "text",
+        "text": REMOVED_IMAGE_PLACEHOLDER,
+    }
+    with Image.open(
+        io.BytesIO(
+            base64.b64decode(messages[9]["content"][0]["content"][1]["source"]["data"])
+        )
+    ) as thumbnail:
+        assert thumbnail.size == (384, 288)
+        assert thumbnail.mode == "L"
+    # 4 images removed and 2 downsampled since the last request
+    assert retention.tokens_saved_per_request == 4 * 1048 + 2 * (1048 - 147)
+    assert retention.tokens_saved > retention.tokens_saved_per_request
+
+
+async def test_image_retention_remembers_a_bounded_number_of_blocks():
+    messages: list[BetaMessageParam] = []
+    retention = ImageRetention()
+    retention.max_saved = 3
+    for turn in range(8):
+        messages.extend(_png_screenshot_turn(turn))
+        retention.track(messages)
+        await retention.evict(1, min_removal_threshold=1, thumbnails_to_keep=1)
+    assert len(retention._saved) == 3
+    # the newest are remembered, the thumbnail among them
+    retention.rebuild(messages)
+    assert len(retention._thumbnails) == 1
+    assert len(retention) == 1
+
+
+async def test_image_retention_after_compaction():
+    messages: list[BetaMessageParam] = []
+    retention = ImageRetention()
+    for turn in range(8):
+        messages.extend(_png_screenshot_turn(turn))
+        retention.track(messages)
+        await retention.evict(2, min_removal_threshold=2, thumbnails_to_keep=2)
+
+    # the oldest turn was compacted away and a new one appended, the length is the same
+    del messages[:2]
+    messages.extend(_png_screenshot_turn(8))
+    retention.rebuild(messages)
+    assert len(retention) == 3
+    # the thumbnails are recognized rather than downsampled again
+    assert retention.tokens_saved_per_request == 3 * 1048 + 2 * (1048 - 147)
+    await retention.evict(1, min_removal_threshold=2, thumbnails_to_keep=2)
+    assert _media_types(messages) == ([None] * 5 + ["image/jpeg"] * 2 + ["image/png"])
+    assert retention.tokens_saved_per_request == 5 * 1048 + 2 * (1048 - 147)
@@ -0,0 +1,67 @@
+import json
+import pstats
+import tracemalloc
+
+import pytest
+
+from computer_use_demo.profiling import Profiler, parse_kinds
+
+
+def _work(messages: list) -> list:
+    messages.extend(
+        {"role": "user", "content": f"{i} " + "x" * 1000} for i in range(100)
+    )
+    return sorted(json.dumps(message) for message in messages)
+
+
+def test_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(Profiler, "directory", tmp_path)
+    monkeypatch.setenv("PROFILE_SESSIONS", "")
+    profiler = Profiler()
+    profiler.arm("session", turns=1)
+    messages: list = []
+
+    with profiler.profile("session", 3, messages) as paths:
+        _work(messages)
+
+    assert sorted(path.suffix for path in paths) == [".json", ".prof", ".tracemalloc"]
+    assert all(path.name.startswith("session-turn3-") for path in paths)
+    stats = pstats.Stats(str(next(p for p in paths if p.suffix == ".prof")))
+    assert any(name == "_work" for _, _, name in stats.stats)  # type: ignore[attr-defined]
+    summary = json.loads(next(p for p in paths if p.suffix == ".json").read_text())
+    assert (summary["messages_before"], summary["messages_after"]) == (0, 100)
+    assert summary["allocated_bytes"] > 100_000
+
+    # the session was armed for one turn
+    with profiler.profile("session", 4, messages) as paths:
+        _work(messages)
+    assert paths == []
+    assert profiler.armed() == {}
+
+
+def test_armed_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setattr(Profiler, "directory", tmp_path)
+    monkeypatch.setenv("PROFILE_SESSIONS", "*")
+    monkeypatch.setenv("PROFILE_KINDS", "memory")
+    profiler = Profiler()
+    for turn in (1, 2):
+        with profiler.profile("other", turn) as paths:
+            _work([])
+        assert sorted(path.suffix for path in paths) == [".json", ".tracemalloc"]
+
+    with pytest.raises(ValueError, match="Invalid profile kinds"):
+        parse_kinds("cpu,heap")
+
+
+def test_write_errors_are_logged(tmp_path, monkeypatch, caplog):
+    # a file where the directory of the profiles should be
+    (tmp_path / "profiles").touch()
+    monkeypatch.setattr(Profiler, "directory", tmp_path / "profiles")
+    monkeypatch.setenv("PROFILE_SESSIONS", "session")
+    profiler = Profiler()
+
+    with profiler.profile("session", 1) as paths:
+        assert tracemalloc.is_tracing()
+    assert paths == []
+    assert not tracemalloc.is_tracing()
+    assert "Could not write the profiles of turn 1 of session" in caplog.text
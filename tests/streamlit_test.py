@@ -25,3 +25,33 @@ def test_streamlit(streamlit_app: AppTest):
             }
         ]
         assert not streamlit_app.exception
+        # one budget for the whole session
+        budget = patch.call_args.kwargs["context_budget"]
+        assert budget is streamlit_app.session_state["context_budget"]
+        streamlit_app.chat_input[0].set_value("Again").run()
+        assert patch.call_args.kwargs["context_budget"] is budget
+        assert not streamlit_app.exception
+
+
+def test_compaction_keeps_the_rendered_messages(streamlit_app: AppTest):
+    streamlit_app.run()
+    streamlit_app.text_input[1].set_value("sk-ant-0000000000000").run()
+
+    async def compacting_loop(*, messages, **kwargs):
+        messages[0]["content"].append(TextBlockParam(text="Summary", type="text"))
+        messages.append({"role": Sender.BOT, "content": "Hi"})
+        del messages[1:-1]
+        return messages
+
+    with mock.patch("computer_use_demo.loop.sampling_loop", compacting_loop):
+        streamlit_app.chat_input[0].set_value("Hello").run()
+        streamlit_app.chat_input[0].set_value("Again").run()
+    assert not streamlit_app.exception
+    assert [
+        message["content"] for message in streamlit_app.session_state["messages"]
+    ] == [
+        [TextBlockParam(text="Hello", type="text")],
+        "Hi",
+        [TextBlockParam(text="Again", type="text")],
+        "Hi",
+    ]
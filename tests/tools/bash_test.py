@@ -1,11 +1,24 @@
+import asyncio
+from unittest import mock
+
 import pytest
 
-from computer_use_demo.tools.bash import BashTool20241022, BashTool20250124, ToolError
+from computer_use_demo.tools.bash import (
+    BashSessionPool,
+    BashTool20241022,
+    BashTool20250124,
+    ToolError,
+    _BashJobManager,
+    _BashSession,
+    close_bash_sessions,
+    close_session_jobs,
+)
 
 
 @pytest.fixture(params=[BashTool20241022, BashTool20250124])
-def bash_tool(request):
-    return request.param()
+async def bash_tool(request):
+    yield request.param()
+    await close_bash_sessions()
 
 
 @pytest.mark.asyncio
@@ -18,6 +31,62 @@ async def test_bash_tool_restart(bash_tool):
     assert "Hello after restart" in result.output
 
 
+@pytest.mark.asyncio
+async def test_bash_tool_restart_uses_pooled_session(bash_tool):
+    pool = BashSessionPool.for_running_loop()
+    await pool._fill()
+    pooled_session = pool._idle[0]
+
+    await bash_tool(command="echo 'first session'")
+    assert bash_tool._session is pooled_session
+
+    await pool._fill()
+    pooled_session = pool._idle[0]
+    used_session = bash_tool._session
+    await bash_tool(restart=True)
+    assert bash_tool._session is pooled_session
+    assert await used_session._process.wait() is not None
+
+
+@pytest.mark.asyncio
+async def test_bash_session_pool_environment(bash_tool):
+    pool = BashSessionPool.for_running_loop()
+    await pool._fill()
+    stale_session = pool._idle[0]
+    pool.env = {"POOL_VAR": "pooled"}
+    result = await bash_tool(command="echo $POOL_VAR")
+    assert result.output == "pooled"
+    # the session started with the old environment was stopped, not handed out
+    assert stale_session._process.returncode is not None
+
+
+@pytest.mark.asyncio
+async def test_bash_session_pool_fills_lazily(bash_tool):
+    assert asyncio.get_running_loop() not in BashSessionPool._pools
+    pool = BashSessionPool.for_running_loop()
+    with mock.patch.object(_BashSession, "start", side_effect=OSError("no shell")):
+        # a failed refill is logged, the pool stays usable
+        await pool._fill()
+    assert pool._idle == [] and not pool._active
+
+    await bash_tool(command="true")
+    assert pool._refill is not None
+    await pool._refill
+    assert len(pool._idle) == 1
+
+
+@pytest.mark.asyncio
+async def test_close_bash_sessions(bash_tool):
+    await bash_tool(command="echo 'in use'")
+    pool = BashSessionPool.for_running_loop()
+    await pool._fill()
+    sessions = [bash_tool._session, *pool._idle]
+
+    await close_bash_sessions()
+    assert all(session._process.returncode is not None for session in sessions)
+    assert pool._refill is not None and pool._refill.done()
+
+
 @pytest.mark.asyncio
 async def test_bash_tool_run_command(bash_tool):
     result = await bash_tool(command="echo 'Hello, World!'")
@@ -69,3 +138,118 @@ async def test_bash_tool_timeout(bash_tool):
         match="timed out: bash has not returned in 0.1 seconds and must be restarted",
     ):
         await bash_tool(command="sleep 1")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_background_job(bash_tool):
+    result = await bash_tool(
+        command="echo 'started'; sleep 0.5; echo 'done'", background=True
+    )
+    assert result.output == "Started background job 1."
+    assert "running" in result.system
+
+    result = await bash_tool(job_action="wait", job_id="1", timeout=5)
+    assert "started\ndone" in result.output
+    assert "exited with returncode 0" in result.system
+
+    # output is only returned once
+    result = await bash_tool(job_action="status", job_id=1)
+    assert result.output == ""
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_background_job_runs_in_session_cwd(bash_tool):
+    await bash_tool(command="cd /tmp")
+    await bash_tool(command="pwd", background=True)
+    result = await bash_tool(job_action="wait", job_id="1", timeout=5)
+    assert result.output.strip() == "/tmp"
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_background_job_kill(bash_tool):
+    await bash_tool(command="sleep 30 & sleep 30", background=True)
+    result = await bash_tool(job_action="wait", job_id="1", timeout=0.1)
+    assert "running" in result.system
+
+    result = await bash_tool(job_action="kill", job_id="1")
+    assert "killed" in result.system
+
+    result = await bash_tool(job_action="list")
+    assert result.output.startswith("job 1 `sleep 30 & sleep 30` killed")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_background_job_errors(bash_tool):
+    with pytest.raises(ToolError, match="No background job with id 7"):
+        await bash_tool(job_action="status", job_id="7")
+    with pytest.raises(ToolError, match="`job_id` is required"):
+        await bash_tool(job_action="wait")
+    with pytest.raises(ToolError, match="Unrecognized job_action"):
+        await bash_tool(job_action="pause", job_id="1")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_resource_usage(bash_tool):
+    result = await bash_tool(
+        command="python3 -c 'sum(range(10**7))'; head -c 4000000 /dev/zero > /dev/null"
+    )
+    assert result.usage is not None
+    assert result.usage.wall_time > 0
+    assert result.usage.user_time + result.usage.system_time > 0
+    assert result.usage.max_rss_kb > 0
+    # usage is metadata and doesn't make an otherwise empty result truthy
+    assert not result.replace(output="", error="")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_timeout_reaps_session(bash_tool):
+    await bash_tool(command="echo 'Hello, World!'")
+    bash_tool._session._timeout = 0.1
+    with pytest.raises(ToolError, match="timed out"):
+        await bash_tool(command="sleep 30 & sleep 30")
+    assert await asyncio.wait_for(bash_tool._session._process.wait(), 1) == -9
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_jobs_kept_with_session(bash_tool):
+    bash_tool.keep_jobs("session")
+    await bash_tool(command="sleep 30", background=True)
+    await bash_tool.close()
+
+    # the tool of the next turn finds the job of the session
+    next_tool = type(bash_tool)()
+    next_tool.keep_jobs("session")
+    result = await next_tool(job_action="status", job_id=1)
+    assert "running" in result.system
+
+    # a restart keeps the jobs
+    await next_tool(restart=True)
+    result = await next_tool(job_action="status", job_id=1)
+    assert "running" in result.system
+
+    # the jobs end with the session
+    job = next_tool._jobs.get(1)
+    await close_session_jobs("session")
+    assert job.killed and job.done
+    assert _BashJobManager.for_session("session").list() == []
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_close_kills_jobs(bash_tool):
+    await bash_tool(command="echo 'in use'")
+    await bash_tool(command="sleep 30", background=True)
+    job = bash_tool._jobs.get(1)
+    session = bash_tool._session
+
+    await bash_tool.close()
+    assert job.killed and job.done
+    assert session._process.returncode is not None
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_finished_jobs_pruned(bash_tool):
+    with mock.patch.object(_BashJobManager, "_max_finished_jobs", 1):
+        for _ in range(3):
+            await bash_tool(command="true", background=True)
+            await bash_tool._jobs.list()[-1].wait(5)
+    assert [job.job_id for job in bash_tool._jobs.list()] == ["2", "3"]
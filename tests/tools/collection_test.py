@@ -0,0 +1,96 @@
+import asyncio
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from computer_use_demo.tools.base import (
+    BaseAnthropicTool,
+    ToolAccess,
+    ToolError,
+    ToolResult,
+)
+from computer_use_demo.tools.bash import BashTool20250124
+from computer_use_demo.tools.collection import ToolCollection
+from computer_use_demo.tools.edit import EditTool20250124
+
+
+class _FakeTool(BaseAnthropicTool):
+    """Records when each call starts and ends, the input names the resource it uses."""
+
+    def __init__(self, name: str, events: list[str]):
+        self.name = name
+        self.events = events
+
+    def to_params(self) -> Any:
+        return {"name": self.name, "type": "custom"}
+
+    def access(self, tool_input: dict[str, Any]) -> ToolAccess:
+        return ToolAccess(exclusive=frozenset({tool_input["resource"]}))
+
+    async def __call__(self, *, resource: str, label: str, delay: float = 0.05):
+        self.events.append(f"start {label}")
+        await asyncio.sleep(delay)
+        self.events.append(f"end {label}")
+        if label == "error":
+            raise ToolError("failed")
+        return ToolResult(output=label)
+
+
+def test_conflicts():
+    display = ToolAccess(exclusive=frozenset({"display"}))
+    read = ToolAccess(reads=frozenset({Path("/repo/src")}))
+    write = ToolAccess(writes=frozenset({Path("/repo/src/main.py")}))
+    assert display.conflicts_with(display)
+    assert not display.conflicts_with(read)
+    assert not read.conflicts_with(read)
+    assert read.conflicts_with(write)
+    assert write.conflicts_with(read)
+    assert write.conflicts_with(write)
+    assert not write.conflicts_with(ToolAccess(writes=frozenset({Path("/repo/doc")})))
+    assert ToolAccess(barrier=True).conflicts_with(ToolAccess())
+
+
+def test_builtin_tool_access():
+    edit_tool = EditTool20250124()
+    bash_tool = BashTool20250124()
+    view = edit_tool.access({"command": "view", "path": "/repo/a.py"})
+    other_view = edit_tool.access({"command": "view", "path": "/repo/b.py"})
+    edit = edit_tool.access({"command": "str_replace", "path": "/repo/a.py"})
+    bash = bash_tool.access({"command": "ls"})
+
+    assert not view.conflicts_with(other_view)
+    assert view.conflicts_with(edit)
+    assert not edit.conflicts_with(other_view)
+    assert not bash.conflicts_with(view)
+    assert bash.conflicts_with(edit)
+    assert bash.conflicts_with(bash)
+    # DISPLAY may have been exported by an earlier command
+    assert bash.conflicts_with(ToolAccess(exclusive=frozenset({"display"})))
+    assert not bash_tool.access({"job_action": "status", "job_id": 1}).conflicts_with(
+        ToolAccess(exclusive=frozenset({"display"}))
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_all():
+    events: list[str] = []
+    collection = ToolCollection(_FakeTool("fake", events))
+
+    results = await collection.run_all(
+        [
+            ("fake", {"resource": "display", "label": "a", "delay": 0.1}),
+            ("fake", {"resource": "bash", "label": "b"}),
+            ("fake", {"resource": "display", "label": "c"}),
+            ("missing", {}),
+            ("fake", {"resource": "bash", "label": "error"}),
+        ]
+    )
+
+    assert [result.output for result in results] == ["a", "b", "c", None, None]
+    assert results[3].error == "Tool missing is invalid"
+    assert results[4].error == "failed"
+    # b runs alongside a, c waits for a
+    assert events.index("start b") < events.index("end a")
+    assert events.index("end a") < events.index("start c")
+    assert events.index("end b") < events.index("start error")
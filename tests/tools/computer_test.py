@@ -55,6 +55,16 @@ async def test_computer_tool_screenshot(computer_tool):
         assert result.base64_image == "base64_screenshot"
 
 
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_without_scrot(computer_tool, tmp_path):
+    # neither gnome-screenshot nor scrot can be found
+    with (
+        patch.dict("os.environ", PATH=str(tmp_path)),
+        pytest.raises(ToolError, match="Failed to take screenshot: .*'scrot'"),
+    ):
+        await computer_tool(action="screenshot")
+
+
 @pytest.mark.asyncio
 async def test_computer_tool_scaling(computer_tool):
     computer_tool._scaling_enabled = True
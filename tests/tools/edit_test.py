@@ -1,3 +1,6 @@
+import asyncio
+import os
+import time
 from pathlib import Path
 from unittest.mock import patch
 
@@ -5,6 +8,7 @@ import pytest
 
 from computer_use_demo.tools.base import CLIResult, ToolError, ToolResult
 from computer_use_demo.tools.edit import EditTool20241022, EditTool20250124
+from computer_use_demo.tools.run import TRUNCATED_MESSAGE
 
 
 @pytest.fixture(params=[EditTool20241022, EditTool20250124])
@@ -30,9 +34,9 @@ async def test_view_command(edit_tool):
     with (
         patch("pathlib.Path.exists", return_value=True),
         patch("pathlib.Path.is_dir", return_value=True),
-        patch("computer_use_demo.tools.edit.run") as mock_run,
+        patch("computer_use_demo.tools.edit.DIRECTORY_LISTINGS.get") as mock_listing,
     ):
-        mock_run.return_value = (None, "file1.txt\nfile2.txt", None)
+        mock_listing.return_value = "file1.txt\nfile2.txt"
         result = await edit_tool(command="view", path="/test/dir")
         assert isinstance(result, CLIResult)
         assert result.output
@@ -78,19 +82,16 @@ async def test_view_command(edit_tool):
 
 
 @pytest.mark.asyncio
-async def test_create_command(edit_tool):
+async def test_create_command(edit_tool, tmp_path):
     # Test creating a new file with content
-    with (
-        patch("pathlib.Path.exists", return_value=False),
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        result = await edit_tool(
-            command="create", path="/test/newfile.txt", file_text="New file content"
-        )
-        assert isinstance(result, ToolResult)
-        assert result.output
-        assert "File created successfully" in result.output
-        mock_write_text.assert_called_once_with("New file content")
+    path = tmp_path / "newfile.txt"
+    result = await edit_tool(
+        command="create", path=str(path), file_text="New file content"
+    )
+    assert isinstance(result, ToolResult)
+    assert result.output
+    assert "File created successfully" in result.output
+    assert path.read_text() == "New file content"
 
     # Test attempting to create a file without content
     with patch("pathlib.Path.exists", return_value=False):
@@ -106,25 +107,20 @@ async def test_create_command(edit_tool):
 
 
 @pytest.mark.asyncio
-async def test_str_replace_command(edit_tool):
+async def test_str_replace_command(edit_tool, tmp_path):
     # Test replacing a unique string in a file
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Original content"
-        result = await edit_tool(
-            command="str_replace",
-            path="/test/file.txt",
-            old_str="Original",
-            new_str="New",
-        )
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "has been edited" in result.output
-        mock_write_text.assert_called_once_with("New content")
+    path = tmp_path / "file.txt"
+    path.write_text("Original content")
+    result = await edit_tool(
+        command="str_replace",
+        path=str(path),
+        old_str="Original",
+        new_str="New",
+    )
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "has been edited" in result.output
+    assert path.read_text() == "New content"
 
     # Test attempting to replace a non-existent string
     with (
@@ -158,77 +154,54 @@ async def test_str_replace_command(edit_tool):
 
     edit_tool._file_history.clear()
     # Verify that the file history is updated after replacement
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text"),
-    ):
-        mock_read_text.return_value = "Original content"
-        await edit_tool(
-            command="str_replace",
-            path="/test/file.txt",
-            old_str="Original",
-            new_str="New",
-        )
-        assert edit_tool._file_history[Path("/test/file.txt")] == ["Original content"]
+    path.write_text("Original content")
+    await edit_tool(
+        command="str_replace",
+        path=str(path),
+        old_str="Original",
+        new_str="New",
+    )
+    assert edit_tool._file_history[path] == ["Original content"]
 
 
 @pytest.mark.asyncio
-async def test_insert_command(edit_tool):
+async def test_insert_command(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
     # Test inserting a string at a valid line number
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Line 1\nLine 2\nLine 3"
-        result = await edit_tool(
-            command="insert", path="/test/file.txt", insert_line=2, new_str="New Line"
-        )
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "has been edited" in result.output
-        mock_write_text.assert_called_once_with("Line 1\nLine 2\nNew Line\nLine 3")
+    path.write_text("Line 1\nLine 2\nLine 3")
+    result = await edit_tool(
+        command="insert", path=str(path), insert_line=2, new_str="New Line"
+    )
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "has been edited" in result.output
+    assert path.read_text() == "Line 1\nLine 2\nNew Line\nLine 3"
 
     # Test inserting a string at the beginning of the file (line 0)
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Line 1\nLine 2"
-        result = await edit_tool(
-            command="insert",
-            path="/test/file.txt",
-            insert_line=0,
-            new_str="New First Line",
-        )
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "has been edited" in result.output
-        mock_write_text.assert_called_once_with("New First Line\nLine 1\nLine 2")
+    path.write_text("Line 1\nLine 2")
+    result = await edit_tool(
+        command="insert",
+        path=str(path),
+        insert_line=0,
+        new_str="New First Line",
+    )
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "has been edited" in result.output
+    assert path.read_text() == "New First Line\nLine 1\nLine 2"
 
     # Test inserting a string at the end of the file
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Line 1\nLine 2"
-        result = await edit_tool(
-            command="insert",
-            path="/test/file.txt",
-            insert_line=2,
-            new_str="New Last Line",
-        )
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "has been edited" in result.output
-        mock_write_text.assert_called_once_with("Line 1\nLine 2\nNew Last Line")
+    path.write_text("Line 1\nLine 2")
+    result = await edit_tool(
+        command="insert",
+        path=str(path),
+        insert_line=2,
+        new_str="New Last Line",
+    )
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "has been edited" in result.output
+    assert path.read_text() == "Line 1\nLine 2\nNew Last Line"
 
     # Test attempting to insert at an invalid line number
     with (
@@ -247,60 +220,37 @@ async def test_insert_command(edit_tool):
 
     # Verify that the file history is updated after insertion
     edit_tool._file_history.clear()
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text"),
-    ):
-        mock_read_text.return_value = "Original content"
-        await edit_tool(
-            command="insert", path="/test/file.txt", insert_line=1, new_str="New Line"
-        )
-        assert edit_tool._file_history[Path("/test/file.txt")] == ["Original content"]
+    path.write_text("Original content")
+    await edit_tool(command="insert", path=str(path), insert_line=1, new_str="New Line")
+    assert edit_tool._file_history[path] == ["Original content"]
 
 
 @pytest.mark.asyncio
-async def test_undo_edit_command(edit_tool):
+async def test_undo_edit_command(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
     # Test undoing a str_replace operation
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Original content"
-        await edit_tool(
-            command="str_replace",
-            path="/test/file.txt",
-            old_str="Original",
-            new_str="New",
-        )
-        mock_read_text.return_value = "New content"
-        result = await edit_tool(command="undo_edit", path="/test/file.txt")
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "Last edit to /test/file.txt undone successfully" in result.output
-        mock_write_text.assert_called_with("Original content")
+    path.write_text("Original content")
+    await edit_tool(
+        command="str_replace",
+        path=str(path),
+        old_str="Original",
+        new_str="New",
+    )
+    result = await edit_tool(command="undo_edit", path=str(path))
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert f"Last edit to {path} undone successfully" in result.output
+    assert path.read_text() == "Original content"
 
     # Test undoing an insert operation
     edit_tool._file_history.clear()
-    with (
-        patch("pathlib.Path.exists", return_value=True),
-        patch("pathlib.Path.is_dir", return_value=False),
-        patch("pathlib.Path.read_text") as mock_read_text,
-        patch("pathlib.Path.write_text") as mock_write_text,
-    ):
-        mock_read_text.return_value = "Line 1\nLine 2"
-        await edit_tool(
-            command="insert", path="/test/file.txt", insert_line=1, new_str="New Line"
-        )
-        mock_read_text.return_value = "Line 1\nNew Line\nLine 2"
-        result = await edit_tool(command="undo_edit", path="/test/file.txt")
-        assert isinstance(result, CLIResult)
-        assert result.output
-        assert "Last edit to /test/file.txt undone successfully" in result.output
-        mock_write_text.assert_called_with("Line 1\nLine 2")
+    path.write_text("Line 1\nLine 2")
+    await edit_tool(command="insert", path=str(path), insert_line=1, new_str="New Line")
+    result = await edit_tool(command="undo_edit", path=str(path))
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert f"Last edit to {path} undone successfully" in result.output
+    assert path.read_text() == "Line 1\nLine 2"
 
     # Test attempting to undo when there's no history
     edit_tool._file_history.clear()
@@ -349,3 +299,254 @@ async def test_validate_path(edit_tool):
         patch("pathlib.Path.is_dir", return_value=True),
     ):
         edit_tool.validate_path("view", Path("/directory/path"))
+
+
+@pytest.mark.asyncio
+async def test_view_range_uses_line_index(edit_tool, tmp_path):
+    path = tmp_path / "large.log"
+    path.write_text("".join(f"line {i}\r\n" for i in range(1, 1001)))
+
+    with patch("pathlib.Path.read_text") as mock_read_text:
+        result = await edit_tool(command="view", path=str(path), view_range=[500, 502])
+        mock_read_text.assert_not_called()
+    assert "\n   500\tline 500\n   501\tline 501\n   502\tline 502\n" in result.output
+
+    result = await edit_tool(command="view", path=str(path), view_range=[1000, -1])
+    assert result.output.endswith("  1000\tline 1000\n  1001\t\n")
+    with pytest.raises(ToolError, match="should be smaller than the number of lines"):
+        await edit_tool(command="view", path=str(path), view_range=[1, 1002])
+
+    # the index is rebuilt once the file is edited
+    await edit_tool(command="insert", path=str(path), insert_line=0, new_str="first")
+    result = await edit_tool(command="view", path=str(path), view_range=[1, 2])
+    assert "     1\tfirst\n     2\tline 1\n" in result.output
+
+
+@pytest.mark.asyncio
+async def test_insert_validates_line_with_index(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("Line 1\nLine 2")
+    with patch("pathlib.Path.read_text") as mock_read_text:
+        with pytest.raises(ToolError, match=r"range of lines of the file: \[0, 2\]"):
+            await edit_tool(
+                command="insert", path=str(path), insert_line=3, new_str="x"
+            )
+        mock_read_text.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_undo_with_persisted_history(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("Line 1\nLine 2")
+    history_dir = tmp_path / "history"
+    edit_tool.persist_history(history_dir)
+    await edit_tool(command="insert", path=str(path), insert_line=1, new_str="New")
+    await edit_tool(
+        command="str_replace", path=str(path), old_str="Line 2", new_str="Last"
+    )
+
+    # a new editor of the same session can undo the edits of the previous one
+    next_tool = type(edit_tool)()
+    next_tool.persist_history(history_dir)
+    await next_tool(command="undo_edit", path=str(path))
+    assert path.read_text() == "Line 1\nNew\nLine 2"
+    await next_tool(command="undo_edit", path=str(path))
+    assert path.read_text() == "Line 1\nLine 2"
+    with pytest.raises(ToolError, match="No edit history found"):
+        await next_tool(command="undo_edit", path=str(path))
+
+
+@pytest.mark.asyncio
+async def test_multi_edit_command(edit_tool, tmp_path):
+    path = tmp_path / "file.py"
+    path.write_text("def f():\n\treturn 1\n\n\ndef g():\n    return 2\n")
+    path.chmod(0o750)
+
+    result = await edit_tool(
+        command="multi_edit",
+        path=str(path),
+        edits=[
+            {"old_str": "return 1", "new_str": "return 10"},
+            {"old_str": "def g():", "new_str": "def h():"},
+            {"insert_line": 0, "new_str": "import os"},
+        ],
+    )
+    assert isinstance(result, CLIResult)
+    assert result.output
+    assert "has been edited with 3 edits" in result.output
+    assert "-        return 1\n+        return 10\n" in result.output
+    assert "+import os\n" in result.output
+    assert path.read_text() == (
+        "import os\ndef f():\n        return 10\n\n\ndef h():\n    return 2\n"
+    )
+    assert path.stat().st_mode & 0o777 == 0o750
+    assert [p.name for p in tmp_path.iterdir()] == ["file.py"]
+
+    # the whole batch is a single undo entry
+    await edit_tool(command="undo_edit", path=str(path))
+    assert (
+        path.read_text() == "def f():\n        return 1\n\n\ndef g():\n    return 2\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_multi_edit_is_atomic(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("a\nb\n")
+
+    with pytest.raises(ToolError, match="edit 2 of 2 failed: No replacement"):
+        await edit_tool(
+            command="multi_edit",
+            path=str(path),
+            edits=[
+                {"old_str": "a", "new_str": "c"},
+                {"old_str": "a", "new_str": "d"},
+            ],
+        )
+    with pytest.raises(ToolError, match="edit 1 of 1 failed: Invalid `insert_line`"):
+        await edit_tool(
+            command="multi_edit",
+            path=str(path),
+            edits=[{"insert_line": 4, "new_str": "x"}],
+        )
+    with pytest.raises(ToolError, match="Parameter `edits` is required"):
+        await edit_tool(command="multi_edit", path=str(path))
+    assert path.read_text() == "a\nb\n"
+    with pytest.raises(ToolError, match="No edit history found"):
+        await edit_tool(command="undo_edit", path=str(path))
+
+
+@pytest.mark.asyncio
+async def test_diff_result_format(edit_tool, tmp_path, monkeypatch):
+    monkeypatch.setattr(edit_tool, "result_format", "diff")
+    path = tmp_path / "file.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 101)))
+
+    result = await edit_tool(
+        command="str_replace", path=str(path), old_str="line 50\n", new_str="fifty\n"
+    )
+    assert result.output == (
+        f"The file {path} has been edited. Here's the diff:\n"
+        "@@ -49,3 +49,3 @@\n line 49\n-line 50\n+fifty\n line 51\n"
+    )
+    result = await edit_tool(
+        command="insert", path=str(path), insert_line=1, new_str="inserted"
+    )
+    assert result.output.endswith("@@ -1,2 +1,3 @@\n line 1\n+inserted\n line 2\n")
+
+    result = await edit_tool(command="undo_edit", path=str(path))
+    assert result.output == (
+        f"Last edit to {path} undone successfully. Here's the diff:\n"
+        "@@ -1,3 +1,2 @@\n line 1\n-inserted\n line 2\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_undo_shows_reverted_lines_only(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 1001)))
+    await edit_tool(
+        command="str_replace", path=str(path), old_str="line 500\n", new_str=""
+    )
+
+    result = await edit_tool(command="undo_edit", path=str(path))
+    assert "   500\tline 500\n" in result.output
+    assert "   495\t" not in result.output
+    assert "   505\t" not in result.output
+
+
+@pytest.mark.asyncio
+async def test_edit_result_is_capped(edit_tool, tmp_path, monkeypatch):
+    monkeypatch.setattr(edit_tool, "max_result_bytes", 100)
+    path = tmp_path / "file.txt"
+    path.write_text("old\n")
+
+    result = await edit_tool(
+        command="str_replace", path=str(path), old_str="old", new_str="ü" * 200
+    )
+    assert result.output.endswith(TRUNCATED_MESSAGE)
+    assert len(result.output.removesuffix(TRUNCATED_MESSAGE).encode()) <= 100
+
+
+@pytest.mark.asyncio
+async def test_search_command(edit_tool, tmp_path):
+    (tmp_path / "file.py").write_text("def f():\n    return 1\n")
+
+    result = await edit_tool(command="search", path=str(tmp_path), query="return")
+    assert isinstance(result, CLIResult)
+    assert f"{tmp_path}/file.py:2:    return 1\n" in result.output
+    with pytest.raises(ToolError, match="Parameter `query` is required"):
+        await edit_tool(command="search", path=str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_commands_run_off_the_event_loop(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    def slow_view(*args):
+        time.sleep(0.2)
+        return CLIResult(output="viewed")
+
+    ticker = asyncio.create_task(tick())
+    with patch.object(edit_tool, "view", side_effect=slow_view):
+        result = await edit_tool(command="view", path=str(path))
+    ticker.cancel()
+    assert result.output == "viewed"
+    assert ticks >= 5
+
+
+@pytest.mark.asyncio
+async def test_concurrent_edits_are_serialized(edit_tool, tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("")
+
+    await asyncio.gather(
+        *(
+            edit_tool(
+                command="insert", path=str(path), insert_line=0, new_str=f"line {i}"
+            )
+            for i in range(20)
+        )
+    )
+    assert sorted(path.read_text().split("\n")) == sorted(
+        [""] + [f"line {i}" for i in range(20)]
+    )
+    assert len(edit_tool._file_history[path]) == 20
+
+
+@pytest.mark.asyncio
+async def test_writes_replace_the_file(edit_tool, tmp_path):
+    path = tmp_path / "script.sh"
+    path.write_text("echo one\n")
+    path.chmod(0o755)
+    link = tmp_path / "link.sh"
+    link.symlink_to(path)
+    with open(path) as reader:
+        await edit_tool(
+            command="str_replace", path=str(link), old_str="one", new_str="two"
+        )
+        # a reader of the old file never sees a partial write
+        assert reader.read() == "echo one\n"
+
+    assert link.is_symlink()
+    assert path.read_text() == "echo two\n"
+    assert path.stat().st_mode & 0o777 == 0o755
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["link.sh", "script.sh"]
+
+
+async def test_created_files_follow_the_umask(edit_tool, tmp_path):
+    path = tmp_path / "new.txt"
+    umask = os.umask(0o027)
+    try:
+        await edit_tool(command="create", path=str(path), file_text="text\n")
+    finally:
+        os.umask(umask)
+    assert path.stat().st_mode & 0o777 == 0o640
@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from computer_use_demo.tools.history import EditHistory, Patch, remove_stale_histories
+
+PATH = Path("/test/file.txt")
+
+
+@pytest.mark.parametrize(
+    "source,target",
+    [
+        ("", ""),
+        ("abc", "abc"),
+        ("", "new"),
+        ("old", ""),
+        ("aaa", "aaaa"),
+        ("line 1\nline 2\n", "line 1\nnew line\nline 2\n"),
+        ("x" * 200_000 + "a" + "y" * 200_000, "x" * 200_000 + "b" + "y" * 200_000),
+    ],
+)
+def test_patch_between(source, target):
+    patch = Patch.between(source, target)
+    assert patch.apply(source) == target
+    assert len(patch.replacement) <= len(target)
+
+
+def test_undo_restores_each_version():
+    history = EditHistory()
+    versions = ["one\n", "one\ntwo\n", "one\n2\n", "zero\none\n2\n"]
+    for old_text, new_text in zip(versions, versions[1:]):
+        history.push(PATH, old_text, new_text)
+
+    assert history[PATH] == versions[:-1]
+    for version in reversed(versions[:-1]):
+        assert history.pop(PATH) == version
+    assert history.pop(PATH) is None
+
+
+def test_undo_after_external_change():
+    history = EditHistory()
+    history.push(PATH, "original", "edited")
+    # the file was changed outside of the editor before the next edit
+    history.push(PATH, "edited elsewhere", "edited again")
+
+    assert history.pop(PATH) == "edited elsewhere"
+    assert history.pop(PATH) == "original"
+
+
+def test_history_is_bounded(monkeypatch):
+    monkeypatch.setattr(EditHistory, "max_file_size", 1_000)
+    monkeypatch.setattr(EditHistory, "max_total_size", 1_700)
+    history = EditHistory()
+    versions = ["a" * 500 + char * 100 for char in "bcdefghijk"]
+    for old_text, new_text in zip(versions, versions[1:]):
+        history.push(PATH, old_text, new_text)
+    assert history.size() <= 1_000
+    assert history[PATH] == versions[-len(history[PATH]) - 1 : -1]
+    assert len(history[PATH]) < 9
+
+    other = Path("/test/other.txt")
+    history.push(other, "", "x" * 800)
+    assert history.size() <= 1_700
+    # the oldest edits of any file are dropped first, the most recent never
+    assert history[other] == [""]
+    assert history[PATH] == [versions[-2]]
+
+
+def test_history_persists(tmp_path):
+    history_dir = tmp_path / "history" / "session"
+    history = EditHistory(history_dir)
+    history.push(PATH, "original", "edited")
+    history.push(PATH, "edited", "edited twice")
+    other = Path("/test/other.txt")
+    history.push(other, "", "other")
+
+    # each file's history is saved on its own
+    assert len(list(history_dir.glob("*.json"))) == 2
+    restored = EditHistory(history_dir)
+    assert restored.pop(PATH) == "edited"
+    assert EditHistory(history_dir)[PATH] == ["original"]
+    restored.pop(other)
+    assert len(list(history_dir.glob("*.json"))) == 1
+
+    # histories are only read once their file is looked up
+    lazy = EditHistory(history_dir)
+    assert lazy.size() == 0
+    assert lazy[PATH] == ["original"]
+    assert lazy.size() > 0
+
+    # a history that can't be read is dropped
+    history_file = next(history_dir.glob("*.json"))
+    for content in ("not json", '{"path": "/test/file.txt"}', "[1, 2]"):
+        history_file.write_text(content)
+        assert EditHistory(history_dir)[PATH] == []
+
+
+def test_remove_stale_histories(tmp_path):
+    stale, fresh = tmp_path / "stale", tmp_path / "fresh"
+    EditHistory(stale).push(PATH, "original", "edited")
+    EditHistory(fresh).push(PATH, "original", "edited")
+    os.utime(stale, (0, 0))
+
+    remove_stale_histories(tmp_path, max_age=3600)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["fresh"]
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools.listing import DirectoryListingCache, list_directory
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "src" / "main.py").write_text("")
+    (tmp_path / "src" / "pkg" / "deep.py").write_text("")
+    (tmp_path / "src" / ".cache").mkdir()
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "README.md").write_text("")
+    # old enough to be cached
+    for path in (tmp_path, tmp_path / "src"):
+        os.utime(path, ns=(0, 10**9))
+    return tmp_path
+
+
+def test_list_directory(tree):
+    assert list_directory(tree).text.split("\n") == [
+        str(tree),
+        f"{tree}/README.md",
+        f"{tree}/src (1 file, 1 directory)",
+        f"{tree}/src/main.py",
+        f"{tree}/src/pkg",
+    ]
+
+
+def test_list_directory_stops_after_max_entries(tree):
+    assert list_directory(tree, max_entries=3).text.split("\n") == [
+        str(tree),
+        f"{tree}/README.md",
+        f"{tree}/src (1 file, 1 directory)",
+        f"{tree}/src/main.py",
+        "... stopped after 3 entries, view a subdirectory to see more",
+    ]
+    # exactly as many entries as allowed, nothing was left out
+    assert list_directory(tree, max_entries=4).text == list_directory(tree).text
+
+
+def test_listing_cache(tree, monkeypatch):
+    cache = DirectoryListingCache()
+    listing = cache.get(tree)
+
+    walks = []
+    monkeypatch.setattr(os, "scandir", lambda path: walks.append(path) or [])
+    assert cache.get(tree) == listing
+    assert not walks
+    monkeypatch.undo()
+
+    # adding a file to a subdirectory changes its mtime
+    (tree / "src" / "new.py").write_text("")
+    assert f"{tree}/src/new.py" in cache.get(tree)
+    # recently modified directories aren't cached
+    (tree / "src" / "newer.py").write_text("")
+    assert f"{tree}/src/newer.py" in cache.get(tree)
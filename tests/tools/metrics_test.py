@@ -0,0 +1,78 @@
+from computer_use_demo.tools.bash import BashTool20250124, close_bash_sessions
+from computer_use_demo.tools.collection import ToolCollection
+from computer_use_demo.tools.metrics import (
+    REGISTRY,
+    TOOL_ERRORS,
+    TOOL_SECONDS,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+)
+
+
+def test_render():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests.", ["path"], registry=registry)
+    active = Gauge("active", "Active things.", registry=registry)
+    requests.inc(path="/a")
+    requests.inc(2, path='/"b"')
+    with active.track():
+        active.inc()
+        assert registry.render() == "\n".join(
+            [
+                "# HELP requests_total Requests.",
+                "# TYPE requests_total counter",
+                'requests_total{path="/\\"b\\""} 2',
+                'requests_total{path="/a"} 1',
+                "# HELP active Active things.",
+                "# TYPE active gauge",
+                "active 2",
+                "",
+            ]
+        )
+    assert "active 1" in registry.render()
+
+
+def test_histogram_buckets():
+    registry = Registry()
+    latency = Histogram(
+        "latency_seconds", "Latency.", ["tool"], buckets=(0.1, 1), registry=registry
+    )
+    for value in (0.05, 0.5, 0.5, 3):
+        latency.observe(value, tool="bash")
+    assert list(latency.samples()) == [
+        'latency_seconds_bucket{tool="bash",le="0.1"} 1',
+        'latency_seconds_bucket{tool="bash",le="1"} 3',
+        'latency_seconds_bucket{tool="bash",le="+Inf"} 4',
+        'latency_seconds_sum{tool="bash"} 4.05',
+        'latency_seconds_count{tool="bash"} 4',
+    ]
+
+
+def test_disabled_registry():
+    registry = Registry(enabled=False)
+    calls = Counter("calls_total", "Calls.", registry=registry)
+    latency = Histogram("latency_seconds", "Latency.", registry=registry)
+    calls.inc()
+    with latency.time():
+        pass
+    assert list(calls.samples()) == []
+    assert list(latency.samples()) == []
+
+
+async def test_collection_records_tool_calls(monkeypatch):
+    monkeypatch.setattr(REGISTRY, "enabled", True)
+    monkeypatch.setattr(TOOL_SECONDS, "_values", {})
+    monkeypatch.setattr(TOOL_ERRORS, "_values", {})
+    collection = ToolCollection(BashTool20250124())
+    try:
+        await collection.run(name="bash", tool_input={"command": "echo hello"})
+        await collection.run(name="missing", tool_input={})
+    finally:
+        await collection.run(name="bash", tool_input={"restart": True})
+        await close_bash_sessions()
+    rendered = REGISTRY.render()
+    assert 'tool_duration_seconds_count{tool="bash",action="command"} 1' in rendered
+    assert 'tool_duration_seconds_count{tool="bash",action="restart"} 1' in rendered
+    assert 'tool_errors_total{tool="missing"} 1' in rendered
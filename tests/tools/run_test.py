@@ -0,0 +1,148 @@
+import asyncio
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+from computer_use_demo.tools.proc import (
+    REAPER_COUNTERS,
+    _check_leaked,
+    process_children,
+    sample_process,
+    sample_process_tree,
+)
+from computer_use_demo.tools.run import (
+    TRUNCATED_MESSAGE,
+    run,
+    run_exec,
+    split_command,
+)
+
+
+def _running_commands(cmdline: str):
+    running = []
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                command = f.read().replace(b"\0", b" ").strip().decode()
+            with open(f"/proc/{pid}/stat") as f:
+                state = f.read().rsplit(")", 1)[1].split()[0]
+        except OSError:
+            continue
+        if command == cmdline and state != "Z":
+            running.append(int(pid))
+    return running
+
+
+def test_split_command():
+    assert split_command("DISPLAY=:1 xdotool type -- 'Hello, World!'") == (
+        ["xdotool", "type", "--", "Hello, World!"],
+        {"DISPLAY": ":1"},
+    )
+    assert split_command("convert a.png -resize 10x10! a.png") == (
+        ["convert", "a.png", "-resize", "10x10!", "a.png"],
+        {},
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_exec():
+    returncode, stdout, stderr, usage = await run_exec(
+        ["sh", "-c", "echo $GREETING; echo oops >&2; exit 3"],
+        env={"GREETING": "hello"},
+    )
+    assert returncode == 3
+    assert stdout == "hello\n"
+    assert stderr == "oops\n"
+    assert usage.wall_time > 0
+
+
+@pytest.mark.asyncio
+async def test_run_exec_missing_program():
+    returncode, stdout, stderr, _ = await run_exec(["no-such-program", "--version"])
+    assert returncode == 127
+    assert stdout == ""
+    assert "No such file or directory: 'no-such-program'" in stderr
+
+
+@pytest.mark.asyncio
+async def test_run_exec_usage_is_per_command():
+    busy = ["python3", "-c", "sum(range(3 * 10**7))"]
+    (_, _, _, busy_usage), (_, _, _, idle_usage) = await asyncio.gather(
+        run_exec(busy), run_exec(["sleep", "1.5"])
+    )
+    assert busy_usage.user_time > 0.1
+    # the busy command exits and is reaped while the idle one still runs
+    assert idle_usage.user_time < 0.1
+
+
+@pytest.mark.asyncio
+async def test_run_exec_caps_output():
+    _, stdout, _, _ = await run_exec(["seq", "1", "1000000"], truncate_after=100)
+    assert stdout == "".join(f"{i}\n" for i in range(1, 100))[:100] + TRUNCATED_MESSAGE
+
+    # a command writing without end is killed once it passes the cap
+    returncode, stdout, _, _ = await asyncio.wait_for(
+        run_exec(["yes"], truncate_after=100), 5
+    )
+    assert returncode == -9
+    assert stdout == "y\n" * 50 + TRUNCATED_MESSAGE
+
+
+@pytest.mark.asyncio
+async def test_run_exec_timeout():
+    with pytest.raises(TimeoutError, match="timed out after 0.1 seconds"):
+        await run_exec(["sh", "-c", "sleep 10 & sleep 10"], timeout=0.1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("timeout", [0.2, None])
+async def test_run_reaps_process_tree(timeout):
+    reaped = REAPER_COUNTERS.reaped
+    # the second sleep leaves the process group, it is still a descendant though
+    command = run("sleep 37 & setsid sleep 37 & sleep 37", timeout=timeout)
+    if timeout:
+        with pytest.raises(TimeoutError):
+            await command
+    else:
+        task = asyncio.create_task(command)
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    await asyncio.sleep(0.1)
+    assert REAPER_COUNTERS.reaped - reaped == 4
+    assert _running_commands("sleep 37") == []
+
+
+def test_leak_check_ignores_reused_pids():
+    leaked = REAPER_COUNTERS.leaked
+    with open(f"/proc/{os.getpid()}/stat") as f:
+        starttime = f.read().rsplit(")", 1)[1].split()[19]
+    _check_leaked({os.getpid(): starttime})
+    assert REAPER_COUNTERS.leaked - leaked == 1
+    # another process that was given the pid of a killed one
+    _check_leaked({os.getpid(): "0"})
+    assert REAPER_COUNTERS.leaked - leaked == 1
+
+
+def test_sample_process_tree():
+    # a shell with a child that doesn't share its process group
+    process = subprocess.Popen(["sh", "-c", "setsid sleep 5 & wait"])
+    time.sleep(0.2)
+    children = process_children(process.pid)
+    try:
+        if children is None:
+            pytest.skip("the kernel doesn't list the children of processes")
+        assert len(children) == 1
+        sample = sample_process_tree(process.pid)
+        shell = sample_process(process.pid)
+        assert sample is not None and shell is not None
+        assert sample.max_rss_kb > shell.max_rss_kb
+    finally:
+        for child in children or []:
+            os.kill(child, signal.SIGKILL)
+        process.wait()
+    assert sample_process_tree(process.pid) is None
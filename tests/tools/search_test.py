@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools import search as search_module
+from computer_use_demo.tools.search import TrigramIndex, TrigramIndexCache, search
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "parser.py").write_text(
+        "import re\n\n\ndef parse(text):\n    return Parser(text).parse()\n"
+    )
+    (tmp_path / "src" / "main.py").write_text("from parser import parse\n")
+    (tmp_path / "README.md").write_text("Run the parser on a file.\n")
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG\0parser")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "parser").write_text("parser")
+    return tmp_path
+
+
+def test_index_candidates(repo):
+    index = TrigramIndex(repo)
+    index.update()
+    assert index.candidates("parser") == [
+        f"{repo}/README.md",
+        f"{repo}/src/main.py",
+        f"{repo}/src/parser.py",
+    ]
+    assert index.candidates("return") == [f"{repo}/src/parser.py"]
+    assert index.candidates("missing") == []
+
+    (repo / "src" / "main.py").write_text("print('hello')\n")
+    os.utime(repo / "src" / "main.py", ns=(0, 1))
+    (repo / "README.md").unlink()
+    (repo / "src" / "new.py").write_text("Parser()\n")
+    # the last walk is trusted for a while, except for the paths invalidated
+    index.invalidate(f"{repo}/src/new.py")
+    index.invalidate(f"{repo}/.git/parser")
+    index.update()
+    assert index.candidates("parser") == [
+        f"{repo}/README.md",
+        f"{repo}/src/main.py",
+        f"{repo}/src/new.py",
+        f"{repo}/src/parser.py",
+    ]
+    index.update_interval = 0
+    index.update()
+    assert index.candidates("parser") == [
+        f"{repo}/src/new.py",
+        f"{repo}/src/parser.py",
+    ]
+    # the ids of the files removed or changed are dropped
+    index._compact()
+    assert None not in index._paths
+    assert index.candidates("parser") == [
+        f"{repo}/src/new.py",
+        f"{repo}/src/parser.py",
+    ]
+
+
+def test_index_over_budget(repo):
+    index = TrigramIndex(repo, max_bytes=1000)
+    index.update()
+    # every text file is a candidate, the search scans them
+    assert index.candidates("return") == [
+        f"{repo}/README.md",
+        f"{repo}/src/main.py",
+        f"{repo}/src/parser.py",
+    ]
+
+
+def test_search(repo):
+    assert search(repo, "parse", context=0) == (
+        f"Found 4 matches for `parse` in {repo}:\n"
+        f"{repo}/src/parser.py:4:def parse(text):\n"
+        f"{repo}/src/parser.py:5:    return Parser(text).parse()\n"
+        "--\n"
+        f"{repo}/src/main.py:1:from parser import parse\n"
+        "--\n"
+        f"{repo}/README.md:1:Run the parser on a file.\n"
+    )
+    # uppercase makes the search case-sensitive
+    assert search(repo, "Parser", context=1) == (
+        f"Found 1 matches for `Parser` in {repo}:\n"
+        f"{repo}/src/parser.py-4-def parse(text):\n"
+        f"{repo}/src/parser.py:5:    return Parser(text).parse()\n"
+        f"{repo}/src/parser.py-6-\n"
+    )
+    assert search(repo / "src" / "main.py", "import", context=0) == (
+        f"Found 1 matches for `import` in {repo}/src/main.py:\n"
+        f"{repo}/src/main.py:1:from parser import parse\n"
+    )
+    assert search(repo, "nothing") == f"No matches found for `nothing` in {repo}."
+
+
+def test_search_over_budget(repo, monkeypatch):
+    monkeypatch.setattr(search_module, "SEARCH_INDEXES", TrigramIndexCache(1, 1000))
+    assert search(repo, "import re", context=0) == (
+        f"Found 1 matches for `import re` in {repo}:\n"
+        f"{repo}/src/parser.py:1:import re\n"
+    )
+
+
+def test_search_caps_results(tmp_path):
+    (tmp_path / "file.txt").write_text("match\n" * 100)
+    result = search(tmp_path, "match", max_results=3, context=1)
+    assert result.startswith(
+        f"Found 100 matches for `match` in {tmp_path}, showing the best 3:\n"
+    )
+    assert result.endswith(f"{tmp_path}/file.txt-4-match\n")
+    assert result.count("\n") == 5
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import pytest
+
+from computer_use_demo.tools import tracing
+from computer_use_demo.tools.tracing import span, trace
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+async def test_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_DIR", tmp_path)
+
+    async def call(label: str):
+        with span("tool", action=label):
+            await asyncio.sleep(0.01)
+
+    with trace("session", user="a") as attributes:
+        attributes["turn"] = 1
+        with span("model"):
+            await asyncio.sleep(0.02)
+        with span("tools"):
+            # tasks inherit the open span
+            await asyncio.gather(call("a"), call("b"))
+        with pytest.raises(ValueError), span("db"):
+            raise ValueError
+
+    records = _records(tmp_path / "session.jsonl")
+    by_name = {record["name"]: record for record in records}
+    root = by_name["turn"]
+    assert root["parent"] is None
+    assert root["attributes"] == {"user": "a", "turn": 1}
+    assert {record["trace"] for record in records} == {root["trace"]}
+    assert by_name["model"]["parent"] == root["span"]
+    assert by_name["model"]["duration_ms"] >= 20
+    tools = [record for record in records if record["name"] == "tool"]
+    assert [record["parent"] for record in tools] == [by_name["tools"]["span"]] * 2
+    assert by_name["db"]["attributes"] == {"error": "ValueError"}
+
+    with trace("session"):
+        pass
+    assert len(_records(tmp_path / "session.jsonl")) == len(records) + 1
+
+
+def test_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_DIR", None)
+    with trace("session"), span("model") as attributes:
+        attributes["tokens"] = 1
+    with span("orphan"):
+        pass
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from computer_use_demo.tools.metrics import EVENT_LOOP_LAG_SECONDS, REGISTRY
+from computer_use_demo.tools.watchdog import LoopWatchdog
+
+
+def _blocking_call():
+    time.sleep(0.3)
+
+
+async def test_watchdog(monkeypatch, caplog):
+    monkeypatch.setattr(REGISTRY, "enabled", True)
+    monkeypatch.setattr(EVENT_LOOP_LAG_SECONDS, "_values", {})
+    monkeypatch.setattr(LoopWatchdog, "threshold", 0.05)
+    monkeypatch.setattr(LoopWatchdog, "interval", 0.01)
+    watchdog = LoopWatchdog()
+    task = asyncio.create_task(watchdog.run())
+    await asyncio.sleep(0.05)
+    assert not watchdog.blocked
+
+    _blocking_call()
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    # reported once, while it was still blocking
+    [blocked] = watchdog.blocked
+    assert 0.05 <= blocked.lag < 0.3
+    assert "_blocking_call" in blocked.stack
+    assert "Event loop blocked" in caplog.text
+    [counts] = EVENT_LOOP_LAG_SECONDS._values.values()
+    assert counts[-1] >= 0.25